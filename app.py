@@ -1,35 +1,99 @@
 """
 File that contains the main application.
 """
-from typing import List
+from typing import TYPE_CHECKING, List
 
 import streamlit as st
 from langchain.docstore.document import Document
 
-from src.logic.keyword_generation import KeywordGenerator
-from src.data.sources.news_extraction import NewsExtractor
-from src.logic.risk_analysis import RiskAnalysis
-from src.logic.feedback_loop import FeedbackLoop
-from src.logic.helper_functionality.news_check.news_checklist import NewsChecklist
-from src.logic.helper_functionality.text_summarization import TextSummarizer
-from src.logic.helper_functionality.document_indexation import Indexer
+from src.logic.helper_functionality.llm_cache import install_llm_cache
+from src.logic.helper_functionality.tracing import METRICS_PATH, TRACES_PATH, install_tracer
 
 import src.logic.config.secrets as config_secrets
 
+if TYPE_CHECKING:
+    from src.logic.keyword_generation import KeywordGenerator
+    from src.data.sources.news_extraction import NewsExtractor
+    from src.logic.risk_analysis import RiskAnalysis
+    from src.logic.helper_functionality.news_check.news_checklist import NewsChecklist
+    from src.logic.helper_functionality.news_check.news_filter import NewsFilter
+    from src.logic.helper_functionality.news_check.news_deduplication import NearDuplicateDetector
+    from src.logic.helper_functionality.text_summarization import TextSummarizer
+    from src.logic.helper_functionality.document_indexation import Indexer
+    from src.logic.pipeline import StageGraph
+
 import os
 import dotenv
 dotenv.load_dotenv()
 os.environ["OPENAI_API_KEY"] = config_secrets.read_openai_credentials()
 
+# serve repeated LLM requests from the persistent response cache
+llm_cache = install_llm_cache()
+# export the spans and metrics of the app, other entry points keep them in memory
+tracer = install_tracer(jsonl_path = TRACES_PATH, prometheus_path = METRICS_PATH)
+
 st.set_page_config(page_title="Risky Business", page_icon="📈")
 
-# define the singletons
-keyword_generator = KeywordGenerator()
-news_extractor = NewsExtractor()
-index = Indexer()
-news_checklist = NewsChecklist()
-text_summarizer = TextSummarizer()
-risk_analysis = RiskAnalysis()
+# define the singletons, each is imported and built once per process when a step first needs it
+@st.cache_resource
+def get_keyword_generator() -> "KeywordGenerator":
+    from src.logic.keyword_generation import KeywordGenerator
+    return KeywordGenerator()
+
+@st.cache_resource
+def get_news_extractor() -> "NewsExtractor":
+    from src.data.sources.news_extraction import NewsExtractor
+    return NewsExtractor()
+
+@st.cache_resource
+def get_indexer() -> "Indexer":
+    from src.logic.helper_functionality.document_indexation import Indexer
+    return Indexer()
+
+@st.cache_resource
+def get_news_checklist() -> "NewsChecklist":
+    from src.logic.helper_functionality.news_check.news_checklist import NewsChecklist
+    return NewsChecklist()
+
+@st.cache_resource
+def get_text_summarizer() -> "TextSummarizer":
+    from src.logic.helper_functionality.text_summarization import TextSummarizer
+    return TextSummarizer()
+
+@st.cache_resource
+def get_risk_analysis() -> "RiskAnalysis":
+    from src.logic.risk_analysis import RiskAnalysis
+    return RiskAnalysis()
+
+@st.cache_resource
+def get_news_filter() -> "NewsFilter":
+    from src.logic.helper_functionality.news_check.news_filter import NewsFilter
+    return NewsFilter(news_checklist = get_news_checklist(), text_summarizer = get_text_summarizer())
+
+@st.cache_resource
+def get_duplicate_detector() -> "NearDuplicateDetector":
+    from src.logic.helper_functionality.news_check.news_deduplication import NearDuplicateDetector
+    return NearDuplicateDetector()
+
+@st.cache_resource
+def get_pipeline() -> "StageGraph":
+    from src.logic.pipeline import build_risk_pipeline
+    return build_risk_pipeline(
+        keyword_generator = get_keyword_generator(),
+        news_extractor = get_news_extractor(),
+        duplicate_detector = get_duplicate_detector(),
+        text_summarizer = get_text_summarizer(),
+        news_filter = get_news_filter(),
+        risk_analysis = get_risk_analysis(),
+    )
+
+def show_trace(run_id: str) -> None:
+    # show where the time, the tokens and the cost of a step went
+    with st.expander("Trace"):
+        st.write("Per operation:")
+        st.dataframe(tracer.breakdown(run_id))
+        st.write("Per article:")
+        st.dataframe([row for row in tracer.breakdown(run_id, by = "article") if row["article"] is not None])
 
 # define the session state
 if "news" not in st.session_state:
@@ -49,6 +113,7 @@ if "feedback" not in st.session_state:
     st.session_state.disabled = False
 
 st.header('Risky Business!')
+st.sidebar.write("LLM cache:", llm_cache.stats())
 
 # form for the company name
 st.write("""Please provide the following information to conduct a risk analysis:""")
@@ -62,19 +127,28 @@ st.write("""The first step in the pipeline is to generate keywords for the compa
         company name as a seed for an agent implementing the ChatGPT-API amongst a variety of tools. The agent
         generates a list of keywords that are relevant to the company and its operations/products.""")
 number_input_keywords = st.number_input('Please forward how many keywords you would like to generate', max_value=50, min_value=1, value=10, step=1, format='%d')
+regenerate_keywords = st.checkbox('Regenerate the keywords instead of reusing the stored ones')
 generate_keywords = st.button('Generate keywords!')
 if generate_keywords:
-    st.session_state.keywords = keyword_generator.generate_keywords(company = company, n = number_input_keywords)
+    with tracer.run("generate-keywords", company = company) as run_id:
+        st.session_state.keywords = get_keyword_generator().get_keywords(company = company, n = number_input_keywords, force = regenerate_keywords)
     st.write(st.session_state.keywords)
+    show_trace(run_id)
 st.markdown("""---""")
 
 # extract news based on the keywords 
 st.header('2. Fetch News')
 st.write("""The second step featured in the pipeline is to extract news based on the keywords. This is done 
         by using the Newsapi.ai news API and more specific their very own Python SDK: https://newsapi.ai/intro-python.""")
+only_new_news = st.checkbox('Only fetch articles newer than the last fetch for these keywords')
 fetch_news = st.button('Fetch news!')
 if fetch_news:
-    st.session_state.news = news_extractor.get_news(keywords = st.session_state.keywords, max_articles = 1)
+    with tracer.run("fetch-news", company = company) as run_id:
+        st.session_state.news, duplicate_report = get_duplicate_detector().deduplicate(
+            get_news_extractor().get_news(keywords = st.session_state.keywords, max_articles = 1, only_new = only_new_news)
+        )
+    if duplicate_report["duplicates"]:
+        st.write(f"Collapsed {duplicate_report['duplicates']} near-duplicate articles, avoiding {duplicate_report['llm_calls_avoided']} LLM calls.")
     if len(st.session_state.news) > 1:
         st.write(f"News successfully fetched: {len(st.session_state.news)} articles retrieved.")
         for article in st.session_state.news:
@@ -85,6 +159,7 @@ if fetch_news:
         st.write(st.session_state.news[0]["body"])
     else:
         st.write("No articles retrieved.")
+    show_trace(run_id)
 st.markdown("""---""")
 
 # filter news based on relevancy and reliability
@@ -94,17 +169,20 @@ agent to check whether the news is relevant to the company. If so the news are a
 to be analyzed.""")
 filter_news = st.button('Filter news!')
 if filter_news:
-    news_cleaned = []
-    for article in st.session_state.news:
-        article["body"] = text_summarizer.summarize_text(raw_text = article["body"], max_tokens = 3500)
-        news_verified: bool = news_checklist.checklist(news = article, company = company)  
-        if news_verified == 1:
-            st.write(f"News verified: False, for: {article['title']}")
-        else:
-            st.write(f"News verified: True, for: {article['title']}")
-        if news_verified == 0:
-            news_cleaned.append(article)
-        st.session_state.news = news_cleaned   
+    progress = st.progress(0.0)
+    results = []
+    with tracer.run("filter-news", company = company) as run_id:
+        for result in get_news_filter().stream(news = st.session_state.news, company = company, max_tokens = 3500, keywords = st.session_state.keywords):
+            results.append(result)
+            progress.progress(len(results) / len(st.session_state.news))
+            if result["error"]:
+                st.write(f"News verified: False ({result['error']}), for: {result['article']['title']}")
+            else:
+                st.write(f"News verified: {result['verified']}, for: {result['article']['title']}")
+    results.sort(key = lambda result: result["index"])
+    st.session_state.news = [result["article"] for result in results if result["verified"]]
+    st.write("Relevancy decisions:", get_news_checklist().prefilter.counters)
+    show_trace(run_id)
 st.markdown("""---""")
 
 # embed risk types
@@ -130,7 +208,8 @@ with st.expander("Indexation Form"):
             concatenated_data += bytes_data
         data: str = concatenated_data.decode("utf-8")
         doc: List[Document] = [Document(page_content = data)]
-        index.do_indexation(documents = doc, namespace = namespace, index_name = index_name, metric = metric, pod_type = pod_type)
+        indexation_report = get_indexer().do_indexation(documents = doc, namespace = namespace, index_name = index_name, metric = metric, pod_type = pod_type)
+        st.write(f"Indexed {indexation_report['indexed']} of {indexation_report['chunks']} chunks, {indexation_report['skipped']} unchanged chunks skipped.")
 st.markdown("""---""")
 
 # analyse news
@@ -138,9 +217,41 @@ st.header('5. Conduct anaylsis')
 st.write("""The fifth stepstep includes conducting a risk anaylsis identifying potential risks discussed in a news article.""")
 click3 = st.button('Click me! to conduct a risk analysis')
 if click3:
-    content = text_summarizer.summarize_text(raw_text = st.session_state.news[0]["body"], max_tokens = 3500)
-    analysis_result = risk_analysis.analysis(company = company, news = content)
-    st.write(analysis_result)
+    if not st.session_state.news:
+        st.warning("No relevant news to analyse. Please fetch and filter news first.")
+    else:
+        views = {}
+        with tracer.run("risk-analysis", company = company) as run_id:
+            # render each stage of each article as soon as it is done instead of waiting for the whole report
+            for event in get_risk_analysis().stream_many(
+                company = company, news = [article["body"] for article in st.session_state.news], max_tokens = 3500
+            ):
+                if event["type"] == "report":
+                    analysis_result = event
+                    continue
+                if event["article"] not in views:
+                    container = st.container()
+                    container.subheader(f"Article {event['article'] + 1}")
+                    views[event["article"]] = {"container": container, "keypoints": container.empty(), "status": container.empty(), "text": ""}
+                view = views[event["article"]]
+                if event["type"] == "token" and event["stage"] == "keypoints":
+                    view["text"] += event["text"]
+                    view["keypoints"].markdown(view["text"])
+                elif event["type"] == "keypoints":
+                    view["keypoints"].markdown(event["text"])
+                elif event["type"] == "step":
+                    view["status"].caption(f"{event['stage'].capitalize()}: using {event['tool']}")
+                elif event["type"] == "risk":
+                    view["container"].markdown(f"**Risk {event['index'] + 1}:** {event['text']}")
+                elif event["type"] == "score":
+                    view["container"].markdown(f"**Score {event['score']}** (likelihood {event['likelihood']} x impact {event['impact']}): {event['text']}")
+                elif event["type"] == "result":
+                    view["status"].caption("Analysis done.")
+                elif event["type"] == "error":
+                    view["status"].caption(f"Analysis failed: {event['error']}")
+        with st.expander("Full report"):
+            st.write(analysis_result["report"])
+        show_trace(run_id)
 st.markdown("""---""")
 
 # feedback loop
@@ -148,46 +259,51 @@ st.header('6. Feedback Loop')
 st.write("""The sixth step includes a feedback loop.""")
 with st.form(key="feedback_form"):
     st.session_state.feedback = st.text_area('Feedback:', """""")
+    optimize_prompt = st.checkbox('Run several candidate prompts in parallel on past articles and keep the best')
     form_submit = st.form_submit_button("Submit")
 if form_submit:
     st.success("Thank you for your feedback!")
+    from src.logic.feedback_loop import FeedbackLoop
     feedback = FeedbackLoop()
     # task = "Please identify {n} keywords for the company {company}.".format(n = number_input_keywords, company = company)
     # result1 = feedback.main(task = task, company = company, problem = st.session_state.feedback, message_type = "keyword")
     task = "Please identify the key points of the following news article."
-    result2 = feedback.main(task = task, company = company, problem = st.session_state.feedback, message_type = "analysis")
+    if optimize_prompt:
+        result2 = feedback.optimize(task = task, company = company, problem = st.session_state.feedback, message_type = "analysis")
+    else:
+        result2 = feedback.main(task = task, company = company, problem = st.session_state.feedback, message_type = "analysis")
     st.write(result2)
 st.markdown("""---""")
 
 # rerun the pipeline
 st.header('7. Rerun Pipeline')
 st.write("""The seventh step includes rerunning the adapted pipeline.""")
+refetch_news = st.checkbox('Fetch the news again instead of reusing the last fetch for these keywords')
 rerun = st.button('Run Loop Again')
 if rerun:
-    st.session_state.news = []
-    st.session_state.keywords = []
-    st.session_state.keyword_num = 0
     st.session_state.feedback = ""
-    st.session_state.keywords = keyword_generator.generate_keywords(company = company, num = number_input_keywords, message_type = "keyword")
+    with tracer.run("rerun-pipeline", company = company) as run_id:
+        pipeline_run = get_pipeline().run(
+            params = {"company": company, "n": number_input_keywords, "max_articles": 1, "max_tokens": 3500},
+            force = ["news"] if refetch_news else [],
+        )
+    st.write("Pipeline stages:", pipeline_run["stages"])
+    outputs = pipeline_run["outputs"]
+    st.session_state.keywords = outputs["keywords"]
     st.write(st.session_state.keywords)
-    st.session_state.news = news_extractor.get_news(keywords = st.session_state.keywords, max_articles = 1)
-    if len(st.session_state.news) > 1:
-        st.write(f"News successfully fetched: {len(st.session_state.news)} articles retrieved.")
-        for article in st.session_state.news:
+    if len(outputs["news"]) > 1:
+        st.write(f"News successfully fetched: {len(outputs['news'])} articles retrieved.")
+        for article in outputs["news"]:
             st.write(article["title"])
-    elif len(st.session_state.news) == 1:
-        st.write(f"News successfully fetched: {len(st.session_state.news)} article retrieved.")
-        st.write(st.session_state.news[0]["title"])
-        st.write(st.session_state.news[0]["body"])
+    elif len(outputs["news"]) == 1:
+        st.write(f"News successfully fetched: {len(outputs['news'])} article retrieved.")
+        st.write(outputs["news"][0]["title"])
+        st.write(outputs["news"][0]["body"])
     else:
         st.write("No articles retrieved.")
-    news_cleaned = []
-    for article in st.session_state.news:
-        article["body"] = text_summarizer.summarize_text(raw_text = article["body"], max_tokens = 3500)
-        news_verified: bool = news_checklist.checklist(news = article, company = company)  
-        st.write(f"News verified: {news_verified}, for: {article['title']}")
-        if news_verified == True:
-            news_cleaned.append(article)
-        st.session_state.news = news_cleaned
-    result = RiskAnalysis.analysis(company = company, news = st.session_state.news[0], message_type="analysis")
-    st.write(result)
+    for result in outputs["verdicts"]:
+        st.write(f"News verified: {result['verified']}, for: {result['article']['title']}")
+    st.session_state.news = [result["article"] for result in outputs["verdicts"] if result["verified"]]
+    if outputs["analysis"]:
+        st.write(outputs["analysis"]["report"])
+    show_trace(run_id)
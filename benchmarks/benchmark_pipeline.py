@@ -0,0 +1,255 @@
+"""
+File that contains the offline benchmark of the pipeline stages. OpenAI, SerpAPI, Wikipedia, Event
+Registry and Pinecone are replaced by the local stand-ins in benchmarks.fakes, so no credentials or
+network access are needed once the tiktoken encoding is cached.
+
+Run from the project root with: python -m benchmarks.benchmark_pipeline --companies 3 --articles 8
+Record a baseline with --update-baseline first and after an intended performance change, the benchmark
+fails without one.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.docstore.document import Document
+
+from benchmarks.fakes import (
+    FakeChatModel, FakeEmbeddings, FakeNewsExtractor, FakePineconeStore, FakeRiskTypes, FakeSearch, Latency
+)
+from benchmarks.timing import summarize
+from src.data.sources.news_extraction import NewsWatermarks, plan_queries
+from src.logic.component_factory import ComponentFactory
+from src.logic.keyword_generation import KeywordGenerator
+from src.logic.risk_analysis import RiskAnalysis
+from src.logic.helper_functionality.document_indexation import Indexer
+from src.logic.helper_functionality.example_index import ExampleIndex
+from src.logic.helper_functionality.news_check.news_checklist import NewsChecklist
+from src.logic.helper_functionality.news_check.news_filter import NewsFilter
+from src.logic.helper_functionality.news_check.news_relevancy_check import RelevancyChecker
+from src.logic.helper_functionality.news_check.relevancy_prefilter import RelevancyPrefilter
+from src.logic.helper_functionality.summarization_engine import ChunkSummaryCache
+from src.logic.helper_functionality.text_summarization import TextSummarizer
+from src.logic.helper_functionality.tracing import install_tracer
+
+from db.keyword_store import KeywordStore
+from db.prompt_repository import PromptRepository
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH: str = os.path.join(ROOT, "benchmarks", "baselines", "pipeline.json")
+EXAMPLES_PATH: str = os.path.join(ROOT, "content", "examples", "keyword_examples.json")
+STAGES: List[str] = ["keywords", "news", "summarize", "filter", "index", "analysis"]
+
+
+def build_components(workdir: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the pipeline components on top of the local stand-ins. All state, including the few-shot
+    example index and the traces, is kept in workdir, so every repeat starts with cold caches and the
+    stores of the app are left untouched.
+
+    :param workdir: The directory the databases, watermarks, vectors and traces are stored in.
+    :param config: The benchmark configuration.
+    :return: The components by name.
+    """
+    def latency(mean_ms: float, offset: int) -> Latency:
+        return Latency(
+            mean_ms = mean_ms, jitter_ms = mean_ms * config["jitter"], error_rate = config["error_rate"], seed = config["seed"] + offset
+        )
+
+    install_tracer(jsonl_path = os.path.join(workdir, "traces.jsonl"), prometheus_path = os.path.join(workdir, "metrics.prom"))
+    examples_path: str = shutil.copy(EXAMPLES_PATH, os.path.join(workdir, "keyword_examples.json"))
+    llm: FakeChatModel = FakeChatModel(latency = latency(config["llm_ms"], 1))
+    search: FakeSearch = FakeSearch(latency = latency(config["search_ms"], 2))
+    wikipedia: FakeSearch = FakeSearch(latency = latency(config["search_ms"], 3), service = "Wikipedia")
+    embeddings: FakeEmbeddings = FakeEmbeddings(latency = latency(config["embedding_ms"], 4))
+    store: FakePineconeStore = FakePineconeStore(path = os.path.join(workdir, "vectors"), latency = latency(config["vector_ms"], 5))
+    prompt_repository: PromptRepository = PromptRepository(path = os.path.join(workdir, "prompts.db"))
+    text_summarizer: TextSummarizer = TextSummarizer(llm = llm, cache = ChunkSummaryCache(db_path = os.path.join(workdir, "summaries.db")))
+    components: ComponentFactory = ComponentFactory(builders = {
+        "llm": lambda: llm,
+        "verbose_llm": lambda: llm,
+        "streaming_llm": lambda: FakeChatModel(latency = llm.latency, streaming = True),
+        "search": lambda: search,
+        "wikipedia": lambda: wikipedia,
+        "risk_types": lambda: FakeRiskTypes(store = store, embeddings = embeddings),
+    })
+    news_checklist: NewsChecklist = NewsChecklist(
+        prefilter = RelevancyPrefilter(path = os.path.join(workdir, "thresholds.db")),
+        relevancy_checker = RelevancyChecker(llm = llm, search = search, wikipedia = wikipedia),
+    )
+    return {
+        "keyword_generator": KeywordGenerator(
+            prompt_repository = prompt_repository, llm = llm, search = search, embeddings = embeddings,
+            example_index = ExampleIndex(path = examples_path, embeddings = embeddings),
+            keyword_store = KeywordStore(path = os.path.join(workdir, "keywords.db")),
+        ),
+        "news_extractor": FakeNewsExtractor(
+            latency = latency(config["news_ms"], 6),
+            article_words = config["article_words"],
+            watermarks = NewsWatermarks(path = os.path.join(workdir, "watermarks.db")),
+        ),
+        # summarizes the articles on a cache of its own, so the filter stage is not served from it
+        "text_summarizer": TextSummarizer(llm = llm, cache = ChunkSummaryCache(db_path = os.path.join(workdir, "stage_summaries.db"))),
+        "news_filter": NewsFilter(news_checklist = news_checklist, text_summarizer = text_summarizer),
+        "indexer": Indexer(embeddings = embeddings, store = store),
+        "risk_analysis": RiskAnalysis(components = components, prompt_repository = prompt_repository, text_summarizer = text_summarizer),
+    }
+
+
+def run(companies: int, articles: int, repeats: int, config: Dict[str, Any], warmup: int = 1) -> Dict[str, Dict[str, Any]]:
+    """
+    Run every stage for the given number of companies and articles per company and measure the wall
+    time of every call. A failed call is counted as an error and its outputs are empty for the
+    following stages.
+
+    :param companies: The number of companies.
+    :param articles: The number of articles per company.
+    :param repeats: The number of measured runs, each with fresh components and cold caches.
+    :param warmup: The number of unmeasured runs before, so imports and lazy setup are not measured.
+    :param config: The benchmark configuration.
+    :return: The summary of every stage, including the number of processed items and errors.
+    """
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    items: Dict[str, int] = {stage: 0 for stage in STAGES}
+    errors: Dict[str, int] = {stage: 0 for stage in STAGES}
+
+    def measure(stage: str, func: Callable[[], Any], count: int, default: Any) -> Any:
+        start: float = time.perf_counter()
+        try:
+            result: Any = func()
+        except Exception as e:
+            errors[stage] += 1
+            print(f"{stage} failed: {type(e).__name__}: {e}", file = sys.stderr)
+            result = default
+        timings[stage].append(time.perf_counter() - start)
+        items[stage] += count
+        return result
+
+    with open(os.path.join(ROOT, "content", "risk_types.txt"), "r", encoding = "utf-8") as file:
+        risk_types: List[Document] = [Document(page_content = file.read())]
+    for repeat in range(warmup + repeats):
+        if repeat == warmup:
+            for stage in STAGES:
+                timings[stage], items[stage], errors[stage] = [], 0, 0
+        workdir: str = tempfile.mkdtemp(prefix = "benchmark-pipeline-")
+        try:
+            parts: Dict[str, Any] = build_components(workdir = workdir, config = {**config, "seed": config["seed"] + repeat * 100})
+            measure("index", lambda: parts["indexer"].do_indexation(documents = risk_types, namespace = "risk-types", index_name = "index-risk"), 1, None)
+            for number in range(companies):
+                company: str = f"Company {number}"
+                keywords: List[str] = measure(
+                    "keywords", lambda: parts["keyword_generator"].generate_keywords(company = company, n = config["keywords"]), 1, [company]
+                )
+                max_articles: int = math.ceil(articles / len(plan_queries(keywords)))
+                news: List[dict] = measure(
+                    "news", lambda: parts["news_extractor"].get_news(keywords = keywords, max_articles = max_articles)[:articles], 1, []
+                )
+                for article in news:
+                    measure("summarize", lambda: parts["text_summarizer"].summarize_article(article = article, max_tokens = config["max_tokens"]), 1, None)
+                verdicts: List[dict] = measure(
+                    "filter",
+                    lambda: parts["news_filter"].filter_news(news = news, company = company, max_tokens = config["max_tokens"], keywords = keywords),
+                    len(news),
+                    [],
+                )
+                relevant: List[str] = [result["article"]["body"] for result in verdicts if result["verified"]]
+                if relevant:
+                    measure(
+                        "analysis",
+                        lambda: parts["risk_analysis"].analyse_many(company = company, news = relevant, max_tokens = config["max_tokens"]),
+                        len(relevant),
+                        None,
+                    )
+        finally:
+            shutil.rmtree(workdir, ignore_errors = True)
+    results: Dict[str, Dict[str, Any]] = {}
+    for stage in STAGES:
+        if not timings[stage]:
+            continue
+        row: Dict[str, Any] = summarize(timings[stage])
+        total: float = sum(timings[stage])
+        row["items"] = items[stage]
+        row["items_per_sec"] = round(items[stage] / total, 2) if total else 0.0
+        row["errors"] = errors[stage]
+        results[stage] = row
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """
+    Compare the results with a baseline. A stage regressed if its p95 latency grew or its throughput
+    dropped by more than the tolerance.
+
+    :param results: The summary of every stage.
+    :param baseline: The summary of every stage of the baseline run.
+    :param tolerance: The allowed relative deviation, e.g. 0.2 for 20%.
+    :return: One message per regression.
+    """
+    regressions: List[str] = []
+    for stage, expected in baseline.items():
+        actual: Optional[Dict[str, Any]] = results.get(stage)
+        if actual is None:
+            regressions.append(f"{stage}: stage did not run")
+            continue
+        if actual["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{stage}: p95 {actual['p95_ms']} ms exceeds baseline {expected['p95_ms']} ms")
+        if actual["items_per_sec"] < expected["items_per_sec"] * (1 - tolerance):
+            regressions.append(f"{stage}: {actual['items_per_sec']} items/s below baseline {expected['items_per_sec']} items/s")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the pipeline stages offline against local stand-ins.")
+    parser.add_argument("--companies", type = int, default = 3)
+    parser.add_argument("--articles", type = int, default = 8, help = "articles per company")
+    parser.add_argument("--repeats", type = int, default = 3)
+    parser.add_argument("--warmup", type = int, default = 1, help = "unmeasured runs before the measurement")
+    parser.add_argument("--keywords", type = int, default = 10)
+    parser.add_argument("--max-tokens", type = int, default = 600)
+    parser.add_argument("--article-words", type = int, default = 800)
+    parser.add_argument("--llm-ms", type = float, default = 50.0)
+    parser.add_argument("--embedding-ms", type = float, default = 10.0)
+    parser.add_argument("--search-ms", type = float, default = 20.0)
+    parser.add_argument("--news-ms", type = float, default = 30.0)
+    parser.add_argument("--vector-ms", type = float, default = 10.0)
+    parser.add_argument("--jitter", type = float, default = 0.2, help = "standard deviation of the latency relative to its mean")
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--baseline", default = BASELINE_PATH)
+    parser.add_argument("--tolerance", type = float, default = 0.2)
+    parser.add_argument("--update-baseline", action = "store_true", help = "store the results as the new baseline")
+    args = parser.parse_args()
+    config: Dict[str, Any] = {
+        "companies": args.companies, "articles": args.articles, "keywords": args.keywords, "max_tokens": args.max_tokens,
+        "article_words": args.article_words, "llm_ms": args.llm_ms, "embedding_ms": args.embedding_ms,
+        "search_ms": args.search_ms, "news_ms": args.news_ms, "vector_ms": args.vector_ms, "jitter": args.jitter,
+        "error_rate": args.error_rate, "seed": args.seed, "repeats": args.repeats,
+    }
+    results: Dict[str, Dict[str, Any]] = run(
+        companies = args.companies, articles = args.articles, repeats = args.repeats, config = config, warmup = args.warmup
+    )
+    for stage, row in results.items():
+        print(json.dumps({"stage": stage, **row}))
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok = True)
+        with open(args.baseline, "w", encoding = "utf-8") as file:
+            json.dump({"config": config, "stages": results}, file, indent = 2)
+        print(f"Baseline written to {args.baseline}.")
+        sys.exit(0)
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, record one with --update-baseline.")
+        sys.exit(2)
+    with open(args.baseline, "r", encoding = "utf-8") as file:
+        baseline: Dict[str, Any] = json.load(file)
+    if baseline["config"] != config:
+        print("The baseline was recorded with a different configuration, rerun with its arguments or --update-baseline.")
+        sys.exit(2)
+    regressions: List[str] = compare(results = results, baseline = baseline["stages"], tolerance = args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,53 @@
+"""
+File that contains the latency benchmark of the fake news detectors.
+
+Run from the project root with: python -m benchmarks.benchmark_reliability_models
+"""
+import argparse
+import json
+from typing import Callable, Dict, List
+
+from src.logic.helper_functionality.news_check.reliability_model.model_registry import load_training_data, model_registry
+from src.logic.helper_functionality.news_check.reliability_model.random_forest_model import random_forest_classifier_batch
+from src.logic.helper_functionality.news_check.reliability_model.svm_model import SVM_classifier_batch
+from src.logic.helper_functionality.news_check.reliability_model.lstm_model import LSTM_classifier_batch
+
+from benchmarks.timing import measure, summarize
+
+MODELS: Dict[str, Callable] = {
+    "random_forest": random_forest_classifier_batch,
+    "svm": SVM_classifier_batch,
+    "lstm": LSTM_classifier_batch,
+}
+BATCH_SIZES: List[int] = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+def run(models: List[str], batch_sizes: List[int], repeats: int) -> List[Dict[str, object]]:
+    """
+    Benchmark the batch prediction of the given models.
+
+    :param models: The names of the models to benchmark.
+    :param batch_sizes: The batch sizes to benchmark.
+    :param repeats: The number of measured calls per model and batch size.
+    :return: One result row per model and batch size.
+    """
+    texts: List[str] = load_training_data()["text"].tolist()
+    results: List[Dict[str, object]] = []
+    for name in models:
+        model_registry.get(name)
+        for batch_size in batch_sizes:
+            batch: List[str] = (texts * (batch_size // len(texts) + 1))[:batch_size]
+            timings: List[float] = measure(lambda: MODELS[name](batch), repeats = repeats)
+            row: Dict[str, object] = {"model": name, "batch_size": batch_size, **summarize(timings, items_per_call = batch_size)}
+            results.append(row)
+            print(json.dumps(row))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the fake news detectors.")
+    parser.add_argument("--models", nargs = "+", default = list(MODELS), choices = list(MODELS))
+    parser.add_argument("--batch-sizes", nargs = "+", type = int, default = BATCH_SIZES)
+    parser.add_argument("--repeats", type = int, default = 20)
+    args = parser.parse_args()
+    run(models = args.models, batch_sizes = args.batch_sizes, repeats = args.repeats)
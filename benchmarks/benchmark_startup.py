@@ -0,0 +1,80 @@
+"""
+File that contains the startup benchmark of the application.
+
+Run from the project root with: python -m benchmarks.benchmark_startup
+"""
+import argparse
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.timing import measure, summarize
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES: List[str] = [
+    "src.logic.config.secrets",
+    "src.logic.helper_functionality.llm_cache",
+    "src.logic.keyword_generation",
+    "src.data.sources.news_extraction",
+    "src.logic.helper_functionality.document_indexation",
+    "src.logic.helper_functionality.news_check.news_filter",
+    "src.logic.risk_analysis",
+    "src.logic.pipeline",
+]
+
+
+def cold_import(module: str) -> float:
+    """
+    Import a module in a fresh interpreter.
+
+    :param module: The dotted name of the module.
+    :return: The import time in seconds, measured inside the interpreter.
+    """
+    code: str = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output: str = subprocess.run(
+        [sys.executable, "-c", code], cwd = ROOT, capture_output = True, text = True, check = True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def run(modules: List[str], repeats: int, app: bool) -> List[Dict[str, object]]:
+    """
+    Benchmark the cold import of the given modules, a credential lookup and, if requested, the cold
+    start and the rerun of app.py as Streamlit executes it on every interaction.
+
+    :param modules: The modules whose cold import is measured.
+    :param repeats: The number of measurements per benchmark.
+    :param app: Whether to measure app.py, which requires the credentials.
+    :return: One result row per benchmark.
+    """
+    results: List[Dict[str, object]] = []
+
+    def report(name: str, timings: List[float]) -> None:
+        row: Dict[str, object] = {"benchmark": name, **summarize(timings)}
+        results.append(row)
+        print(json.dumps(row))
+
+    for module in modules:
+        report(f"import {module}", [cold_import(module) for _ in range(repeats)])
+    from src.logic.config import secrets as config_secrets
+    report("read_openai_credentials", measure(config_secrets.read_openai_credentials, repeats = repeats * 100))
+    if app:
+        sys.path.insert(0, ROOT)
+        start: float = time.perf_counter()
+        runpy.run_path(os.path.join(ROOT, "app.py"), run_name = "__main__")
+        report("app cold start", [time.perf_counter() - start])
+        report("app rerun", measure(lambda: runpy.run_path(os.path.join(ROOT, "app.py"), run_name = "__main__"), repeats = repeats, warmup = 0))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the startup of the application.")
+    parser.add_argument("--modules", nargs = "+", default = MODULES)
+    parser.add_argument("--repeats", type = int, default = 5)
+    parser.add_argument("--app", action = "store_true", help = "also measure the cold start and rerun of app.py")
+    args = parser.parse_args()
+    run(modules = args.modules, repeats = args.repeats, app = args.app)
@@ -0,0 +1,284 @@
+"""
+File that contains deterministic local stand-ins for OpenAI, SerpAPI, Wikipedia, Event Registry and
+Pinecone, so the pipeline can be benchmarked offline.
+
+Every stand-in takes a Latency that sleeps for a seeded, jittered duration per request and fails a
+configurable share of the requests with a FakeServiceError.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult, SystemMessage
+
+from src.data.sources.news_extraction import NewsExtractor, NewsWatermarks
+from src.logic.helper_functionality.vector_store import LocalVectorStore, Match, VectorStoreBackend, VectorStoreRetriever
+
+WORDS: List[str] = (
+    "market supply chain pricing demand regulation competitor revenue forecast product launch factory "
+    "shares investors lawsuit recall merger acquisition tariff inflation customers brand reputation "
+    "strike shortage semiconductor logistics quarter guidance analyst outlook subsidy emissions"
+).split()
+
+
+class FakeServiceError(Exception):
+    """
+    Raised by a stand-in for a request that was configured to fail.
+    """
+
+
+class Latency():
+    """
+    Class that simulates the response time and the error rate of a remote service.
+    """
+
+    def __init__(self, mean_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+        """
+        Initialize the Latency.
+
+        :param mean_ms: The mean response time in milliseconds.
+        :param jitter_ms: The standard deviation of the response time in milliseconds.
+        :param error_rate: The share of requests that fail, between 0 and 1.
+        :param seed: The seed of the random generator.
+        :raise ValueError: If arg error_rate is not between 0 and 1.
+        """
+        if not 0 <= error_rate <= 1:
+            raise ValueError("Argument error_rate must be between 0 and 1.")
+        self.mean_ms: float = mean_ms
+        self.jitter_ms: float = jitter_ms
+        self.error_rate: float = error_rate
+        self.requests: int = 0
+        self.errors: int = 0
+        self._random: random.Random = random.Random(seed)
+        self._lock: threading.Lock = threading.Lock()
+
+    def wait(self, service: str) -> None:
+        """
+        Sleep for one simulated response time and fail if the request was drawn to fail.
+
+        :param service: The name of the service, used in the error message.
+        :raise FakeServiceError: If the request fails.
+        """
+        with self._lock:
+            self.requests += 1
+            delay: float = max(self._random.gauss(self.mean_ms, self.jitter_ms), 0.0) / 1000
+            failed: bool = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        time.sleep(delay)
+        if failed:
+            raise FakeServiceError(f"Simulated {service} failure.")
+
+
+def stable_hash(*parts: Any) -> int:
+    """
+    Hash values to an integer that is the same in every process.
+    """
+    return int(hashlib.sha256("\x1f".join(map(str, parts)).encode("utf-8")).hexdigest()[:16], 16)
+
+
+def filler(seed: int, words: int) -> str:
+    """
+    Create deterministic text of the given number of words.
+    """
+    rng: random.Random = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "."
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Approximate the token count of a text without loading an encoding.
+    """
+    return len(text.split()) * 4 // 3
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Class that answers the prompts of the pipeline like GPT-4 would in shape, so the chains, agents and
+    output parsers run unchanged. Agents call one of their tools tool_calls times before they answer.
+    With streaming set, the answer is also reported word by word as new tokens.
+    """
+
+    latency: Any = None
+    tool_calls: int = 1
+    tools: List[str] = ["Get Risk Type", "Search"]
+    completion_words: int = 60
+    model_name: str = "gpt-4"
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        prompt: str = "\n".join(message.content for message in messages)
+        # the format instructions are in the system message, the steps taken so far in the others
+        instructions: str = "\n".join(message.content for message in messages if isinstance(message, SystemMessage))
+        scratchpad: str = "\n".join(message.content for message in messages if not isinstance(message, SystemMessage))
+        last: str = messages[-1].content
+        seed: int = stable_hash(prompt)
+        if "<END_OF_PLAN>" in instructions:
+            return "Plan:\n1. Identify the risks in the statement.\n2. Given the above steps taken, please respond to the users original question.\n<END_OF_PLAN>"
+        if "rate the relevancy of the news articles" in last:
+            # the verdict depends on the article only, not on the batch it was packed into
+            articles: List[Tuple[str, str]] = re.findall(r"^\[([\w-]+)\] (.*)$", last, re.MULTILINE)
+            return json.dumps([
+                {"id": article_id, "relevancy": stable_hash(article) % 3 != 0, "explanation": filler(stable_hash(article), 12)}
+                for article_id, article in articles
+            ])
+        if "action_input" in instructions:
+            if scratchpad.count("Observation:") < self.tool_calls:
+                tool: Optional[str] = next((name for name in self.tools if f"{name}:" in instructions), None)
+                if tool:
+                    action: str = json.dumps({"action": tool, "action_input": filler(seed, 4)})
+                    return f"Thought: I need more information.\nAction:\n```\n{action}\n```"
+            if "Relevancy:" in prompt:
+                return f"Final Answer: Relevancy: {stable_hash(seed) % 3 != 0}\nExplanation: {filler(seed, 20)}"
+            keywords: Optional[re.Match] = re.search(r"(\d+) keywords", last)
+            if keywords:
+                rng: random.Random = random.Random(seed)
+                return "Final Answer: " + ", ".join(rng.sample(WORDS, min(int(keywords.group(1)), len(WORDS))))
+            return f"Final Answer: {filler(seed, self.completion_words)}"
+        return filler(seed, self.completion_words)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            self.latency.wait("OpenAI")
+        answer: str = self._answer(messages)
+        if self.streaming and run_manager:
+            for token in re.findall(r"\S+\s*", answer):
+                run_manager.on_llm_new_token(token)
+        usage: Dict[str, int] = {
+            "prompt_tokens": sum(approximate_tokens(message.content) for message in messages),
+            "completion_tokens": approximate_tokens(answer),
+        }
+        return ChatResult(
+            generations = [ChatGeneration(message = AIMessage(content = answer))],
+            llm_output = {"token_usage": usage, "model_name": self.model_name},
+        )
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self._generate(messages, stop = stop, **kwargs)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Class that embeds texts into deterministic unit vectors, one simulated request per call.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, dimension: int = 64) -> None:
+        self.latency: Optional[Latency] = latency
+        self.dimension: int = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector: np.ndarray = np.random.default_rng(stable_hash(text)).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            self.latency.wait("OpenAI embeddings")
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            self.latency.wait("OpenAI embeddings")
+        return self._embed(text)
+
+
+class FakeSearch():
+    """
+    Class that stands in for the SerpAPI and Wikipedia wrappers used as agent tools.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, service: str = "SerpAPI") -> None:
+        self.latency: Optional[Latency] = latency
+        self.service: str = service
+
+    def run(self, query: str) -> str:
+        if self.latency:
+            self.latency.wait(self.service)
+        return filler(stable_hash(self.service, query), 40)
+
+
+class FakePineconeStore(VectorStoreBackend):
+    """
+    Class that answers like a Pinecone index from a local vector store, adding the network round trip
+    of every request.
+    """
+
+    def __init__(self, path: str, latency: Optional[Latency] = None, metric: str = "cosine") -> None:
+        self.store: LocalVectorStore = LocalVectorStore(path = path, metric = metric)
+        self.latency: Optional[Latency] = latency
+
+    def _wait(self) -> None:
+        if self.latency:
+            self.latency.wait("Pinecone")
+
+    def upsert(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], metadatas: Sequence[Dict[str, Any]]) -> None:
+        self._wait()
+        self.store.upsert(ids = ids, vectors = vectors, metadatas = metadatas)
+
+    def query(self, vector: Sequence[float], k: int = 4) -> List[Match]:
+        self._wait()
+        return self.store.query(vector = vector, k = k)
+
+    def delete(self, ids: Sequence[str]) -> None:
+        self._wait()
+        self.store.delete(ids = ids)
+
+    def count(self) -> int:
+        self._wait()
+        return self.store.count()
+
+    def existing(self, ids: Sequence[str]) -> Set[str]:
+        self._wait()
+        return self.store.existing(ids = ids)
+
+
+class FakeRiskTypes():
+    """
+    Class that stands in for ToolSearchRiskTypes, answering with the risk type chunks closest to the query.
+    """
+
+    def __init__(self, store: VectorStoreBackend, embeddings: Embeddings) -> None:
+        self.retriever: VectorStoreRetriever = VectorStoreRetriever(store = store, embeddings = embeddings, k = 2)
+
+    def run(self, query: str) -> str:
+        return "\n\n".join(document.page_content for document in self.retriever.get_relevant_documents(query))
+
+    def run_find_type(self, query: str) -> str:
+        return self.run(query)
+
+
+class FakeNewsExtractor(NewsExtractor):
+    """
+    Class that serves deterministic articles instead of querying the Event Registry API. Every query
+    returns max_articles articles, about a third of them do not mention any of the queried keywords.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, article_words: int = 600, watermarks: Optional[NewsWatermarks] = None, keywords_per_query: int = 5, max_workers: int = 8) -> None:
+        super().__init__(watermarks = watermarks, keywords_per_query = keywords_per_query, max_workers = max_workers)
+        self.latency: Optional[Latency] = latency
+        self.article_words: int = article_words
+
+    def _query(self, keywords: List[str], max_articles: int, watermark: Optional[dict]) -> Iterator[dict]:
+        if self.latency:
+            self.latency.wait("Event Registry")
+        now: datetime = datetime(2023, 7, 1)
+        for index in range(max_articles):
+            seed: int = stable_hash(*keywords, index)
+            mentioned: List[str] = keywords if seed % 3 else []
+            yield {
+                "uri": str(seed),
+                "title": f"{' '.join(mentioned[:2]) or filler(seed, 3)} report {index}",
+                "body": " ".join([*mentioned, filler(seed, self.article_words)]),
+                "dateTime": (now - timedelta(minutes = index)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            }
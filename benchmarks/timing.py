@@ -0,0 +1,58 @@
+"""
+File that contains the shared timing helpers of the benchmark suites.
+"""
+import math
+import time
+from typing import Callable, Dict, List
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """
+    Calculate a percentile of a list of samples using the nearest-rank method.
+
+    :param samples: The measured values.
+    :param q: The percentile between 0 and 100.
+    :return: The percentile of the samples, 0.0 if there are no samples.
+    """
+    if not samples:
+        return 0.0
+    ordered: List[float] = sorted(samples)
+    rank: int = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def measure(func: Callable[[], object], repeats: int, warmup: int = 1) -> List[float]:
+    """
+    Measure the wall time of a function.
+
+    :param func: The function to be measured.
+    :param repeats: The number of measured calls.
+    :param warmup: The number of unmeasured calls before the measurement.
+    :return: The wall time of every measured call in seconds.
+    """
+    for _ in range(warmup):
+        func()
+    timings: List[float] = []
+    for _ in range(repeats):
+        start: float = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings: List[float], items_per_call: int = 1) -> Dict[str, float]:
+    """
+    Summarize a list of timings.
+
+    :param timings: The wall time of every call in seconds.
+    :param items_per_call: The number of items processed per call.
+    :return: The throughput in items per second and the p50/p95/p99 latency in milliseconds.
+    """
+    total: float = sum(timings)
+    return {
+        "calls": len(timings),
+        "items_per_sec": round(items_per_call * len(timings) / total, 2) if total else 0.0,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+    }
@@ -23,6 +23,9 @@ columns = [
 # Create the table prompts
 db.create_table('prompts', columns)
 
+# Index the lookup of the latest prompt per type
+db.c.execute("CREATE INDEX idx_prompts_type_created_at ON prompts (type, created_at)")
+
 # Commit the changes and close the database connection
 db.conn.commit()
 db.close()
\ No newline at end of file
@@ -1,6 +1,7 @@
 """
 File that contains the database connector class.
 """
+import os
 import sqlite3
 from typing import List, Tuple
 
@@ -13,7 +14,7 @@ class DatabaseConnector():
         self.c = None
 
     def open(self) -> None:
-        self.conn = sqlite3.connect(f"db/{self.dbname}")
+        self.conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), self.dbname))
         self.c = self.conn.cursor()
 
     def close(self) -> None:
@@ -0,0 +1,123 @@
+"""
+File that contains the keyword store over the keywords table.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from db.prompt_repository import DB_DIR, ConnectionPool
+
+KEYWORD_DB_PATH: str = os.path.join(DB_DIR, "keyword_store.db")
+
+
+class KeywordStore():
+    """
+    Class that stores the generated keywords of a company keyed by the company, the number of keywords
+    and the version of the keyword prompt. Company names are matched case-insensitively.
+    """
+
+    def __init__(self, path: str = KEYWORD_DB_PATH, pool_size: int = 4) -> None:
+        """
+        Initialize the KeywordStore and make sure the keywords table exists.
+
+        :param path: The path of the SQLite file.
+        :param pool_size: The number of pooled connections.
+        """
+        self.pool: ConnectionPool = ConnectionPool(path = path, size = pool_size)
+        with self.pool.connection() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS keywords (
+                    company TEXT,
+                    n INTEGER,
+                    prompt_version INTEGER,
+                    keywords TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (company, n, prompt_version)
+                )"""
+            )
+
+    @staticmethod
+    def _key(company: str) -> str:
+        return " ".join(company.split()).lower()
+
+    def get_many(self, companies: Sequence[str], n: int, prompt_version: int) -> Dict[str, Tuple[List[str], float]]:
+        """
+        Look up the keywords of several companies.
+
+        :param companies: The companies.
+        :param n: The number of keywords.
+        :param prompt_version: The version of the keyword prompt.
+        :return: The keywords and the time they were generated at, keyed by the companies as given, for
+        the companies that are in the store.
+        """
+        keys: Dict[str, str] = {self._key(company): company for company in companies}
+        if not keys:
+            return {}
+        with self.pool.connection() as conn:
+            rows: List[Tuple[str, str, float]] = conn.execute(
+                f"""SELECT company, keywords, created_at FROM keywords
+                WHERE n = ? AND prompt_version = ? AND company IN ({', '.join('?' * len(keys))})""",
+                (n, prompt_version, *keys),
+            ).fetchall()
+        return {keys[company]: (json.loads(keywords), created_at) for company, keywords, created_at in rows}
+
+    def get(self, company: str, n: int, prompt_version: int) -> Optional[Tuple[List[str], float]]:
+        """
+        Look up the keywords of a company.
+
+        :return: The keywords and the time they were generated at or None if they are not in the store.
+        """
+        return self.get_many(companies = [company], n = n, prompt_version = prompt_version).get(company)
+
+    def put_many(self, keywords: Dict[str, List[str]], n: int, prompt_version: int) -> None:
+        """
+        Store the keywords of several companies, replacing older entries.
+
+        :param keywords: The keywords keyed by company.
+        :param n: The number of keywords that was requested.
+        :param prompt_version: The version of the keyword prompt.
+        """
+        now: float = time.time()
+        with self.pool.connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO keywords (company, n, prompt_version, keywords, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(self._key(company), n, prompt_version, json.dumps(values), now) for company, values in keywords.items()],
+            )
+
+    def companies(self, limit: int = 10) -> List[str]:
+        """
+        Return the companies keywords were generated for most recently.
+
+        :param limit: The maximum number of companies.
+        :return: The normalized company names, most recent first.
+        """
+        with self.pool.connection() as conn:
+            rows: List[Tuple[str]] = conn.execute(
+                "SELECT company FROM keywords GROUP BY company ORDER BY MAX(created_at) DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def put(self, company: str, keywords: List[str], n: int, prompt_version: int) -> None:
+        """
+        Store the keywords of a company, replacing an older entry.
+        """
+        self.put_many(keywords = {company: keywords}, n = n, prompt_version = prompt_version)
+
+
+_keyword_store: Optional[KeywordStore] = None
+_keyword_store_lock: threading.Lock = threading.Lock()
+
+
+def get_keyword_store() -> KeywordStore:
+    """
+    Return the process wide keyword store.
+
+    :return: The keyword store.
+    """
+    global _keyword_store
+    with _keyword_store_lock:
+        if _keyword_store is None:
+            _keyword_store = KeywordStore()
+        return _keyword_store
@@ -0,0 +1,193 @@
+"""
+File that contains the prompt repository over the prompts table.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+DB_DIR: str = os.path.dirname(os.path.abspath(__file__))
+DB_PATH: str = os.path.join(DB_DIR, "risk.db")
+
+
+def open_connection(path: str, timeout: float = 30) -> sqlite3.Connection:
+    """
+    Open a SQLite connection in WAL mode, so readers never block behind a writer and concurrent
+    writers, e.g. of several processes, wait for the lock instead of failing.
+
+    :param path: The path of the SQLite file.
+    :param timeout: The number of seconds to wait for a database lock.
+    :return: The connection.
+    """
+    conn: sqlite3.Connection = sqlite3.connect(path, timeout = timeout, check_same_thread = False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class ConnectionPool():
+    """
+    Class that hands out a fixed number of SQLite connections to concurrent threads.
+    """
+
+    def __init__(self, path: str, size: int = 4, timeout: float = 30) -> None:
+        """
+        Initialize the ConnectionPool. The connections are opened in WAL mode, so readers never block
+        behind a writer.
+
+        :param path: The path of the SQLite file.
+        :param size: The number of connections.
+        :param timeout: The number of seconds to wait for a free connection or a database lock.
+        :raise ValueError: If arg size is not a positive integer.
+        """
+        if not isinstance(size, int) or size < 1:
+            raise ValueError("Argument size must be a positive integer.")
+        self.path: str = path
+        self.timeout: float = timeout
+        self._connections: queue.Queue = queue.Queue(maxsize = size)
+        for _ in range(size):
+            self._connections.put(open_connection(path, timeout = timeout))
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection for the duration of a with block. The transaction is committed when the
+        block succeeds and rolled back otherwise.
+
+        :return: The connection.
+        :raise queue.Empty: If no connection becomes free within the timeout.
+        """
+        conn: sqlite3.Connection = self._connections.get(timeout = self.timeout)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._connections.put(conn)
+
+    def close(self) -> None:
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PromptRepository():
+    """
+    Class that stores the prompts revised by the feedback loop and serves the latest prompt per type
+    from an in-process cache.
+    """
+
+    def __init__(self, path: str = DB_PATH, pool_size: int = 4) -> None:
+        """
+        Initialize the PromptRepository and make sure the prompts table and its index exist.
+
+        :param path: The path of the SQLite file.
+        :param pool_size: The number of pooled connections.
+        """
+        self.pool: ConnectionPool = ConnectionPool(path = path, size = pool_size)
+        self._cache: Dict[str, Optional[Tuple[int, str]]] = {}
+        self._generation: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        with self.pool.connection() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS prompts (
+                    message TEXT,
+                    type VARCHAR(50),
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_prompts_type_created_at ON prompts (type, created_at)")
+
+    def _latest(self, message_type: str) -> Optional[Tuple[int, str]]:
+        """
+        Return the id and message of the latest prompt of a type, from the cache if possible. A row read
+        while the cache was invalidated is returned but not cached, since it may predate the invalidation.
+        """
+        with self._lock:
+            if message_type in self._cache:
+                return self._cache[message_type]
+            generation: int = self._generation
+        with self.pool.connection() as conn:
+            row: Optional[Tuple[int, str]] = conn.execute(
+                "SELECT id, message FROM prompts WHERE type = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+                (message_type,)
+            ).fetchone()
+        with self._lock:
+            if self._generation == generation:
+                self._cache[message_type] = row
+        return row
+
+    def latest(self, message_type: str) -> Optional[str]:
+        """
+        Return the latest prompt of a type.
+
+        :param message_type: The type of the prompt, e.g. "keyword" or "analysis".
+        :return: The prompt or None if no prompt of the type exists.
+        """
+        row: Optional[Tuple[int, str]] = self._latest(message_type)
+        return row[1] if row else None
+
+    def version(self, message_type: str) -> Optional[int]:
+        """
+        Return the id of the latest prompt of a type, which changes whenever a revised prompt is stored.
+
+        :param message_type: The type of the prompt.
+        :return: The id or None if no prompt of the type exists.
+        """
+        row: Optional[Tuple[int, str]] = self._latest(message_type)
+        return row[0] if row else None
+
+    def insert(self, message: str, message_type: str) -> int:
+        """
+        Store a revised prompt and invalidate the cached prompt of its type.
+
+        :param message: The prompt.
+        :param message_type: The type of the prompt.
+        :return: The id of the stored prompt.
+        """
+        with self.pool.connection() as conn:
+            prompt_id: int = conn.execute(
+                "INSERT INTO prompts (message, type) VALUES (?, ?)", (message, message_type)
+            ).lastrowid
+        self.invalidate(message_type)
+        return prompt_id
+
+    def invalidate(self, message_type: Optional[str] = None) -> None:
+        """
+        Drop the cached prompt of a type, or of all types if message_type is None.
+
+        :param message_type: The type of the prompt.
+        """
+        with self._lock:
+            self._generation += 1
+            if message_type is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(message_type, None)
+
+
+_repository: Optional[PromptRepository] = None
+_repository_lock: threading.Lock = threading.Lock()
+
+
+def get_prompt_repository() -> PromptRepository:
+    """
+    Return the process wide prompt repository.
+
+    :return: The prompt repository.
+    """
+    global _repository
+    with _repository_lock:
+        if _repository is None:
+            _repository = PromptRepository()
+        return _repository
@@ -0,0 +1,205 @@
+"""
+File that contains the headless batch runner for company watchlists.
+
+Run from the project root with: python -m src.batch_runner watchlist.txt --output results.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set
+
+from src.logic.keyword_generation import KeywordGenerator
+from src.data.sources.news_extraction import NewsExtractor
+from src.logic.risk_analysis import RiskAnalysis
+from src.logic.pipeline import StageGraph, build_risk_pipeline
+from src.logic.helper_functionality.news_check.news_checklist import NewsChecklist
+from src.logic.helper_functionality.news_check.news_filter import NewsFilter
+from src.logic.helper_functionality.news_check.news_deduplication import NearDuplicateDetector
+from src.logic.helper_functionality.text_summarization import TextSummarizer
+from src.logic.helper_functionality.llm_cache import install_llm_cache
+from src.logic.helper_functionality.tracing import TRACES_PATH, install_tracer
+
+import src.logic.config.secrets as config_secrets
+
+_pipeline: Optional[StageGraph] = None
+
+
+def read_watchlist(path: str) -> List[str]:
+    """
+    Read the companies of a watchlist, one per line. Blank lines and lines starting with # are
+    ignored, duplicate companies are kept once.
+
+    :param path: The path of the watchlist file.
+    :return: The companies in file order.
+    """
+    with open(path, "r", encoding = "utf-8") as file:
+        companies: List[str] = [line.strip() for line in file if line.strip() and not line.strip().startswith("#")]
+    return list(dict.fromkeys(companies))
+
+
+def finished_companies(path: str) -> Set[str]:
+    """
+    Read the companies that already finished successfully from a results file. A line cut off by a
+    crash is ignored, so its company runs again.
+
+    :param path: The path of the JSONL results file.
+    :return: The finished companies.
+    """
+    finished: Set[str] = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, "r", encoding = "utf-8") as file:
+        for line in file:
+            try:
+                result: Dict[str, Any] = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("error") is None:
+                finished.add(result["company"])
+    return finished
+
+
+def _init_worker(trace: bool = False) -> None:
+    """
+    Build the components of the pipeline once per worker process.
+
+    :param trace: Whether to append the spans of the worker to the trace file of the app.
+    """
+    global _pipeline
+    os.environ["OPENAI_API_KEY"] = config_secrets.read_openai_credentials()
+    if trace:
+        # the workers share the trace file, but each would overwrite the metrics file with its own metrics
+        install_tracer(jsonl_path = TRACES_PATH)
+    install_llm_cache()
+    text_summarizer: TextSummarizer = TextSummarizer()
+    _pipeline = build_risk_pipeline(
+        keyword_generator = KeywordGenerator(),
+        news_extractor = NewsExtractor(),
+        duplicate_detector = NearDuplicateDetector(),
+        text_summarizer = text_summarizer,
+        news_filter = NewsFilter(news_checklist = NewsChecklist(), text_summarizer = text_summarizer),
+        risk_analysis = RiskAnalysis(),
+    )
+
+
+def run_company(company: str, n: int, max_articles: int, max_tokens: int) -> Dict[str, Any]:
+    """
+    Run keyword generation, news fetching, filtering and the risk analysis for one company.
+
+    :param company: The company.
+    :param n: The number of keywords to generate.
+    :param max_articles: The maximum number of articles to fetch.
+    :param max_tokens: The maximum number of tokens of a summarized article body.
+    :return: A dictionary containing the company, its keywords, the number of fetched and relevant
+    articles, the analysis report, how each stage ran, the duration and an error message if it failed.
+    """
+    started: float = time.monotonic()
+    try:
+        # the news are fetched on every run, so a recurring run reports on the latest articles; the
+        # downstream stages are only recomputed if the fetched articles changed
+        run: Dict[str, Any] = _pipeline.run(
+            params = {"company": company, "n": n, "max_articles": max_articles, "max_tokens": max_tokens}, force = ("news",)
+        )
+    except Exception as e:
+        logging.error(f"Pipeline for {company} failed: {e}")
+        return {"company": company, "error": str(e), "duration": time.monotonic() - started}
+    outputs: Dict[str, Any] = run["outputs"]
+    return {
+        "company": company,
+        "keywords": outputs["keywords"],
+        "articles": len(outputs["news"]),
+        "relevant": sum(1 for result in outputs["verdicts"] if result["verified"]),
+        "report": outputs["analysis"]["report"] if outputs["analysis"] else None,
+        "stages": run["stages"],
+        "duration": time.monotonic() - started,
+        "error": None,
+    }
+
+
+def run_watchlist(watchlist: str, output: str, workers: int = 4, n: int = 10, max_articles: int = 1, max_tokens: int = 3500, prefetch: bool = True, trace: bool = False) -> Dict[str, int]:
+    """
+    Run the pipeline for every company of a watchlist on a process pool and append each result to a
+    JSONL file as soon as it finished. Companies that already finished successfully in the file are
+    skipped, so an interrupted run resumes where it stopped. The keywords of all companies are generated
+    in batches up front, so the workers find them in the keyword store.
+
+    :param watchlist: The path of the watchlist file.
+    :param output: The path of the JSONL results file.
+    :param workers: The number of worker processes.
+    :param n: The number of keywords to generate per company.
+    :param max_articles: The maximum number of articles to fetch per company.
+    :param max_tokens: The maximum number of tokens of a summarized article body.
+    :param prefetch: Whether to generate the keywords of all companies in batches before the run.
+    :param trace: Whether the workers append their spans to the trace file of the app.
+    :return: The number of companies that were skipped, succeeded and failed.
+    :raise ValueError: If arg workers is not a positive integer.
+    """
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("Argument workers must be a positive integer.")
+    done: Set[str] = finished_companies(output)
+    companies: List[str] = [company for company in read_watchlist(watchlist) if company not in done]
+    summary: Dict[str, int] = {"skipped": len(done), "succeeded": 0, "failed": 0}
+    if not companies:
+        return summary
+    logging.info(f"Running {len(companies)} companies, {len(done)} already finished.")
+    if trace:
+        install_tracer(jsonl_path = TRACES_PATH)
+    if prefetch:
+        os.environ["OPENAI_API_KEY"] = config_secrets.read_openai_credentials()
+        try:
+            KeywordGenerator().prefetch(companies = companies, n = n)
+        except Exception as e:
+            # the workers generate the keywords that are still missing one by one
+            logging.error(f"Prefetching the keywords failed: {e}")
+    with open(output, "a", encoding = "utf-8") as file, ProcessPoolExecutor(max_workers = min(workers, len(companies)), initializer = _init_worker, initargs = (trace,)) as executor:
+        if file.tell() > 0:
+            # terminate a line cut off by a crash, so the next result starts on its own line
+            with open(output, "rb") as previous:
+                previous.seek(-1, os.SEEK_END)
+                if previous.read(1) != b"\n":
+                    file.write("\n")
+        futures: Dict[Future, str] = {
+            executor.submit(run_company, company, n, max_articles, max_tokens): company for company in companies
+        }
+        try:
+            for future in as_completed(futures):
+                try:
+                    result: Dict[str, Any] = future.result()
+                except Exception as e:
+                    result = {"company": futures[future], "error": str(e)}
+                summary["failed" if result["error"] else "succeeded"] += 1
+                file.write(json.dumps(result) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+                print(f"[{summary['succeeded'] + summary['failed']}/{len(companies)}] {result['company']}: {result['error'] or 'done'}")
+        except KeyboardInterrupt:
+            executor.shutdown(wait = False, cancel_futures = True)
+            raise
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run the risk pipeline for every company of a watchlist.")
+    parser.add_argument("watchlist", help = "file with one company per line")
+    parser.add_argument("--output", default = "results.jsonl", help = "JSONL file the results are appended to")
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--keywords", type = int, default = 10)
+    parser.add_argument("--max-articles", type = int, default = 1)
+    parser.add_argument("--max-tokens", type = int, default = 3500)
+    parser.add_argument("--no-prefetch", action = "store_true", help = "generate the keywords per company in the workers")
+    parser.add_argument("--trace", action = "store_true", help = "append the spans of the run to the trace file of the app")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+    print(json.dumps(run_watchlist(
+        watchlist = args.watchlist,
+        output = args.output,
+        workers = args.workers,
+        n = args.keywords,
+        max_articles = args.max_articles,
+        max_tokens = args.max_tokens,
+        prefetch = not args.no_prefetch,
+        trace = args.trace,
+    )))
@@ -1,34 +1,275 @@
 """
 File that contains the logic for news extraction.
 """
+import hashlib
+import json
 import logging
-from typing import List
-from eventregistry import EventRegistry, QueryArticlesIter, QueryItems
+import os
+import queue
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Tuple
 
 from src.logic.config import secrets as config_secrets
+from src.logic.helper_functionality.tracing import get_tracer, in_context
+
+from db.prompt_repository import DB_DIR, ConnectionPool
+
+if TYPE_CHECKING:
+    from eventregistry import EventRegistry
+
+WATERMARKS_DB_PATH: str = os.path.join(DB_DIR, "news_watermarks.db")
+
+class NewsWatermarks():
+    """
+    Class that persists how far each keyword set was polled, so polling only pulls articles not seen yet.
+    The watermarks live in SQLite, so the worker processes of a batch run can advance them concurrently.
+    """
+
+    def __init__(self, path: str = WATERMARKS_DB_PATH, pool_size: int = 2) -> None:
+        """
+        Initialize the NewsWatermarks and make sure the watermarks table exists. Watermarks of a JSON file
+        next to path with the same name, as written by earlier versions, are imported once.
+
+        :param path: The path of the SQLite file.
+        :param pool_size: The number of pooled connections.
+        """
+        self.path: str = path
+        self.pool: ConnectionPool = ConnectionPool(path = path, size = pool_size)
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS news_watermarks (key TEXT PRIMARY KEY, date_time TEXT, uris TEXT)")
+        self._import_json(os.path.splitext(path)[0] + ".json")
+
+    def _import_json(self, json_path: str) -> None:
+        try:
+            with open(json_path, "r", encoding = "utf-8") as file:
+                watermarks: Dict[str, dict] = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT COUNT(*) FROM news_watermarks").fetchone()[0]:
+                return
+            conn.executemany(
+                "INSERT INTO news_watermarks (key, date_time, uris) VALUES (?, ?, ?)",
+                [(key, watermark["date_time"], json.dumps(watermark["uris"])) for key, watermark in watermarks.items()],
+            )
+        logging.info(f"Imported {len(watermarks)} news watermarks from {json_path}.")
+
+    @staticmethod
+    def key(keywords: List[str]) -> str:
+        """
+        Create the key of a keyword set, independent of order and case.
+
+        :param keywords: The keywords of the query.
+        :return: The sha256 hex digest of the normalized keywords.
+        """
+        normalized: List[str] = sorted({keyword.strip().lower() for keyword in keywords})
+        return hashlib.sha256("\n".join(normalized).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _seen(date_time: str, uris: str) -> Dict[str, str]:
+        seen = json.loads(uris)
+        # Earlier versions stored only the uris at the watermark itself
+        return {uri: date_time for uri in seen} if isinstance(seen, list) else seen
+
+    def get(self, keywords: List[str]) -> Optional[dict]:
+        """
+        Return the watermark of a keyword set.
+
+        :param keywords: The keywords of the query.
+        :return: A dictionary containing the oldest dateTime to query from and the uris already returned
+        since, None if never polled.
+        """
+        with self.pool.connection() as conn:
+            row: Optional[Tuple[str, str]] = conn.execute(
+                "SELECT date_time, uris FROM news_watermarks WHERE key = ?", (self.key(keywords),)
+            ).fetchone()
+        return {"date_time": row[0], "uris": sorted(self._seen(*row))} if row else None
+
+    def update(self, keywords: List[str], articles: List[dict], retrieved: Optional[List[dict]] = None) -> None:
+        """
+        Advance the watermark of a keyword set. The watermark moves to the oldest retrieved article, so
+        articles that were retrieved but not returned, e.g. because they ranked too low, are retrieved
+        again by the next poll, while the returned articles are remembered as seen. The watermark is read
+        and written in one transaction, so concurrent updates from other processes are merged.
+
+        :param keywords: The keywords of the query.
+        :param articles: The articles returned for the keyword set.
+        :param retrieved: All articles retrieved for the keyword set, defaults to the returned ones.
+        """
+        dated: List[dict] = [article for article in (articles if retrieved is None else retrieved) if article.get("dateTime")]
+        if not dated:
+            return
+        oldest: str = min(article["dateTime"] for article in dated)
+        key: str = self.key(keywords)
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            current: Optional[Tuple[str, str]] = conn.execute(
+                "SELECT date_time, uris FROM news_watermarks WHERE key = ?", (key,)
+            ).fetchone()
+            date_time: str = max(oldest, current[0]) if current else oldest
+            seen: Dict[str, str] = self._seen(*current) if current else {}
+            seen.update({article["uri"]: article["dateTime"] for article in articles if article.get("dateTime")})
+            conn.execute(
+                "INSERT OR REPLACE INTO news_watermarks (key, date_time, uris) VALUES (?, ?, ?)",
+                (key, date_time, json.dumps({uri: seen_at for uri, seen_at in sorted(seen.items()) if seen_at >= date_time})),
+            )
+
+
+def plan_queries(keywords: List[str], keywords_per_query: int = 5) -> List[List[str]]:
+    """
+    Split a keyword list into batches that fit into one Event Registry query. Keywords are deduplicated
+    independent of case, keeping their order.
+
+    :param keywords: The keywords.
+    :param keywords_per_query: The maximum number of keywords ORed together in one query.
+    :return: The keyword batches.
+    :raise ValueError: If arg keywords_per_query is not a positive integer.
+    """
+    if not isinstance(keywords_per_query, int) or keywords_per_query < 1:
+        raise ValueError("Argument keywords_per_query must be a positive integer.")
+    unique: List[str] = list({keyword.strip().lower(): keyword.strip() for keyword in keywords if keyword.strip()}.values())
+    return [unique[start:start + keywords_per_query] for start in range(0, len(unique), keywords_per_query)]
+
+
+def matched_keywords(article: dict, keywords: List[str]) -> List[str]:
+    """
+    Find the keywords mentioned as whole words in the title or body of an article.
+
+    :param article: The news article.
+    :param keywords: The keywords.
+    :return: The keywords found, in keyword order.
+    """
+    text: str = f"{article.get('title') or ''}\n{article.get('body') or ''}".lower()
+    return [keyword for keyword in keywords if re.search(rf"(?<!\w){re.escape(keyword.lower())}(?!\w)", text)]
+
 
 class NewsExtractor():
     """
     Class that handles the extraction of news articles from the Event Registry API.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, watermarks: Optional[NewsWatermarks] = None, keywords_per_query: int = 5, max_workers: int = 8) -> None:
+        """
+        Initialize the NewsExtractor. The Event Registry client is created on the first query.
+
+        :param watermarks: The store of how far each keyword set was polled.
+        :param keywords_per_query: The maximum number of keywords ORed together in one query.
+        :param max_workers: The maximum number of queries running at the same time.
+        :raise ValueError: If arg max_workers is not a positive integer.
+        """
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("Argument max_workers must be a positive integer.")
+        self._event_registry: Optional["EventRegistry"] = None
+        self._lock: threading.Lock = threading.Lock()
+        self.watermarks: NewsWatermarks = watermarks or NewsWatermarks()
+        self.keywords_per_query: int = keywords_per_query
+        self.max_workers: int = max_workers
+
+    @property
+    def event_registry(self) -> "EventRegistry":
+        """
+        The Event Registry client, imported and created on first use.
+        """
+        with self._lock:
+            if self._event_registry is None:
+                from eventregistry import EventRegistry
+                self._event_registry = EventRegistry(
+                    apiKey = config_secrets.read_newsapi_credentials(), allowUseOfArchive=False
+                )
+            return self._event_registry
+
+    def _query(self, keywords: List[str], max_articles: int, watermark: Optional[dict]) -> Iterator[dict]:
         """
-        Initialize the NewsExtractor.
+        Run one Event Registry query for a batch of keywords, newest first.
+
+        :return: An iterator of the at most max_articles articles not seen yet, stopping at the watermark if
+        one is given.
         """
-        self.event_registry = EventRegistry(
-            apiKey = config_secrets.read_newsapi_credentials(), allowUseOfArchive=False
+        from eventregistry import QueryArticlesIter, QueryItems
+        q: QueryArticlesIter = QueryArticlesIter(
+            keywords = QueryItems.OR([f'"{keyword}"' for keyword in keywords]),
+            dataType = ["news", "pr"],
+            dateStart = watermark["date_time"][:10] if watermark else None
         )
-        self.news: List[List[dict]] = []
+        seen_uris: Set[str] = set(watermark["uris"]) if watermark else set()
+        count: int = 0
+        with get_tracer().span("news.query", kind = "news", keywords = len(keywords)):
+            for article in q.execQuery(
+                self.event_registry,
+                sortBy = "date",
+                sortByAsc = False,
+                maxItems = max_articles + len(seen_uris),
+            ):
+                if watermark and article.get("dateTime", "") < watermark["date_time"]:
+                    break
+                # Articles returned by an earlier poll do not count towards max_articles
+                if article["uri"] in seen_uris:
+                    continue
+                yield article
+                count += 1
+                if count == max_articles:
+                    break
 
-    def get_news(self, keywords: List[str], max_articles: int) -> List[dict]:
+    def _fan_out(self, keywords: List[str], max_articles: int, watermark: Optional[dict]) -> Iterator[dict]:
+        """
+        Query all keyword batches concurrently and yield each article as soon as one of the queries
+        returned it, skipping articles already yielded or seen at the watermark.
         """
-        Retrieve the latest news article for a given collection of keywords by querying the Event Registry 
-        API sorted by their date.
+        batches: List[List[str]] = plan_queries(keywords = keywords, keywords_per_query = self.keywords_per_query)
+        if not batches:
+            return
+        seen_uris: Set[str] = set(watermark["uris"]) if watermark else set()
+        results: queue.Queue = queue.Queue()
+        done: object = object()
+        stop: threading.Event = threading.Event()
+
+        def drain(batch: List[str]) -> None:
+            try:
+                for article in self._query(batch, max_articles, watermark):
+                    if stop.is_set():
+                        return
+                    results.put(article)
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(done)
+
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(batches))) as executor:
+            futures: List[Future] = [executor.submit(in_context(drain), batch) for batch in batches]
+            try:
+                running: int = len(futures)
+                while running:
+                    result: Any = results.get()
+                    if result is done:
+                        running -= 1
+                        continue
+                    if isinstance(result, Exception):
+                        raise result
+                    if result["uri"] in seen_uris:
+                        continue
+                    seen_uris.add(result["uri"])
+                    yield result
+            finally:
+                # Workers stop at their next article once the caller stops consuming
+                stop.set()
+                for future in futures:
+                    future.cancel()
 
-        :param keywords: A string containing relevant keywords.
+    def get_news(self, keywords: List[str], max_articles: int, only_new: bool = False) -> List[dict]:
+        """
+        Retrieve the latest news articles for a given collection of keywords. All keywords are queried
+        in concurrent batches, the results are merged by uri and ranked by the number of keywords the
+        article mentions and then by recency. Each article carries the keywords it mentions under
+        "matched_keywords".
+
+        :param keywords: A list of relevant keywords.
         :param max_articles: The maximum number of articles to retrieve.
-        :return: A list of news articles for the given keywords.
+        :param only_new: If True, only return articles that are newer than the ones seen in a previous run and
+        advance the watermark past the articles returned. Other fetches leave the watermark untouched.
+        :return: A list of the top max_articles news articles for the given keywords.
         :raise ValueError: If arg keywords is not list of strings or if the list is empty.
         :raise ValueError: If arg max_articles is not a positive integer.
         """
@@ -36,18 +277,17 @@ class NewsExtractor():
             raise ValueError("Argument keywords must be a non-empty List of strings.")
         if not isinstance(max_articles, int) or max_articles <= 0:
             raise ValueError("Argument max_articles must be a positiv integer.")
+        watermark: Optional[dict] = self.watermarks.get(keywords) if only_new else None
         try:
-            q: QueryArticlesIter = QueryArticlesIter(
-                keywords = QueryItems.OR([f'"{keyword}"' for keyword in keywords[:5]]), dataType = ["news", "pr"]
-            )
-            for article in q.execQuery(
-                self.event_registry,
-                sortBy = "date",
-                sortByAsc = False,
-                maxItems = max_articles,
-            ):  
-                self.news.append(article)
+            articles: List[dict] = [
+                {**article, "matched_keywords": matched_keywords(article = article, keywords = keywords)}
+                for article in self._fan_out(keywords = keywords, max_articles = max_articles, watermark = watermark)
+            ]
         except Exception as e:
             logging.error(e)
             raise ValueError(f"Error: {str(e)}") from e
-        return self.news
+        articles.sort(key = lambda article: (len(article["matched_keywords"]), article.get("dateTime") or ""), reverse = True)
+        ranked: List[dict] = articles[:max_articles]
+        if only_new:
+            self.watermarks.update(keywords, ranked, retrieved = articles)
+        return ranked
@@ -0,0 +1,351 @@
+"""
+File that contains the factory for the agents and tools shared by the pipeline.
+"""
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain.chat_models import ChatOpenAI
+from langchain.agents import Tool, AgentExecutor, AgentType, initialize_agent
+from langchain import SerpAPIWrapper
+from langchain.utilities import WikipediaAPIWrapper
+from langchain.experimental.plan_and_execute import PlanAndExecute, load_agent_executor, load_chat_planner
+from langchain.experimental.plan_and_execute.schema import ListStepContainer
+
+from src.logic.langchain_tools.tool_process_thought import process_thoughts
+from src.logic.langchain_tools.tool_get_risk_scoring_system import get_risk_scoring_system
+from src.logic.langchain_tools.tool_query_risk_types import ToolSearchRiskTypes
+
+from src.logic.config import secrets as config_secrets
+
+class ObjectPool():
+    """
+    Class that hands out exclusive instances of an object that is expensive to construct. Instances
+    are created lazily up to the pool size and reused afterwards.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int, reset: Optional[Callable[[Any], None]] = None) -> None:
+        """
+        Initialize the ObjectPool.
+
+        :param factory: Function that creates a new instance.
+        :param size: The maximum number of instances.
+        :param reset: Function that is called on an instance before it is handed out again.
+        :raise ValueError: If arg size is not a positive integer.
+        """
+        if not isinstance(size, int) or size < 1:
+            raise ValueError("Argument size must be a positive integer.")
+        self.factory: Callable[[], Any] = factory
+        self.size: int = size
+        self.reset: Optional[Callable[[Any], None]] = reset
+        self.created: int = 0
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock: threading.Lock = threading.Lock()
+        self._closed: bool = False
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Check out an instance for exclusive use and return it to the pool afterwards.
+
+        :param timeout: The maximum number of seconds to wait for a free instance.
+        :return: The instance.
+        :raise RuntimeError: If the pool is closed.
+        :raise TimeoutError: If no instance became free within the timeout.
+        """
+        if self._closed:
+            raise RuntimeError("The pool is closed.")
+        try:
+            instance: Any = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create: bool = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                try:
+                    instance = self.factory()
+                except Exception:
+                    with self._lock:
+                        self.created -= 1
+                    raise
+            else:
+                try:
+                    instance = self._idle.get(timeout = timeout)
+                except queue.Empty as e:
+                    raise TimeoutError("No pooled instance became available.") from e
+        if self.reset:
+            self.reset(instance)
+        try:
+            yield instance
+        finally:
+            if not self._closed:
+                self._idle.put(instance)
+
+    def warm_up(self) -> None:
+        """
+        Create all instances of the pool up front.
+        """
+        with self._lock:
+            missing: int = self.size - self.created
+            self.created = self.size
+        for _ in range(missing):
+            self._idle.put(self.factory())
+
+    def close(self) -> None:
+        """
+        Drop all idle instances. Instances that are checked out are discarded on return.
+        """
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+
+def _reset_plan_and_execute(agent: PlanAndExecute) -> None:
+    """
+    Clear the steps of a previous run, PlanAndExecute otherwise carries them into the next run.
+    """
+    agent.step_container = ListStepContainer()
+
+
+class ComponentFactory():
+    """
+    Class that builds the tools, language models and agents of the pipeline once per process and
+    hands out ready instances. Stateless components are shared, agents are pooled for concurrent use.
+    """
+
+    def __init__(self, pool_size: int = 4, builders: Optional[Dict[str, Callable[[], Any]]] = None) -> None:
+        """
+        Initialize the ComponentFactory. Nothing is constructed before it is first needed.
+
+        :param pool_size: The maximum number of instances of each agent.
+        :param builders: Functions replacing the builders of shared components, e.g. a local chat model for "llm".
+        :raise ValueError: If arg pool_size is not a positive integer.
+        """
+        if not isinstance(pool_size, int) or pool_size < 1:
+            raise ValueError("Argument pool_size must be a positive integer.")
+        self.pool_size: int = pool_size
+        self._components: Dict[str, Any] = {}
+        self._pools: Dict[str, ObjectPool] = {}
+        self._lock: threading.RLock = threading.RLock()
+        self._builders: Dict[str, Callable[[], Any]] = {
+            "search": lambda: SerpAPIWrapper(serpapi_api_key = config_secrets.read_serpapi_credentials()),
+            "wikipedia": WikipediaAPIWrapper,
+            "risk_types": ToolSearchRiskTypes,
+            "llm": lambda: ChatOpenAI(
+                model = "gpt-4", temperature = 0, openai_api_key = config_secrets.read_openai_credentials()
+            ),
+            "verbose_llm": lambda: ChatOpenAI(
+                model = "gpt-4", temperature = 0, openai_api_key = config_secrets.read_openai_credentials(), verbose = True
+            ),
+            "streaming_llm": lambda: ChatOpenAI(
+                model = "gpt-4", temperature = 0, openai_api_key = config_secrets.read_openai_credentials(), streaming = True
+            ),
+            "risk_type_tools": self._build_risk_type_tools,
+            "risk_scoring_tools": self._build_risk_scoring_tools,
+            "research_tools": self._build_research_tools,
+        }
+        self._builders.update(builders or {})
+        self._pool_builders: Dict[str, Callable[[], Any]] = {
+            "risk_agent": self._build_risk_agent,
+            "scoring_agent": self._build_scoring_agent,
+            "research_agent": self._build_research_agent,
+        }
+        self._pool_resets: Dict[str, Callable[[Any], None]] = {"risk_agent": _reset_plan_and_execute}
+
+    def get(self, name: str) -> Any:
+        """
+        Return a shared, stateless component. It is constructed on first use.
+
+        :param name: The name of the component, one of search, wikipedia, risk_types, llm, verbose_llm,
+        streaming_llm, risk_type_tools, risk_scoring_tools or research_tools.
+        :return: The component.
+        :raise ValueError: If there is no component with the given name.
+        """
+        component: Any = self._components.get(name)
+        if component is not None:
+            return component
+        if name not in self._builders:
+            raise ValueError(f"Unknown component '{name}'.")
+        with self._lock:
+            if name not in self._components:
+                self._components[name] = self._builders[name]()
+            return self._components[name]
+
+    def pool(self, name: str) -> ObjectPool:
+        """
+        Return the pool of an agent.
+
+        :param name: The name of the agent, one of risk_agent, scoring_agent or research_agent.
+        :return: The pool handing out instances of the agent.
+        :raise ValueError: If there is no agent with the given name.
+        """
+        if name not in self._pool_builders:
+            raise ValueError(f"Unknown agent '{name}'.")
+        with self._lock:
+            if name not in self._pools:
+                self._pools[name] = ObjectPool(
+                    factory = self._pool_builders[name], size = self.pool_size, reset = self._pool_resets.get(name)
+                )
+            return self._pools[name]
+
+    def acquire(self, name: str, timeout: Optional[float] = None):
+        """
+        Check out an agent for exclusive use.
+
+        :param name: The name of the agent.
+        :param timeout: The maximum number of seconds to wait for a free instance.
+        :return: A context manager yielding the agent.
+        """
+        return self.pool(name).acquire(timeout = timeout)
+
+    def start(self, agents: Optional[List[str]] = None) -> None:
+        """
+        Construct the shared components and the agents up front, so no request pays the setup cost.
+
+        :param agents: The names of the agents to warm up, all agents if None.
+        """
+        for name in self._builders:
+            self.get(name)
+        for name in agents if agents is not None else list(self._pool_builders):
+            self.pool(name).warm_up()
+        logging.info("Components started.")
+
+    def close(self) -> None:
+        """
+        Release all components and agents. They are rebuilt on the next use.
+        """
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools = {}
+            self._components = {}
+
+    def _build_risk_type_tools(self) -> List[Tool]:
+        risk_type: ToolSearchRiskTypes = self.get("risk_types")
+        return [
+            Tool(
+                name = "Search",
+                func = self.get("search").run,
+                description = "useful for when you need to answer questions about current events. this tool should not be used to searhc for news articles",
+            ),
+            Tool(
+                name = "Thought Processing",
+                func = process_thoughts,
+                description = """useful for when you have a thought that you want to use in a task,
+                but you want to make sure it's formatted correctly"""
+            ),
+            Tool(
+                name = "Get Risk Type",
+                func = risk_type.run_find_type,
+                description = """useful when you need to find a specific risk type. the input should be an object of interest
+                (e.g. price increases, brand reputation, decrease in user demand, etc.)"""
+            ),
+            Tool(
+                name = "Get Risk Type Description",
+                func = risk_type.run,
+                description = """useful when you need detailed information for a specific risk type. the input should be
+                the name of the risk type (e.g. market risk)"""
+            ),
+            Tool(
+                name = "Wikipedia",
+                func = self.get("wikipedia").run,
+                description = "useful for when you need to detailed information about a topic"
+            )
+        ]
+
+    def _build_risk_scoring_tools(self) -> List[Tool]:
+        return [
+            Tool(
+                name = "Search",
+                func = self.get("search").run,
+                description = "useful for when you need to answer questions about current events",
+            ),
+            Tool(
+                name = "Thought Processing",
+                func = process_thoughts,
+                description = """useful for when you have a thought that you want to use in a task,
+                but you want to make sure it's formatted correctly"""
+            ),
+            Tool(
+                name = "Get Risk Scoring System",
+                func = get_risk_scoring_system,
+                description = """useful when you need information about how to score risks (likelihood and impact)). takes a single input formatted as a question"""
+            )
+        ]
+
+    def _build_research_tools(self) -> List[Tool]:
+        return [
+            Tool(
+                name = "Search",
+                func = self.get("search").run,
+                description = "useful for when you need to answer questions about current events"
+            ),
+            Tool(
+                name = "Thought Processing",
+                func = process_thoughts,
+                description = """useful for when you have a thought that you want to use in a task,
+                but you want to make sure it's formatted correctly"""
+            ),
+            Tool(
+                name = "Wikipedia",
+                func = self.get("wikipedia").run,
+                description = "useful for when you need to detailed information about a topic"
+            )
+        ]
+
+    def _build_risk_agent(self) -> PlanAndExecute:
+        llm: ChatOpenAI = self.get("llm")
+        planner = load_chat_planner(llm)
+        executor = load_agent_executor(llm, self.get("risk_type_tools"), verbose = True)
+        return PlanAndExecute(planner = planner, executor = executor, verbose = True)
+
+    def _build_scoring_agent(self) -> AgentExecutor:
+        return initialize_agent(
+            tools = self.get("risk_scoring_tools"),
+            llm = self.get("verbose_llm"),
+            agent = AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION,
+            verbose = True
+        )
+
+    def _build_research_agent(self) -> AgentExecutor:
+        return initialize_agent(
+            tools = self.get("research_tools"),
+            llm = self.get("llm"),
+            agent = AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION,
+            verbose = True
+        )
+
+
+_factory: Optional[ComponentFactory] = None
+_factory_lock: threading.Lock = threading.Lock()
+
+
+def get_component_factory() -> ComponentFactory:
+    """
+    Return the process wide component factory.
+
+    :return: The component factory.
+    """
+    global _factory
+    if _factory is None:
+        with _factory_lock:
+            if _factory is None:
+                _factory = ComponentFactory()
+    return _factory
+
+
+def shutdown_component_factory() -> None:
+    """
+    Release the process wide component factory.
+    """
+    global _factory
+    with _factory_lock:
+        if _factory is not None:
+            _factory.close()
+            _factory = None
@@ -4,8 +4,12 @@ File that contains the code for retrieving the secret keys from the credentials.
 import json
 import logging
 import os
+import threading
 from typing import Dict
 
+_credentials: Dict[str, Dict[str, str]] = {}
+_credentials_lock: threading.Lock = threading.Lock()
+
 
 def _load_root_dir() -> str:
     """
@@ -15,25 +19,42 @@ def _load_root_dir() -> str:
     location = os.path.abspath(os.path.dirname(__file__))
     root_folder = "credentials"
     while not os.path.isdir(os.path.join(location, root_folder)):
-        location = os.path.dirname(location)
+        parent = os.path.dirname(location)
+        if parent == location:
+            # no credentials folder up to the file system root, reading it fails with FileNotFoundError
+            return os.path.join(os.path.abspath(os.path.dirname(__file__)), root_folder)
+        location = parent
     return os.path.join(location, root_folder)
 
 
 def _read_credentials(filename: str) -> Dict[str, str]:
     """
-    Helper to load the secret classes
+    Helper to load the secret classes. The file is parsed once per process, a missing file is
+    retried on the next call.
     """
-    try:
-        with open(_load_root_dir() + "/" + filename, encoding="utf-8") as f:
-            config: Dict[str, str] = json.load(f)
-        return config
-    except FileNotFoundError:
-        logging.error(
-            f"File '{filename}' not available! See the README where to get the secret from."
-        )
+    with _credentials_lock:
+        if filename in _credentials:
+            return _credentials[filename]
+        try:
+            with open(_load_root_dir() + "/" + filename, encoding="utf-8") as f:
+                config: Dict[str, str] = json.load(f)
+            _credentials[filename] = config
+            return config
+        except FileNotFoundError:
+            logging.error(
+                f"File '{filename}' not available! See the README where to get the secret from."
+            )
     return {}
 
 
+def clear_credentials_cache() -> None:
+    """
+    Forget the loaded credentials, so the next read parses credentials.json again.
+    """
+    with _credentials_lock:
+        _credentials.clear()
+
+
 def read_openai_credentials() -> str:
     """
     This will read the internal config file and return the corresponding API_KEY stored in it.
@@ -1,43 +1,73 @@
 """
 File that contains the logic for the feedback loop.
 """
-from typing import Literal
+import logging
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple
 
-from langchain.agents import AgentType, AgentExecutor
-from langchain.chat_models import ChatOpenAI
-from langchain.agents import initialize_agent
 from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
 from langchain import LLMChain, PromptTemplate
 from langchain.memory import ConversationBufferWindowMemory
-from langchain.agents import Tool
-from langchain import SerpAPIWrapper
-from langchain.utilities import WikipediaAPIWrapper
+from langchain.schema import HumanMessage
 
-from src.logic.langchain_tools.tool_process_thought import process_thoughts
+from src.logic.component_factory import ComponentFactory, get_component_factory
+from src.logic.keyword_generation import KEYWORD_SYSTEM_TEMPLATE
+from src.logic.pipeline import StageStore
+from src.logic.risk_analysis import KEYPOINT_SYSTEM_TEMPLATE
+from src.logic.helper_functionality.tracing import Tracer, get_tracer, in_context
 
-from src.logic.config import secrets as config_secrets
+from db.keyword_store import KeywordStore, get_keyword_store
+from db.prompt_repository import PromptRepository, get_prompt_repository
 
-from db.database_connector import DatabaseConnector
+MAX_SCORE: float = 10.0
+BASELINE: int = -1
+SYSTEM_TEMPLATES: Dict[str, str] = {"keyword": KEYWORD_SYSTEM_TEMPLATE, "analysis": KEYPOINT_SYSTEM_TEMPLATE}
+REVISION_STRATEGIES: List[str] = [
+    "Address the feedback as directly as possible.",
+    "Make the prompt more specific about the expected content.",
+    "Make the prompt more concise and unambiguous.",
+    "Make the prompt explicit about the expected output format.",
+]
+CANDIDATE_TEMPLATE: str = """Act as a Prompt Creator. Your goal is to optimize a prompt based on the feedback of a user on its results.
+Keep all placeholders in curly braces of the prompt unchanged.
+Prompt: {prompt}
+Feedback on the results for {company}: {problem}
+Focus of the revision: {strategy} (variant {variant})
+Answer with the rewritten prompt only, in the form "Revised prompt: ..."."""
+SCORE_TEMPLATE: str = """Act as a reviewer of prompts. The prompt below was run on the input below and produced the output below.
+A user gave feedback on earlier results of the prompt. Rate how well the output does the task of the prompt and addresses the
+feedback, from 0 (not at all) to 10 (fully). Answer in the form "Score: <number>" followed by a one sentence reason.
+Prompt: {candidate}
+Feedback: {problem}
+Input: {inputs}
+Output: {output}"""
 
 class FeedbackLoop():
     """
     FeedbackLoop is a class that implements a feedback loop for a given prompt.
     """
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, components: Optional[ComponentFactory] = None, prompt_repository: Optional[PromptRepository] = None, stage_store: Optional[StageStore] = None, keyword_store: Optional[KeywordStore] = None) -> None:
+        self.components: ComponentFactory = components or get_component_factory()
+        self.tracer: Tracer = get_tracer()
+        self.prompt_repository: PromptRepository = prompt_repository or get_prompt_repository()
+        self._stage_store: Optional[StageStore] = stage_store
+        self.keyword_store: KeywordStore = keyword_store or get_keyword_store()
 
-    def createDBConnection(self, db_name: str = "risk.db") -> DatabaseConnector:
+    @property
+    def stage_store(self) -> StageStore:
         """
-        Open a connection to the database and return a connection object.
+        The store of the pipeline stage outputs the articles candidate prompts are evaluated on are taken
+        from, opened on first use.
         """
-        db = DatabaseConnector(db_name)
-        db.open()
-        return db
+        if self._stage_store is None:
+            self._stage_store = StageStore()
+        return self._stage_store
 
     def human_input(self, company: str, problem: str, output: str) -> str:
-        wikipedia: WikipediaAPIWrapper = WikipediaAPIWrapper()
-        search: SerpAPIWrapper = SerpAPIWrapper(serpapi_api_key = config_secrets.read_serpapi_credentials())
         template_suggestions: Literal = """As a company specialist, you are tasked with answering questions about a company. This
         information will be used for a risk analysis. Your answers should be in line with the feedback given on a previous
         iteration of the risk analysis.
@@ -54,36 +84,10 @@ class FeedbackLoop():
         chat_prompt_suggestions: ChatPromptTemplate = ChatPromptTemplate.from_messages(
             [system_message_prompt_suggestions, human_message_prompt_suggestions]
         )
-        llm_suggestions = ChatOpenAI(
-            model="gpt-4",
-            temperature = 0,
-            client = chat_prompt_suggestions,
-            openai_api_key = config_secrets.read_openai_credentials(),
-        )
-        tools_suggestions = [
-            Tool(
-                name = "Search",
-                func = search.run,
-                description = "useful for when you need to answer questions about current events"
-            ),
-            Tool(
-                name = "Thought Processing",
-                func = process_thoughts,
-                description = """useful for when you have a thought that you want to use in a task,
-                but you want to make sure it's formatted correctly"""
-            ),
-            Tool(
-                name = "Wikipedia",
-                func = wikipedia.run,
-                description = "useful for when you need to detailed information about a topic"
+        with self.components.acquire("research_agent") as agent_suggestions:
+            suggestions_answer = agent_suggestions.run(
+                chat_prompt_suggestions.format_prompt(company = company, problem = problem, suggestions = questions).to_messages()
             )
-        ]
-        agent_suggestions: AgentExecutor = initialize_agent(
-            tools = tools_suggestions, llm = llm_suggestions, agent = AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION, verbose = True
-        )
-        suggestions_answer = agent_suggestions.run(
-            chat_prompt_suggestions.format_prompt(company = company, problem = problem, suggestions = questions).to_messages()
-        )
         return suggestions_answer
 
     def initialize_chain(self, instructions, memory=None):
@@ -100,7 +104,7 @@ class FeedbackLoop():
             input_variables=["history", "human_input"], template=template
         )
         chain = LLMChain(
-            llm = ChatOpenAI(model="gpt-4", temperature=0),
+            llm = self.components.get("llm"),
             prompt = prompt,
             verbose = True,
             memory = ConversationBufferWindowMemory(),
@@ -122,7 +126,7 @@ class FeedbackLoop():
             input_variables=["chat_history"], template=meta_template
         )
         meta_chain = LLMChain(
-            llm = ChatOpenAI(model="gpt-4", temperature=0),
+            llm = self.components.get("llm"),
             prompt = meta_prompt,
             verbose = True,
         )
@@ -137,6 +141,19 @@ class FeedbackLoop():
         delimiter = "Instructions: "
         new_instructions = meta_output[meta_output.find(delimiter) + len(delimiter) :]
         return new_instructions
+
+    @staticmethod
+    def extract_revised_prompt(output: str) -> str:
+        """
+        Extract the revised prompt from an answer of the Prompt Creator, dropping its questions.
+
+        :param output: The answer.
+        :return: The revised prompt or the stripped answer if it has no revised prompt section.
+        """
+        parts: List[str] = re.split(r"revised prompt:", output, maxsplit = 1, flags = re.IGNORECASE)
+        if len(parts) < 2:
+            return output.strip()
+        return re.split(r"(?:b\)\s*)?questions:", parts[1], maxsplit = 1, flags = re.IGNORECASE)[0].strip()
     
     def main(self, task: str, company: str, problem: str, message_type:str, max_iters=3, max_meta_iters=1):
         failed_phrase = "task failed"
@@ -152,7 +169,7 @@ class FeedbackLoop():
         for i in range(max_meta_iters):
             print(f"[Episode {i+1}/{max_meta_iters}]")
             chain = self.initialize_chain(instructions, memory = None)
-            output = chain.predict(human_input = meta_task)
+            output = chain.predict(human_input = meta_task, callbacks = self.tracer.callbacks)
             for j in range(max_iters):
                 print(f"(Step {j+1}/{max_iters})")
                 print(f"Assistant: {output}")
@@ -163,24 +180,208 @@ class FeedbackLoop():
                     human_input = self.human_input(company=company, problem=problem, output=output)
                 if any(phrase in human_input.lower() for phrase in key_phrases):
                     break
-                output = chain.predict(human_input=human_input)
+                output = chain.predict(human_input=human_input, callbacks = self.tracer.callbacks)
             if j+1 == max_iters and i+1 == max_meta_iters:
                 print(output)
-                revised_prompt = ""
-                if "revised prompt:" in output.lower():
-                    revised_prompt = output.split("Revised prompt:")[1].strip()
-                    if "questions:" in revised_prompt.lower():
-                        revised_prompt = revised_prompt.split("b) Questions:")[0].strip()
-                else:
-                    revised_prompt = output.strip()
-                db = self.createDBConnection()
-                db.c.execute("INSERT INTO prompts (message, type) VALUES (?, ?)", (revised_prompt, message_type))
-                db.conn.commit()
+                revised_prompt = self.extract_revised_prompt(output)
+                self.prompt_repository.insert(message = revised_prompt, message_type = message_type)
                 return revised_prompt
             meta_chain = self.initialize_meta_chain()
-            meta_output = meta_chain.predict(chat_history = self.get_chat_history(chain.memory))
+            meta_output = meta_chain.predict(chat_history = self.get_chat_history(chain.memory), callbacks = self.tracer.callbacks)
             print(f"Feedback: {meta_output}")
             instructions = self.get_new_instructions(meta_output)
             print(f"New Instructions: {instructions}")
             print("\n" + "#" * 80 + "\n")
-        print(f"Let's enter the next episode!")
\ No newline at end of file
+        print(f"Let's enter the next episode!")
+
+    def evaluation_set(self, message_type: str, company: str, limit: int = 4, max_chars: int = 4000) -> List[Dict[str, Any]]:
+        """
+        Collect a fixed sample of past inputs of the prompt of a type to run candidate prompts on: the
+        latest relevant articles of the pipeline for "analysis" and the company of the feedback and the
+        latest companies of the keyword store for "keyword".
+
+        :param message_type: The type of the prompt.
+        :param company: The company the feedback was given for.
+        :param limit: The maximum number of inputs.
+        :param max_chars: The number of characters each article is cut to.
+        :return: The inputs, each a dictionary of the variables of the prompt.
+        """
+        if message_type == "keyword":
+            companies: List[str] = list(dict.fromkeys([company, *self.keyword_store.companies(limit = limit)]))
+            return [{"company": name, "n": 10} for name in companies[:limit]]
+        if message_type != "analysis":
+            return []
+        articles: Dict[str, Dict[str, Any]] = {}
+        for verdicts in self.stage_store.recent(stage = "verdicts", limit = limit * 4):
+            for result in verdicts:
+                body: str = (result["article"].get("body") or "")[:max_chars]
+                if result["verified"] and body:
+                    articles.setdefault(body, {"news": body})
+        return list(articles.values())[:limit]
+
+    def _generate_candidate(self, prompt: str, company: str, problem: str, strategy: str, variant: int, stop: threading.Event) -> Optional[str]:
+        if stop.is_set():
+            return None
+        content: str = CANDIDATE_TEMPLATE.format(prompt = prompt, company = company, problem = problem, strategy = strategy, variant = variant)
+        with self.tracer.span("feedback.candidate", kind = "llm", variant = variant):
+            answer: str = self.components.get("llm").predict_messages([HumanMessage(content = content)], callbacks = self.tracer.callbacks).content
+        return self.extract_revised_prompt(answer) or None
+
+    def _score_candidate(self, message_type: str, candidate: str, problem: str, inputs: Dict[str, Any], stop: threading.Event) -> Optional[float]:
+        """
+        Run a candidate prompt on one input the way the pipeline runs it and let an LLM judge the output.
+
+        :return: The score between 0 and MAX_SCORE, 0 if the output could not be judged, None if stopped.
+        """
+        if stop.is_set():
+            return None
+        chat_prompt: ChatPromptTemplate = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(SYSTEM_TEMPLATES[message_type]),
+            HumanMessagePromptTemplate.from_template(candidate),
+        ])
+        llm: Any = self.components.get("llm")
+        with self.tracer.span("feedback.run", kind = "llm"):
+            output: str = llm.predict_messages(chat_prompt.format_messages(**inputs), callbacks = self.tracer.callbacks).content
+        if stop.is_set():
+            return None
+        content: str = SCORE_TEMPLATE.format(
+            candidate = candidate, problem = problem, inputs = "\n".join(f"{name}: {value}" for name, value in inputs.items()), output = output
+        )
+        with self.tracer.span("feedback.score", kind = "llm"):
+            answer: str = llm.predict_messages([HumanMessage(content = content)], callbacks = self.tracer.callbacks).content
+        match: Optional[re.Match] = re.search(r"score:\s*(\d+(?:\.\d+)?)", answer, re.IGNORECASE)
+        if not match:
+            logging.warning(f"Could not parse the score of a candidate prompt: {answer[:100]}")
+            return 0.0
+        return min(max(float(match.group(1)), 0.0), MAX_SCORE)
+
+    @staticmethod
+    def _losers(scores: Dict[int, List[float]], total: int) -> Set[int]:
+        """
+        Find the candidates that cannot win anymore: even scoring the maximum on their remaining examples,
+        their mean stays below the mean another candidate has already secured.
+        """
+        secured: float = max(sum(values) / total for values in scores.values())
+        return {index for index, values in scores.items() if (sum(values) + MAX_SCORE * (total - len(values))) / total < secured}
+
+    def optimize(self, task: str, company: str, problem: str, message_type: str, candidates: int = 4, budget: float = 120.0, max_workers: int = 8, examples: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
+        """
+        Revise a prompt in one round: generate several candidate prompts concurrently, run each and the
+        current prompt on the same fixed sample of past inputs in parallel, let an LLM judge every output
+        and store the candidate with the best mean score if it beats the current prompt. Candidates that
+        cannot win anymore are cancelled, candidates with a failed run, e.g. because of a renamed
+        placeholder, are dropped. Only candidates scored on the whole sample are ranked, so when the
+        budget runs out a candidate with a few lucky scores cannot win over one that was fully evaluated.
+
+        :param task: The prompt that is revised if no revised prompt of the type is stored yet.
+        :param company: The company the feedback was given for.
+        :param problem: The feedback of the user.
+        :param message_type: The type of the prompt, e.g. "keyword" or "analysis".
+        :param candidates: The number of candidate prompts.
+        :param budget: The wall-clock budget in seconds.
+        :param max_workers: The maximum number of LLM calls running at the same time.
+        :param examples: The inputs to run the candidates on, the evaluation set of the type if None.
+        :return: The stored prompt or None if no candidate was scored on the whole sample within the budget
+        or none beat the current prompt.
+        :raise ValueError: If arg message_type is not "keyword" or "analysis".
+        :raise ValueError: If arg candidates or max_workers is not a positive integer or budget is not positive.
+        """
+        if message_type not in SYSTEM_TEMPLATES:
+            raise ValueError(f"Argument message_type must be one of {', '.join(SYSTEM_TEMPLATES)}.")
+        if not isinstance(candidates, int) or candidates < 1:
+            raise ValueError("Argument candidates must be a positive integer.")
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("Argument max_workers must be a positive integer.")
+        if budget <= 0:
+            raise ValueError("Argument budget must be positive.")
+        deadline: float = time.monotonic() + budget
+        prompt: str = self.prompt_repository.latest(message_type) or task
+        evaluation: List[Dict[str, Any]] = examples if examples is not None else self.evaluation_set(message_type = message_type, company = company)
+        if not evaluation:
+            logging.warning(f"No past inputs of the {message_type} prompt to evaluate candidates on, the prompt is left unchanged.")
+            return None
+        texts: Dict[int, str] = {}
+        scores: Dict[int, List[float]] = {}
+        pruned: Set[int] = set()
+        failed: Set[int] = set()
+        stop: threading.Event = threading.Event()
+        futures: Dict[Future, Tuple[str, int]] = {}
+        executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "feedback")
+
+        def evaluate(index: int, text: str) -> Set[Future]:
+            texts[index] = text
+            scores[index] = []
+            scorings: Set[Future] = set()
+            for inputs in evaluation:
+                scoring: Future = executor.submit(in_context(self._score_candidate), message_type, text, problem, inputs, stop)
+                futures[scoring] = ("score", index)
+                scorings.add(scoring)
+            return scorings
+
+        def cancel(indices: Set[int]) -> None:
+            for other, (_, owner) in futures.items():
+                if owner in indices:
+                    other.cancel()
+
+        try:
+            # the current prompt is scored on the same sample, a candidate has to beat it to be stored
+            pending: Set[Future] = evaluate(BASELINE, prompt)
+            for index in range(candidates):
+                strategy: str = REVISION_STRATEGIES[index % len(REVISION_STRATEGIES)]
+                candidate: Future = executor.submit(in_context(self._generate_candidate), prompt, company, problem, strategy, index + 1, stop)
+                futures[candidate] = ("candidate", index)
+                pending.add(candidate)
+            while pending:
+                remaining: float = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.warning(f"Prompt optimization ran out of its budget of {budget} seconds.")
+                    break
+                done, pending = wait(pending, timeout = remaining, return_when = FIRST_COMPLETED)
+                for future in done:
+                    kind, index = futures.pop(future)
+                    if future.cancelled() or index in pruned or index in failed:
+                        continue
+                    name: str = "The current prompt" if index == BASELINE else f"Candidate prompt {index + 1}"
+                    try:
+                        result: Any = future.result()
+                    except Exception as e:
+                        logging.error(f"{name} failed: {e}")
+                        if kind == "score":
+                            failed.add(index)
+                            del scores[index]
+                            cancel({index})
+                        continue
+                    if kind == "candidate":
+                        if result:
+                            pending |= evaluate(index, result)
+                        continue
+                    if result is None:
+                        continue
+                    scores[index].append(result)
+                    losers: Set[int] = self._losers(scores = scores, total = len(evaluation)) - pruned
+                    if losers:
+                        pruned |= losers
+                        cancel(losers)
+        finally:
+            stop.set()
+            executor.shutdown(wait = False, cancel_futures = True)
+        ranked: List[Tuple[float, int]] = [
+            (sum(values) / len(values), index) for index, values in scores.items()
+            if index != BASELINE and len(values) == len(evaluation) and index not in pruned
+        ]
+        logging.info(
+            f"Prompt optimization generated {len(texts) - 1} of {candidates} candidates, cancelled {len(pruned - {BASELINE})}, "
+            f"dropped {len(failed - {BASELINE})} failed, fully scored {len(ranked)}."
+        )
+        if not ranked:
+            logging.warning("No candidate prompt was scored on the whole sample without failing or being outscored, the prompt is left unchanged.")
+            return None
+        # the best mean the current prompt can still reach, exact if it was scored on the whole sample
+        baseline_values: List[float] = scores.get(BASELINE, [])
+        baseline: float = 0.0 if BASELINE in failed else (sum(baseline_values) + MAX_SCORE * (len(evaluation) - len(baseline_values))) / len(evaluation)
+        mean, best = max(ranked, key = lambda item: (item[0], -item[1]))
+        if mean <= baseline:
+            logging.warning(f"No candidate prompt beat the current prompt ({mean:.2f} vs. {baseline:.2f}), the prompt is left unchanged.")
+            return None
+        self.prompt_repository.insert(message = texts[best], message_type = message_type)
+        return texts[best]
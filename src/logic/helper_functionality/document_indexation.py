@@ -3,14 +3,15 @@ File that contains the logic for indexation of documents.
 """
 import re
 import logging
-from typing import List, Sequence, Literal, Optional
+from typing import Dict, List, Sequence, Set, Literal, Optional
 
 from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Pinecone
-import pinecone 
 
+from src.logic.helper_functionality.embedding_store import CachedEmbeddings, content_hash
+from src.logic.helper_functionality.vector_store import VectorStoreBackend, get_vector_store
 from src.logic.config import secrets as config_secrets
 
 class Indexer():
@@ -18,23 +19,42 @@ class Indexer():
     Class that contains the logic/tools for the risk types index.
     """
 
-    def __init__(self) -> None:
-        pinecone.init(
-            api_key = config_secrets.read_pinecone_credentials(),
-            environment = "us-west4-gcp"
-        )
+    def __init__(self, backend: Optional[str] = None, embeddings: Optional[Embeddings] = None, store: Optional[VectorStoreBackend] = None) -> None:
+        """
+        Initialize the Indexer.
+
+        :param backend: The vector store backend, either "local" or "pinecone". See get_vector_store for the default.
+        :param embeddings: The embeddings of the chunks, the cached OpenAI embeddings if None.
+        :param store: The vector store to index into, overriding the index arguments of do_indexation.
+        """
+        self.backend: Optional[str] = backend
+        self.store: Optional[VectorStoreBackend] = store
+        self._embeddings: Optional[Embeddings] = embeddings
+
+    @property
+    def embeddings(self) -> Embeddings:
+        """
+        The OpenAI embeddings backed by the persistent embedding store, created on first use.
+        """
+        if self._embeddings is None:
+            self._embeddings = CachedEmbeddings(
+                embeddings = OpenAIEmbeddings(openai_api_key = config_secrets.read_openai_credentials())
+            )
+        return self._embeddings
 
-    def do_indexation(self, documents: List[Document], namespace: Optional[str] = None, index_name: Optional[str] = "index", metric: Optional[str] = "cosine", pod_type: Optional[str] = "p1.x1") -> None:
+    def do_indexation(self, documents: List[Document], namespace: Optional[str] = None, index_name: Optional[str] = "index", metric: Optional[str] = "cosine", pod_type: Optional[str] = "p1.x1") -> Dict[str, int]:
         """
         Index a document in a vectorstore. Creates a new index if an index with the provided name 
-        doesn't already exist.
+        doesn't already exist. Chunks are identified by the hash of their content, so only new or
+        changed chunks are embedded and upserted.
 
         :param documents: The documents to be indexed.
         :param namespace: The namespace to be used for the index.
         :param index_name: The name of the index to be used.
         :param metric: The metric to be used for the index.
         :param pod_type: The pod type to be used for the index.
-        :return: None
+        :return: The number of chunks, of chunks that were indexed and of chunks that were skipped
+        because they are already in the index or duplicate another chunk.
         :raise ValueError: If arg documents is not a list of Documents or if the list is empty.
         :raise TypeError: If arg namespace is not a string.
         :raise ValueError: If arg index_name is not a string or if it doesn't match the pattern.
@@ -61,21 +81,24 @@ class Indexer():
             split_documents: List[Document] = RecursiveCharacterTextSplitter(
                 chunk_size = chunk_size, chunk_overlap = chunk_overlap
             ).split_documents(documents = documents)
-            embeddings: OpenAIEmbeddings = OpenAIEmbeddings(
-                openai_api_key = config_secrets.read_openai_credentials()
+            chunks: Dict[str, Document] = {content_hash(doc.page_content): doc for doc in split_documents}
+            store: VectorStoreBackend = self.store or get_vector_store(
+                index_name = index_name, namespace = namespace, metric = metric, pod_type = pod_type, backend = self.backend
             )
-            res: List[List[float]] = embeddings.embed_documents([doc.page_content for doc in split_documents])
-            if index_name not in pinecone.list_indexes():
-                pinecone.create_index(
-                    name = index_name,
-                    metric = metric,
-                    dimension = len(res[0]),
-                    pod_type = pod_type
+            existing: Set[str] = store.existing(list(chunks))
+            new_ids: List[str] = [id_ for id_ in chunks if id_ not in existing]
+            if new_ids:
+                res: List[List[float]] = self.embeddings.embed_documents([chunks[id_].page_content for id_ in new_ids])
+                store.upsert(
+                    ids = new_ids,
+                    vectors = res,
+                    metadatas = [{**chunks[id_].metadata, "text": chunks[id_].page_content} for id_ in new_ids]
                 )
-                Pinecone.from_documents(documents = split_documents, embedding = embeddings, index_name = index_name, namespace = namespace)
-            else:
-                index: Pinecone = Pinecone.from_existing_index(index_name = index_name, embedding = embeddings, namespace = namespace)
-                index.add_documents(documents = split_documents, namespace = namespace)
+            report: Dict[str, int] = {
+                "chunks": len(split_documents), "indexed": len(new_ids), "skipped": len(split_documents) - len(new_ids)
+            }
+            logging.info(f"Indexed {report['indexed']} chunks, skipped {report['skipped']} unchanged chunks.")
         except (ValueError, TypeError) as e:
             logging.error(e)
-            raise ValueError(f"Error: {e}") from e
\ No newline at end of file
+            raise ValueError(f"Error: {e}") from e
+        return report
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+File that contains the logic for the persistent embedding store.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from langchain.embeddings.base import Embeddings
+
+from db.prompt_repository import DB_DIR, open_connection
+
+EMBEDDING_CACHE_DB_PATH: str = os.path.join(DB_DIR, "embedding_cache.db")
+
+def content_hash(text: str) -> str:
+    """
+    Calculate the stable content hash of a text.
+
+    :param text: The text to be hashed.
+    :return: The sha256 hex digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore():
+    """
+    Class that persists embeddings in a local SQLite database keyed by the embedding model and the
+    content hash of the embedded text.
+    """
+
+    def __init__(self, db_path: str = EMBEDDING_CACHE_DB_PATH) -> None:
+        """
+        Initialize the EmbeddingStore.
+
+        :param db_path: The path of the SQLite file the embeddings are stored in.
+        """
+        self.db_path: str = db_path
+        self._lock: threading.Lock = threading.Lock()
+        self.conn: sqlite3.Connection = open_connection(self.db_path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT,
+                hash TEXT,
+                vector BLOB,
+                PRIMARY KEY (model, hash)
+            )"""
+        )
+        self.conn.commit()
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """
+        Look up the embeddings of several texts.
+
+        :param model: The name of the embedding model.
+        :param hashes: The content hashes of the texts.
+        :return: The embeddings found, keyed by content hash.
+        """
+        found: Dict[str, List[float]] = {}
+        unique: List[str] = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch: List[str] = unique[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({', '.join('?' * len(batch))})",
+                    (model, *batch)
+                ).fetchall()
+                for hash_, vector in rows:
+                    found[hash_] = np.frombuffer(vector, dtype = np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, Sequence[float]]) -> None:
+        """
+        Store the embeddings of several texts.
+
+        :param model: The name of the embedding model.
+        :param vectors: The embeddings keyed by the content hash of their text.
+        """
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, hash_, np.asarray(vector, dtype = np.float32).tobytes()) for hash_, vector in vectors.items()]
+            )
+            self.conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Class that wraps an embedding model, so every distinct text is only embedded once across runs.
+    """
+
+    def __init__(self, embeddings: Embeddings, store: Optional[EmbeddingStore] = None, model: Optional[str] = None) -> None:
+        """
+        Initialize the CachedEmbeddings.
+
+        :param embeddings: The embedding model to wrap.
+        :param store: The store the embeddings are persisted in.
+        :param model: The name the embeddings are stored under, defaults to the model attribute of the wrapped embeddings.
+        """
+        self.embeddings: Embeddings = embeddings
+        self.store: EmbeddingStore = store or get_embedding_store()
+        self.model: str = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of texts, calling the wrapped model only for texts that were never embedded before.
+
+        :param texts: The texts to embed.
+        :return: The embeddings in the order of the texts.
+        """
+        hashes: List[str] = [content_hash(text) for text in texts]
+        vectors: Dict[str, List[float]] = self.store.get_many(model = self.model, hashes = hashes)
+        missing: Dict[str, str] = {hash_: text for hash_, text in zip(hashes, texts) if hash_ not in vectors}
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            embedded: List[List[float]] = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors: Dict[str, List[float]] = dict(zip(missing.keys(), embedded))
+            self.store.put_many(model = self.model, vectors = new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[hash_] for hash_ in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query, reusing the stored embedding if the text was embedded before.
+
+        :param text: The text to embed.
+        :return: The embedding.
+        """
+        hash_: str = content_hash(text)
+        vector: Optional[List[float]] = self.store.get_many(model = self.model, hashes = [hash_]).get(hash_)
+        if vector is not None:
+            self.hits += 1
+            return vector
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self.store.put_many(model = self.model, vectors = {hash_: vector})
+        return vector
+
+
+_store: Optional[EmbeddingStore] = None
+_store_lock: threading.Lock = threading.Lock()
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """
+    Return the process wide embedding store.
+
+    :return: The embedding store.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore()
+        return _store
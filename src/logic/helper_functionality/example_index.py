@@ -0,0 +1,167 @@
+"""
+File that contains the logic for the persistent few-shot example index.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from langchain.embeddings.base import Embeddings
+
+from src.logic.helper_functionality.embedding_store import CachedEmbeddings, content_hash
+from src.logic.helper_functionality.vector_store import LocalVectorStore, Match
+from src.logic.config import secrets as config_secrets
+
+class ExampleIndex():
+    """
+    Class that keeps the embeddings of the few-shot examples of a JSON file in a local vector store next
+    to the file. Examples are identified by their content hash, so only new or changed examples are
+    embedded when the file changes, and selecting an example only embeds the query.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None, embeddings: Optional[Embeddings] = None) -> None:
+        """
+        Initialize the ExampleIndex. The index is synchronized with the JSON file on first use.
+
+        :param path: The path of the JSON file containing a list of examples.
+        :param index_path: The directory the index is saved in, defaults to the path without its extension
+        followed by ".index".
+        :param embeddings: The embeddings of the examples, the cached OpenAI embeddings if None.
+        """
+        self.path: str = path
+        self.index_path: str = index_path or os.path.splitext(path)[0] + ".index"
+        self.store: LocalVectorStore = LocalVectorStore(path = self.index_path)
+        self._embeddings: Optional[Embeddings] = embeddings
+        self._source_hash: Optional[str] = None
+        self._lock: threading.RLock = threading.RLock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        """
+        The OpenAI embeddings backed by the persistent embedding store, created on first use.
+        """
+        if self._embeddings is None:
+            from langchain.embeddings.openai import OpenAIEmbeddings
+            self._embeddings = CachedEmbeddings(
+                embeddings = OpenAIEmbeddings(openai_api_key = config_secrets.read_openai_credentials())
+            )
+        return self._embeddings
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.index_path, "manifest.json")
+
+    @staticmethod
+    def example_text(example: Dict[str, str]) -> str:
+        """
+        Create the text an example is embedded as, its values ordered by key.
+        """
+        return " ".join(str(example[key]) for key in sorted(example))
+
+    @staticmethod
+    def example_id(example: Dict[str, str]) -> str:
+        """
+        Create the content address of an example.
+        """
+        return content_hash(json.dumps(example, sort_keys = True))
+
+    def _model(self) -> str:
+        return getattr(self.embeddings, "model", type(self.embeddings).__name__)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path, "r", encoding = "utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_manifest(self, source_hash: str) -> None:
+        os.makedirs(self.index_path, exist_ok = True)
+        with open(self._manifest_path, "w", encoding = "utf-8") as file:
+            json.dump({"source_hash": source_hash, "model": self._model()}, file)
+        self._source_hash = source_hash
+
+    def _upsert(self, examples: List[Dict[str, str]]) -> int:
+        """
+        Embed and store the examples that are not in the index yet.
+
+        :return: The number of embedded examples.
+        """
+        examples_by_id: Dict[str, Dict[str, str]] = {self.example_id(example): example for example in examples}
+        existing: Set[str] = self.store.existing(list(examples_by_id))
+        new_ids: List[str] = [id_ for id_ in examples_by_id if id_ not in existing]
+        if new_ids:
+            vectors: List[List[float]] = self.embeddings.embed_documents([self.example_text(examples_by_id[id_]) for id_ in new_ids])
+            self.store.upsert(ids = new_ids, vectors = vectors, metadatas = [examples_by_id[id_] for id_ in new_ids])
+        return len(new_ids)
+
+    def sync(self) -> None:
+        """
+        Bring the index in line with the JSON file. Nothing is embedded if the content hash of the file is
+        the one the index was built from. Otherwise new or changed examples are embedded and removed
+        examples are dropped. A change of the embedding model rebuilds the index.
+        """
+        with self._lock:
+            with open(self.path, "rb") as file:
+                raw: bytes = file.read()
+            source_hash: str = content_hash(raw.decode("utf-8"))
+            if source_hash == self._source_hash:
+                return
+            manifest: Dict[str, Any] = self._read_manifest()
+            if manifest.get("model") not in (None, self._model()):
+                logging.info(f"Embedding model of the example index changed, rebuilding {self.index_path}.")
+                self.store.clear()
+            elif manifest.get("source_hash") == source_hash:
+                self._source_hash = source_hash
+                return
+            examples: List[Dict[str, str]] = json.loads(raw)
+            ids: Set[str] = {self.example_id(example) for example in examples}
+            self.store.delete([id_ for id_ in self.store.ids() if id_ not in ids])
+            embedded: int = self._upsert(examples)
+            logging.info(f"Example index synchronized, embedded {embedded} of {len(examples)} examples.")
+            self._write_manifest(source_hash)
+
+    def add(self, examples: List[Dict[str, str]]) -> int:
+        """
+        Append examples to the JSON file and embed them, e.g. keyword lists accepted in the feedback loop.
+        Examples that are already in the file are skipped.
+
+        :param examples: The examples, each with the same keys as the examples in the file.
+        :return: The number of added examples.
+        :raise ValueError: If arg examples is not a list of dictionaries.
+        """
+        if not isinstance(examples, list) or not all(isinstance(example, dict) for example in examples):
+            raise ValueError("Argument examples must be a list of dictionaries.")
+        with self._lock:
+            self.sync()
+            with open(self.path, "r", encoding = "utf-8") as file:
+                current: List[Dict[str, str]] = json.load(file)
+            known: Set[str] = {self.example_id(example) for example in current}
+            new_examples: List[Dict[str, str]] = []
+            for example in examples:
+                if self.example_id(example) not in known:
+                    known.add(self.example_id(example))
+                    new_examples.append(example)
+            if not new_examples:
+                return 0
+            self._upsert(new_examples)
+            text: str = json.dumps(current + new_examples, indent = 4, ensure_ascii = False)
+            tmp_path: str = self.path + ".tmp"
+            with open(tmp_path, "w", encoding = "utf-8") as file:
+                file.write(text)
+            os.replace(tmp_path, self.path)
+            self._write_manifest(content_hash(text))
+            return len(new_examples)
+
+    def select(self, query: str, k: int = 1) -> List[Dict[str, str]]:
+        """
+        Select the examples most similar to a query.
+
+        :param query: The query, e.g. the prompt the examples are for.
+        :param k: The number of examples.
+        :return: The examples, most similar first.
+        """
+        self.sync()
+        matches: List[Match] = self.store.query(vector = self.embeddings.embed_query(query), k = k)
+        return [dict(metadata) for _, _, metadata in matches]
@@ -0,0 +1,220 @@
+"""
+File that contains the logic for the persistent LLM response cache.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import langchain
+from langchain.cache import BaseCache, RETURN_VAL_TYPE
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+
+from db.prompt_repository import DB_DIR, open_connection
+
+LLM_CACHE_DB_PATH: str = os.path.join(DB_DIR, "llm_cache.db")
+
+class LLMResponseCache(BaseCache):
+    """
+    Class that contains a persistent, content-addressed cache for LLM responses. Entries are keyed by
+    the model parameters (model, temperature, ...) and the exact formatted message list and are stored
+    in a local SQLite database.
+    """
+
+    def __init__(self, db_path: str = LLM_CACHE_DB_PATH, max_entries: Optional[int] = 10000, ttl_seconds: Optional[float] = 60 * 60 * 24 * 7) -> None:
+        """
+        Initialize the LLMResponseCache.
+
+        :param db_path: The path of the SQLite file the responses are stored in.
+        :param max_entries: The maximum number of responses to keep, least recently used entries are evicted first.
+        None disables the size limit.
+        :param ttl_seconds: The time in seconds after which a response expires. None disables the expiry.
+        :raise ValueError: If arg max_entries is not a positive integer or None.
+        :raise ValueError: If arg ttl_seconds is not a positive number or None.
+        """
+        if max_entries is not None and (not isinstance(max_entries, int) or max_entries < 1):
+            raise ValueError("Argument max_entries must be a positive integer or None.")
+        if ttl_seconds is not None and (not isinstance(ttl_seconds, (int, float)) or ttl_seconds <= 0):
+            raise ValueError("Argument ttl_seconds must be a positive number or None.")
+        self.db_path: str = db_path
+        self.max_entries: Optional[int] = max_entries
+        self.ttl_seconds: Optional[float] = ttl_seconds
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._local: threading.local = threading.local()
+        self.conn: sqlite3.Connection = open_connection(self.db_path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                llm TEXT,
+                response TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed_at ON llm_cache (accessed_at)")
+        self.conn.commit()
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        """
+        Create the content address of a request.
+
+        :param prompt: The serialized message list.
+        :param llm_string: The serialized model parameters.
+        :return: The sha256 hex digest of the request.
+        """
+        return hashlib.sha256(f"{llm_string}\n---\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _is_bypassed(self) -> bool:
+        return getattr(self._local, "bypass", False)
+
+    @contextmanager
+    def bypass(self) -> Iterator[None]:
+        """
+        Skip cache lookups for the calls made inside the context on the current thread. The fresh
+        responses are still written to the cache, so subsequent calls profit from them.
+        """
+        previous: bool = self._is_bypassed()
+        self._local.bypass = True
+        try:
+            yield
+        finally:
+            self._local.bypass = previous
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """
+        Look up the cached response for a request.
+
+        :param prompt: The serialized message list.
+        :param llm_string: The serialized model parameters.
+        :return: The cached generations or None if there is no valid entry. Unreadable entries are
+        removed and counted as misses.
+        """
+        if self._is_bypassed():
+            return None
+        key: str = self._key(prompt = prompt, llm_string = llm_string)
+        now: float = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                self.evictions += 1
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            try:
+                generations: RETURN_VAL_TYPE = loads(row[0])
+            except (ValueError, TypeError, KeyError) as e:
+                logging.error(f"Discarding unreadable cache entry: {e}")
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """
+        Store the response for a request and evict expired or surplus entries.
+
+        :param prompt: The serialized message list.
+        :param llm_string: The serialized model parameters.
+        :param return_val: The generations returned by the model.
+        """
+        key: str = self._key(prompt = prompt, llm_string = llm_string)
+        now: float = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, llm, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, llm_string, dumps(list(return_val)), now, now)
+            )
+            self._evict(now = now)
+            self.conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """
+        Remove expired entries and the least recently used entries above max_entries. Expects the
+        lock to be held by the caller.
+
+        :param now: The current timestamp.
+        """
+        if self.ttl_seconds is not None:
+            cursor = self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.evictions += max(cursor.rowcount, 0)
+        if self.max_entries is not None:
+            cursor = self.conn.execute(
+                """DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def clear(self, **kwargs: Any) -> None:
+        """
+        Remove all cached responses.
+        """
+        with self._lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the counters of the cache.
+
+        :return: A dictionary containing hits, misses, evictions and the number of stored entries.
+        """
+        with self._lock:
+            size: int = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": size}
+
+
+def install_llm_cache(db_path: str = LLM_CACHE_DB_PATH, max_entries: Optional[int] = 10000, ttl_seconds: Optional[float] = 60 * 60 * 24 * 7) -> LLMResponseCache:
+    """
+    Register the persistent cache as the global LangChain LLM cache, so every ChatOpenAI call in the
+    pipeline is served from it. Calling it again returns the already installed cache.
+
+    :param db_path: The path of the SQLite file the responses are stored in.
+    :param max_entries: The maximum number of responses to keep.
+    :param ttl_seconds: The time in seconds after which a response expires.
+    :return: The installed cache.
+    """
+    if isinstance(langchain.llm_cache, LLMResponseCache):
+        return langchain.llm_cache
+    langchain.llm_cache = LLMResponseCache(db_path = db_path, max_entries = max_entries, ttl_seconds = ttl_seconds)
+    return langchain.llm_cache
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """
+    Return the installed persistent cache.
+
+    :return: The installed cache or None if none is installed.
+    """
+    if isinstance(langchain.llm_cache, LLMResponseCache):
+        return langchain.llm_cache
+    return None
+
+
+@contextmanager
+def bypass_llm_cache() -> Iterator[None]:
+    """
+    Skip the cache lookup for every LLM call made inside the context on the current thread.
+    """
+    cache: Optional[LLMResponseCache] = get_llm_cache()
+    if cache is None:
+        yield
+        return
+    with cache.bypass():
+        yield
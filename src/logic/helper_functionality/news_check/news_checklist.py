@@ -1,23 +1,62 @@
 """
 File that contains the logic for the news checklist.
 """
+from typing import Dict, List, Optional, Tuple
+
 from src.logic.helper_functionality.news_check.news_relevancy_check import RelevancyChecker
+from src.logic.helper_functionality.news_check.relevancy_prefilter import RelevancyPrefilter
 
 class NewsChecklist():
     """
     Class that contains the logic for the news checklist.
     """
 
-    def __init__(self):
-        self.relevancyChecker: RelevancyChecker  = RelevancyChecker()
+    def __init__(self, prefilter: Optional[RelevancyPrefilter] = None, relevancy_checker: Optional[RelevancyChecker] = None):
+        self.relevancyChecker: RelevancyChecker  = relevancy_checker or RelevancyChecker()
+        self.prefilter: RelevancyPrefilter = prefilter or RelevancyPrefilter()
 
-    def checklist(self, news: dict, company: str) -> int:
+    def checklist(self, news: dict, company: str, keywords: Optional[List[str]] = None) -> int:
         """
         Check whether the news checklist for authenticating the news as relevant as 
-        well as the source as credible (future) is fulfilled.
+        well as the source as credible (future) is fulfilled. Clear cases are decided by
+        the local pre-filter, only ambiguous articles are checked by the relevancy agent.
 
         :param news: The news article to check.
+        :param company: The company the news should be relevant for.
+        :param keywords: The keywords generated for the company, used by the pre-filter.
         :return: 0 if the conditions are fulfilled, 1 otherwise.
         """
-        result: int = self.relevancyChecker.check_relevancy(company = company, news = news["body"]) 
-        return result
\ No newline at end of file
+        result, score = self.prefilter.decide(article = news["body"], company = company, keywords = keywords)
+        if result is None:
+            result = self.relevancyChecker.check_relevancy(company = company, news = news["body"])
+            self.prefilter.record(score = score, verdict = result)
+        return result
+
+    def precheck(self, news: dict, company: str, keywords: Optional[List[str]] = None) -> Tuple[Optional[int], float]:
+        """
+        Run only the local pre-filter on a news article.
+
+        :param news: The news article to check.
+        :param company: The company the news should be relevant for.
+        :param keywords: The keywords generated for the company.
+        :return: 0 if relevant, 1 if irrelevant or None if the relevancy agent has to decide, and the score.
+        """
+        return self.prefilter.decide(article = news["body"], company = company, keywords = keywords)
+
+    def checklist_batch(self, news: List[dict], company: str, scores: List[float]) -> List[int]:
+        """
+        Check several news articles the pre-filter could not decide with batched relevancy checks and
+        record the verdicts as calibration samples.
+
+        :param news: The news articles to check.
+        :param company: The company the news should be relevant for.
+        :param scores: The pre-filter scores of the articles.
+        :return: 0 if the conditions are fulfilled, 1 otherwise, for each article in input order.
+        """
+        verdicts: Dict[str, int] = self.relevancyChecker.check_relevancy_batch(
+            company = company, news = {str(index): article["body"] for index, article in enumerate(news)}
+        )
+        results: List[int] = [verdicts[str(index)] for index in range(len(news))]
+        for score, result in zip(scores, results):
+            self.prefilter.record(score = score, verdict = result)
+        return results
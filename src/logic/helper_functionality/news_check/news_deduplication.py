@@ -0,0 +1,124 @@
+"""
+File that contains the logic for detecting near-duplicate news articles.
+"""
+import hashlib
+import re
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+_MERSENNE_PRIME: int = (1 << 61) - 1
+_MAX_HASH: int = (1 << 32) - 1
+
+class NearDuplicateDetector():
+    """
+    Class that collapses near-duplicate articles (e.g. the same wire story from several outlets) using
+    MinHash signatures of the article bodies and locality-sensitive hashing.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, bands: int = 32, shingle_size: int = 5, llm_calls_per_article: int = 3) -> None:
+        """
+        Initialize the NearDuplicateDetector.
+
+        :param threshold: The estimated Jaccard similarity from which two articles are duplicates.
+        :param num_perm: The number of hash permutations of a MinHash signature.
+        :param bands: The number of LSH bands, must divide num_perm.
+        :param shingle_size: The number of words per shingle.
+        :param llm_calls_per_article: The number of LLM calls the pipeline makes per article (summary,
+        relevancy check and analysis), used to report the calls avoided.
+        :raise ValueError: If arg threshold is not between 0 and 1.
+        :raise ValueError: If arg bands does not divide num_perm.
+        """
+        if not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+            raise ValueError("Argument threshold must be a number between 0 and 1.")
+        if not isinstance(bands, int) or bands < 1 or num_perm % bands != 0:
+            raise ValueError("Argument bands must be a positive integer dividing num_perm.")
+        self.threshold: float = threshold
+        self.num_perm: int = num_perm
+        self.bands: int = bands
+        self.rows: int = num_perm // bands
+        self.shingle_size: int = shingle_size
+        self.llm_calls_per_article: int = llm_calls_per_article
+        generator: np.random.Generator = np.random.default_rng(1)
+        self._a: np.ndarray = generator.integers(1, _MERSENNE_PRIME, size = num_perm, dtype = np.uint64)
+        self._b: np.ndarray = generator.integers(0, _MERSENNE_PRIME, size = num_perm, dtype = np.uint64)
+
+    def _shingles(self, text: str) -> Set[str]:
+        words: List[str] = re.findall(r"\w+", text.lower())
+        if len(words) < self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Calculate the MinHash signature of a text.
+
+        :param text: The text to be hashed.
+        :return: The signature as an array of num_perm hash values.
+        """
+        shingles: Set[str] = self._shingles(text)
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype = np.uint64)
+        hashes: np.ndarray = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size = 4).digest(), "little") for shingle in shingles),
+            dtype = np.uint64, count = len(shingles)
+        )
+        permuted: np.ndarray = ((hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis = 0)
+
+    def similarity(self, first: np.ndarray, second: np.ndarray) -> float:
+        """
+        Estimate the Jaccard similarity of two texts from their signatures.
+        """
+        return float(np.mean(first == second))
+
+    def deduplicate(self, news: List[dict], key: str = "body") -> Tuple[List[dict], Dict[str, int]]:
+        """
+        Collapse clusters of near-duplicate articles into their first article. The other articles of a
+        cluster are kept as linked sources in the list "duplicates" of the representative.
+
+        :param news: The news articles, the first article of a cluster is kept as its representative.
+        :param key: The article field that is compared.
+        :return: The representative articles in input order and a report containing the number of
+        articles, clusters, collapsed duplicates and LLM calls avoided.
+        :raise ValueError: If arg news is not a list.
+        """
+        if not isinstance(news, List):
+            raise ValueError("Argument news must be a List of articles.")
+        signatures: List[np.ndarray] = [self.signature(article.get(key) or "") for article in news]
+        parents: List[int] = list(range(len(news)))
+
+        def find(index: int) -> int:
+            while parents[index] != index:
+                parents[index] = parents[parents[index]]
+                index = parents[index]
+            return index
+
+        buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        for index, signature in enumerate(signatures):
+            for band in range(self.bands):
+                band_key: Tuple[int, bytes] = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                buckets.setdefault(band_key, []).append(index)
+        for candidates in buckets.values():
+            for position, first in enumerate(candidates):
+                for second in candidates[position + 1:]:
+                    root_first, root_second = find(first), find(second)
+                    if root_first != root_second and self.similarity(signatures[first], signatures[second]) >= self.threshold:
+                        parents[max(root_first, root_second)] = min(root_first, root_second)
+        representatives: Dict[int, dict] = {}
+        for index, article in enumerate(news):
+            root: int = find(index)
+            if root == index:
+                representatives[index] = {**article, "duplicates": []}
+            else:
+                representatives[root]["duplicates"].append(
+                    {field: article.get(field) for field in ("uri", "url", "title", "source", "dateTime")}
+                )
+        duplicates: int = len(news) - len(representatives)
+        report: Dict[str, int] = {
+            "articles": len(news),
+            "clusters": len(representatives),
+            "duplicates": duplicates,
+            "llm_calls_avoided": duplicates * self.llm_calls_per_article,
+        }
+        return list(representatives.values()), report
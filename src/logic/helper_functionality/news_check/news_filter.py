@@ -0,0 +1,173 @@
+"""
+File that contains the logic for filtering news articles concurrently.
+"""
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from src.logic.helper_functionality.news_check.news_checklist import NewsChecklist
+from src.logic.helper_functionality.text_summarization import TextSummarizer
+from src.logic.helper_functionality.token_budget import annotate_token_counts
+from src.logic.helper_functionality.tracing import Tracer, get_tracer, in_context
+
+class NewsFilter():
+    """
+    Class that summarizes news articles and runs the news checklist on them with bounded parallelism.
+    """
+
+    def __init__(self, news_checklist: NewsChecklist, text_summarizer: TextSummarizer, max_workers: int = 4, timeout: Optional[float] = 300, batch_size: int = 8) -> None:
+        """
+        Initialize the NewsFilter.
+
+        :param news_checklist: The checklist used to verify the articles.
+        :param text_summarizer: The summarizer used to shorten the article bodies.
+        :param max_workers: The maximum number of articles processed at the same time.
+        :param timeout: The maximum number of seconds an article may take once it started. None disables the timeout.
+        The timeout is cooperative: a timed-out article is reported as failed, but its running LLM call cannot be
+        interrupted and keeps its worker until it returns.
+        :param batch_size: The number of articles the pre-filter could not decide that are checked with one batched LLM call.
+        :raise ValueError: If arg max_workers is not a positive integer.
+        :raise ValueError: If arg timeout is not a positive number or None.
+        :raise ValueError: If arg batch_size is not a positive integer.
+        """
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("Argument max_workers must be a positive integer.")
+        if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+            raise ValueError("Argument timeout must be a positive number or None.")
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError("Argument batch_size must be a positive integer.")
+        self.news_checklist: NewsChecklist = news_checklist
+        self.text_summarizer: TextSummarizer = text_summarizer
+        self.max_workers: int = max_workers
+        self.timeout: Optional[float] = timeout
+        self.batch_size: int = batch_size
+        self.tracer: Tracer = get_tracer()
+
+    def _process(self, article: dict, company: str, keywords: Optional[List[str]], max_tokens: int, started: Dict[int, float], job: int) -> dict:
+        """
+        Summarize a single article and run the local pre-filter on it.
+
+        :return: A copy of the article with the summarized body, the pre-filter verdict or None and its score.
+        """
+        started[job] = time.monotonic()
+        with self.tracer.attributes(company = company, article = job), self.tracer.span("filter.article", kind = "article"):
+            processed: dict = self.text_summarizer.summarize_article(article = article, max_tokens = max_tokens)
+            verdict, score = self.news_checklist.precheck(news = processed, company = company, keywords = keywords)
+        return {"article": processed, "verdict": verdict, "score": score}
+
+    def _verify(self, articles: List[dict], company: str, scores: List[float], started: Dict[int, float], job: int) -> List[int]:
+        """
+        Run the batched checklist on articles the pre-filter could not decide.
+
+        :return: The checklist result of each article in input order.
+        """
+        started[job] = time.monotonic()
+        with self.tracer.attributes(company = company), self.tracer.span("filter.batch", kind = "batch", articles = len(articles)):
+            return self.news_checklist.checklist_batch(news = articles, company = company, scores = scores)
+
+    def stream(self, news: List[dict], company: str, max_tokens: int = 3500, keywords: Optional[List[str]] = None) -> Iterator[dict]:
+        """
+        Filter the news articles concurrently and yield each result as soon as its article finished.
+        Articles the pre-filter cannot decide are collected and checked batch_size at a time with a single
+        LLM call. Results are yielded on the calling thread, so they can be rendered directly.
+
+        :param news: The news articles to filter.
+        :param company: The company the news should be relevant for.
+        :param max_tokens: The maximum number of tokens of a summarized article body.
+        :param keywords: The keywords generated for the company, used by the relevancy pre-filter.
+        :return: An iterator of dictionaries containing the index of the article in the input, the
+        processed article, whether it was verified and an error message if it failed or timed out. An
+        article that failed or timed out before it was summarized is returned unsummarized.
+        :raise ValueError: If arg news is not a list.
+        :raise ValueError: If arg company is not a string or if the string is empty.
+        """
+        if not isinstance(news, List):
+            raise ValueError("Argument news must be a List of articles.")
+        if not isinstance(company, str) or not company:
+            raise ValueError("Argument company must be a non empty string.")
+        if not news:
+            return
+        news = annotate_token_counts(news)
+        workers: int = min(self.max_workers, len(news))
+        started: Dict[int, float] = {}
+        jobs: Dict[Future, Tuple[int, List[int]]] = {}
+        processed: Dict[int, dict] = {}
+        undecided: List[Tuple[int, float]] = []
+        stalled: Set[Future] = set()
+        executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers = workers)
+
+        def submit_batch() -> Future:
+            batch: List[Tuple[int, float]] = undecided[:self.batch_size]
+            del undecided[:self.batch_size]
+            job: int = len(jobs)
+            future: Future = executor.submit(
+                in_context(self._verify), [processed[index] for index, _ in batch], company, [score for _, score in batch], started, job
+            )
+            jobs[future] = (job, [index for index, _ in batch])
+            return future
+
+        try:
+            for index, article in enumerate(news):
+                jobs[executor.submit(in_context(self._process), article, company, keywords, max_tokens, started, index)] = (index, [index])
+            pending = set(jobs)
+            while pending:
+                done, pending = wait(pending, timeout = 1 if self.timeout else None, return_when = FIRST_COMPLETED)
+                for future in done:
+                    job, indices = jobs[future]
+                    try:
+                        result: Any = future.result()
+                    except Exception as e:
+                        for index in indices:
+                            logging.error(f"Filtering article {index} failed: {e}")
+                            yield {"index": index, "article": processed.get(index, news[index]), "verified": False, "error": str(e)}
+                        continue
+                    if job >= len(news):
+                        for index, verified in zip(indices, result):
+                            yield {"index": index, "article": processed[index], "verified": verified == 0, "error": None}
+                        continue
+                    processed[job] = result["article"]
+                    if result["verdict"] is None:
+                        undecided.append((job, result["score"]))
+                    else:
+                        yield {"index": job, "article": result["article"], "verified": result["verdict"] == 0, "error": None}
+                summarizing: bool = any(jobs[future][0] < len(news) for future in pending)
+                while len(undecided) >= self.batch_size or (undecided and not summarizing):
+                    pending.add(submit_batch())
+                if self.timeout is None:
+                    continue
+                now: float = time.monotonic()
+                stalled = {future for future in stalled if not future.done()}
+                for future in list(pending):
+                    job, indices = jobs[future]
+                    if job in started:
+                        timed_out: bool = now - started[job] > self.timeout
+                    else:
+                        # A timed-out job keeps its worker, queued jobs cannot start once they hold all of them
+                        timed_out = len(stalled) >= workers
+                    if not timed_out:
+                        continue
+                    if not future.cancel():
+                        stalled.add(future)
+                    pending.discard(future)
+                    for index in indices:
+                        if job in started:
+                            logging.error(f"Filtering article {index} timed out after {self.timeout} seconds.")
+                        else:
+                            logging.error(f"Filtering article {index} timed out, all workers are held by timed-out articles.")
+                        yield {"index": index, "article": processed.get(index, news[index]), "verified": False, "error": "timeout"}
+        finally:
+            executor.shutdown(wait = False, cancel_futures = True)
+
+    def filter_news(self, news: List[dict], company: str, max_tokens: int = 3500, keywords: Optional[List[str]] = None) -> List[dict]:
+        """
+        Filter the news articles concurrently.
+
+        :param news: The news articles to filter.
+        :param company: The company the news should be relevant for.
+        :param max_tokens: The maximum number of tokens of a summarized article body.
+        :param keywords: The keywords generated for the company, used by the relevancy pre-filter.
+        :return: The results in the order of the input articles.
+        """
+        results: List[dict] = list(self.stream(news = news, company = company, max_tokens = max_tokens, keywords = keywords))
+        return sorted(results, key = lambda result: result["index"])
@@ -1,26 +1,85 @@
 """
 File that contains the logic for the news relevancy check.
 """
+import json
 import logging
 import re
-from typing import Literal, Any
+from typing import Dict, List, Literal, Any, Optional
 
 from langchain.agents import AgentType, initialize_agent, AgentExecutor
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
 from langchain.agents import Tool
+from langchain.schema import BaseMessage
+from langchain.chat_models.base import BaseChatModel
 from langchain import SerpAPIWrapper
 from langchain.utilities import WikipediaAPIWrapper
 
+from src.logic.helper_functionality.token_budget import count_tokens
 from src.logic.langchain_tools.tool_process_thought import process_thoughts
 from src.logic.config import secrets as config_secrets
+from src.logic.helper_functionality.tracing import Tracer, get_tracer
+
+BATCH_SYSTEM_TEMPLATE: str = """You are a risk analyst and your task is to evaluate the relevance of several
+news articles to your company. You will be provided with the company name and a list of news articles, each
+starting with its id in square brackets. Keep in mind that news mentioning aspects such as competitors or their
+products/services in the same market can still be relevant even when not mentioning the company name directly.
+Answer with a JSON array containing one object per article with the keys "id" (the article id), "relevancy"
+(true if the article is directly or indirectly relevant to the company, false otherwise) and "explanation"
+(one sentence of reasoning). Do not add any text before or after the JSON array."""
+BATCH_FEW_SHOT_HUMAN: str = """Please rate the relevancy of the news articles for the company: Gucci.
+[example-1] In a recent sighting that has sent fans into a frenzy, the beloved British singer and style icon, Harry
+Styles, was seen sporting a stunning Gucci tee while expressing his infatuation with the polka dotted franchise.
+[example-2] The city council approved a new bus line connecting the northern suburbs to the main station."""
+BATCH_FEW_SHOT_AI: str = """[{{"id": "example-1", "relevancy": true, "explanation": "The article mentions a signature Gucci tee worn by Harry Styles."}},
+{{"id": "example-2", "relevancy": false, "explanation": "Public transport planning has no connection to Gucci or the luxury fashion market."}}]"""
+BATCH_HUMAN_TEMPLATE: str = """Please rate the relevancy of the news articles for the company: {company}.
+{articles}"""
+
+
+def parse_batch_verdicts(answer: str, ids: List[str]) -> Dict[str, int]:
+    """
+    Parse the per-article verdicts of a batched relevancy answer. The answer is read as a JSON array first,
+    lines of the form "[id] Relevancy: True|False" are accepted as well. Unknown ids are ignored.
+
+    :param answer: The answer of the LLM.
+    :param ids: The ids of the articles in the batch.
+    :return: 0 if the article is relevant, 1 otherwise, keyed by the ids that could be parsed.
+    """
+    verdicts: Dict[str, int] = {}
+    match: Optional[re.Match] = re.search(r"\[\s*\{.*\}\s*\]", answer, re.DOTALL)
+    if match:
+        try:
+            items: Any = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            items = []
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            relevancy: Any = item.get("relevancy")
+            if isinstance(relevancy, str):
+                relevancy = {"true": True, "false": False}.get(relevancy.strip().lower())
+            if str(item.get("id")) in ids and isinstance(relevancy, bool):
+                verdicts[str(item.get("id"))] = 0 if relevancy else 1
+    for article_id, relevancy in re.findall(r"\[?\s*([\w-]+)\s*\]?\W+Relevancy\W+(True|False)", answer, re.IGNORECASE):
+        if article_id in ids and article_id not in verdicts:
+            verdicts[article_id] = 0 if relevancy.lower() == "true" else 1
+    return verdicts
+
 
 class RelevancyChecker():
     """
     Class that contains the logic for the news relevancy check.
     """
     
-    def __init__(self):
+    def __init__(self, llm: Optional[BaseChatModel] = None, search: Optional[SerpAPIWrapper] = None, wikipedia: Optional[WikipediaAPIWrapper] = None):
+        """
+        Initialize the RelevancyChecker.
+
+        :param llm: The chat model of the agent and the batched checks, GPT-4 if None.
+        :param search: The web search of the agent, SerpAPI if None.
+        :param wikipedia: The Wikipedia lookup of the agent.
+        """
         self.system_template: Literal = """system message template"""
         self.system_message_prompt: SystemMessagePromptTemplate = SystemMessagePromptTemplate.from_template(self.system_template)
         self.few_shot_human: SystemMessagePromptTemplate = SystemMessagePromptTemplate.from_template("human message example template", additional_kwargs={"name": "example_user"})
@@ -30,14 +89,15 @@ class RelevancyChecker():
         self.chat_prompt: ChatPromptTemplate = ChatPromptTemplate.from_messages(
             [self.system_message_prompt, self.few_shot_human, self.few_shot_ai, self.human_message_prompt]
         )
-        self.llm: ChatOpenAI = ChatOpenAI(
+        self.tracer: Tracer = get_tracer()
+        self.llm: BaseChatModel = llm or ChatOpenAI(
             model="gpt-4",
             temperature = 0,
             client = self.chat_prompt,
             openai_api_key = config_secrets.read_openai_credentials()
         )
-        self.search: SerpAPIWrapper = SerpAPIWrapper(serpapi_api_key = config_secrets.read_serpapi_credentials())
-        self.wikipedia: WikipediaAPIWrapper = WikipediaAPIWrapper()
+        self.search: SerpAPIWrapper = search or SerpAPIWrapper(serpapi_api_key = config_secrets.read_serpapi_credentials())
+        self.wikipedia: WikipediaAPIWrapper = wikipedia or WikipediaAPIWrapper()
         self.tools = [
             Tool(
                 name = "Search",
@@ -102,9 +162,11 @@ class RelevancyChecker():
             self.chat_prompt = ChatPromptTemplate.from_messages(
                 [self.system_message_prompt, self.few_shot_human, self.few_shot_ai, self.human_message_prompt]
             )
-            relevancy: str = self.agent.run(
-                self.chat_prompt.format_messages(company = company, news = news, few_shot_article = few_shot_article, few_shot_company = few_shot_company, few_shot_answer = few_shot_answer)
-            )
+            with self.tracer.span("relevancy_agent.run", kind = "agent"):
+                relevancy: str = self.agent.run(
+                    self.chat_prompt.format_messages(company = company, news = news, few_shot_article = few_shot_article, few_shot_company = few_shot_company, few_shot_answer = few_shot_answer),
+                    callbacks = self.tracer.callbacks,
+                )
             is_relevant_result: str | Any = re.search(r"Relevancy: (True|False)", relevancy).group(1)
             if is_relevant_result == "True":
                 is_relevant: int = 0
@@ -114,3 +176,72 @@ class RelevancyChecker():
             logging.error(e)
             raise ValueError(f"Error: {e}") from e
         return is_relevant
+
+    def _pack(self, news: Dict[str, str], max_tokens: int) -> List[Dict[str, str]]:
+        """
+        Pack articles into batches whose prompt stays within max_tokens. An article exceeding the budget
+        on its own is sent in a batch of its own.
+        """
+        overhead: int = count_tokens(BATCH_SYSTEM_TEMPLATE + BATCH_FEW_SHOT_HUMAN + BATCH_FEW_SHOT_AI + BATCH_HUMAN_TEMPLATE)
+        batches: List[Dict[str, str]] = [{}]
+        tokens: int = overhead
+        for article_id, article in news.items():
+            # Every article costs about 40 answer tokens on top of its own text.
+            article_tokens: int = count_tokens(article) + 40
+            if batches[-1] and tokens + article_tokens > max_tokens:
+                batches.append({})
+                tokens = overhead
+            batches[-1][article_id] = article
+            tokens += article_tokens
+        return batches
+
+    def _ask_batch(self, company: str, news: Dict[str, str]) -> Dict[str, int]:
+        """
+        Rate a batch of articles with a single LLM call.
+
+        :return: The verdicts that could be parsed, keyed by article id.
+        """
+        chat_prompt: ChatPromptTemplate = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(BATCH_SYSTEM_TEMPLATE),
+            SystemMessagePromptTemplate.from_template(BATCH_FEW_SHOT_HUMAN, additional_kwargs={"name": "example_user"}),
+            SystemMessagePromptTemplate.from_template(BATCH_FEW_SHOT_AI, additional_kwargs={"name": "example_assistant"}),
+            HumanMessagePromptTemplate.from_template(BATCH_HUMAN_TEMPLATE),
+        ])
+        articles: str = "\n".join(f"[{article_id}] {' '.join(article.split())}" for article_id, article in news.items())
+        messages: List[BaseMessage] = chat_prompt.format_messages(company = company, articles = articles)
+        try:
+            with self.tracer.span("relevancy.batch", kind = "llm", articles = len(news)):
+                answer: str = self.llm.predict_messages(messages, callbacks = self.tracer.callbacks).content
+        except Exception as e:
+            logging.error(f"Batched relevancy check failed: {e}")
+            return {}
+        return parse_batch_verdicts(answer = answer, ids = list(news))
+
+    def check_relevancy_batch(self, company: str, news: Dict[str, str], max_tokens: int = 6000) -> Dict[str, int]:
+        """
+        Check whether several news articles are relevant to a company. The articles are packed into as few
+        prompts as fit the token budget, so the instructions and the example are paid once per batch.
+        Articles whose verdict cannot be parsed from the answer are checked one by one.
+
+        :param company: The company the news should be relevant for.
+        :param news: The news articles to check, keyed by article id.
+        :param max_tokens: The maximum number of tokens of a batched prompt including the expected answer.
+        :return: 0 if the news article is relevant, 1 otherwise, keyed by article id.
+        :raise ValueError: If arg company is not a string or if the string is empty.
+        :raise ValueError: If arg news is not a dictionary of non empty strings.
+        """
+        if not isinstance(company, str) or not company:
+            raise ValueError("Argument company must be a non empty string.")
+        if not isinstance(news, dict) or not all(isinstance(article, str) and article for article in news.values()):
+            raise ValueError("Argument news must be a dictionary of non empty strings.")
+        news = {str(article_id): article for article_id, article in news.items()}
+        verdicts: Dict[str, int] = {}
+        for batch in self._pack(news = news, max_tokens = max_tokens):
+            if batch:
+                verdicts.update(self._ask_batch(company = company, news = batch))
+        unparsed: List[str] = [article_id for article_id in news if article_id not in verdicts]
+        if unparsed:
+            logging.info(f"Falling back to single relevancy checks for {len(unparsed)} of {len(news)} articles.")
+        for article_id in unparsed:
+            verdicts[article_id] = self.check_relevancy(company = company, news = news[article_id])
+        return verdicts
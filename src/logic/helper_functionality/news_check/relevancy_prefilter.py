@@ -0,0 +1,226 @@
+"""
+File that contains the logic for the local relevancy pre-filter.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from db.prompt_repository import DB_DIR, ConnectionPool
+
+RELEVANT: int = 0
+IRRELEVANT: int = 1
+PREFILTER_DB_PATH: str = os.path.join(DB_DIR, "relevancy_thresholds.db")
+
+class RelevancyPrefilter():
+    """
+    Class that scores the relevancy of a news article to a company locally with BM25 against the company
+    name and its keywords. Clear cases are decided without the LLM, only the ambiguous middle band is
+    forwarded to the relevancy agent. Nothing is decided locally until the thresholds were calibrated on
+    verdicts of the LLM, and a share of the clear cases keeps being forwarded, so the thresholds can be
+    checked and moved in both directions.
+    """
+
+    def __init__(self, path: str = PREFILTER_DB_PATH, accept_threshold: Optional[float] = None, reject_threshold: Optional[float] = None, company_weight: float = 3.0, k1: float = 1.2, b: float = 0.75, avg_length: int = 400, max_samples: int = 1000, calibrate_every: int = 20, audit_every: Optional[int] = 20) -> None:
+        """
+        Initialize the RelevancyPrefilter. Thresholds and calibration samples saved at path override the
+        default thresholds. They live in SQLite, so the worker processes of a batch run can record
+        samples concurrently. A JSON file next to path with the same name, as written by earlier
+        versions, is imported once. The thresholds are calibrated on load and every calibrate_every
+        recorded samples.
+
+        :param path: The path of the SQLite file the thresholds and calibration samples are stored in.
+        :param accept_threshold: The score from which an article is relevant without asking the LLM,
+        None to accept nothing locally until calibration found a threshold.
+        :param reject_threshold: The score up to which an article is irrelevant without asking the LLM,
+        None to reject nothing locally until calibration found a threshold.
+        :param company_weight: The weight of the company name terms relative to keyword terms.
+        :param k1: The BM25 term frequency saturation.
+        :param b: The BM25 length normalization.
+        :param avg_length: The average article length in words used for the length normalization.
+        :param max_samples: The number of latest calibration samples that are kept.
+        :param calibrate_every: The number of recorded samples after which the thresholds are calibrated.
+        :param audit_every: Every audit_every-th article that could be decided locally is forwarded to the
+        LLM instead, so its verdict is recorded as a calibration sample. None disables the audit.
+        """
+        self.path: str = path
+        self.accept_threshold: Optional[float] = accept_threshold
+        self.reject_threshold: Optional[float] = reject_threshold
+        self.company_weight: float = company_weight
+        self.k1: float = k1
+        self.b: float = b
+        self.avg_length: int = avg_length
+        self.max_samples: int = max_samples
+        self.calibrate_every: int = calibrate_every
+        self.audit_every: Optional[int] = audit_every
+        self._recorded: int = 0
+        self._local: int = 0
+        self.samples: List[Tuple[float, int]] = []
+        self.counters: Dict[str, int] = {"accepted": 0, "rejected": 0, "audited": 0, "forwarded": 0}
+        self._lock: threading.Lock = threading.Lock()
+        self.pool: ConnectionPool = ConnectionPool(path = path, size = 2)
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS prefilter_thresholds (name TEXT PRIMARY KEY, value REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS prefilter_samples (id INTEGER PRIMARY KEY AUTOINCREMENT, score REAL, verdict INTEGER)")
+        self._import_json(os.path.splitext(path)[0] + ".json")
+        self.load()
+        self.calibrate()
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        """
+        Tokenize a text into lower case words with a light plural stemming.
+        """
+        return [re.sub(r"(?<=\w{3})(?<!s)s$", "", word) for word in re.findall(r"\w+", text.lower())]
+
+    def score(self, article: str, company: str, keywords: Optional[List[str]] = None) -> float:
+        """
+        Score the relevancy of an article with BM25, normalized to the range 0 to 1.
+
+        :param article: The text of the news article.
+        :param company: The company the news should be relevant for.
+        :param keywords: The keywords generated for the company.
+        :return: The normalized score, 1 if every query term is saturated in the article.
+        """
+        words: List[str] = self._terms(article)
+        if not words:
+            return 0.0
+        frequencies: Counter = Counter(words)
+        weights: Dict[str, float] = {}
+        for keyword in keywords or []:
+            for term in self._terms(keyword):
+                weights[term] = max(weights.get(term, 0.0), 1.0)
+        for term in self._terms(company):
+            weights[term] = self.company_weight
+        if not weights:
+            return 0.0
+        norm: float = self.k1 * (1 - self.b + self.b * len(words) / self.avg_length)
+        score: float = sum(
+            weight * frequencies[term] * (self.k1 + 1) / (frequencies[term] + norm) for term, weight in weights.items()
+        )
+        return min(score / (sum(weights.values()) * (self.k1 + 1) * 0.5), 1.0)
+
+    def decide(self, article: str, company: str, keywords: Optional[List[str]] = None) -> Tuple[Optional[int], float]:
+        """
+        Decide the relevancy of an article locally if it is a clear case.
+
+        :param article: The text of the news article.
+        :param company: The company the news should be relevant for.
+        :param keywords: The keywords generated for the company.
+        :return: 0 if relevant, 1 if irrelevant or None if the LLM has to decide, and the score.
+        """
+        score: float = self.score(article = article, company = company, keywords = keywords)
+        with self._lock:
+            verdict: Optional[int] = None
+            if self.accept_threshold is not None and score >= self.accept_threshold:
+                verdict = RELEVANT
+            elif self.reject_threshold is not None and score <= self.reject_threshold:
+                verdict = IRRELEVANT
+            if verdict is None:
+                self.counters["forwarded"] += 1
+                return None, score
+            self._local += 1
+            if self.audit_every and self._local % self.audit_every == 0:
+                self.counters["audited"] += 1
+                return None, score
+            self.counters["accepted" if verdict == RELEVANT else "rejected"] += 1
+        return verdict, score
+
+    def record(self, score: float, verdict: int) -> None:
+        """
+        Store the verdict of the LLM for a score as a calibration sample, keeping the latest max_samples
+        samples, and recalibrate every calibrate_every samples.
+
+        :param score: The local score of the article.
+        :param verdict: 0 if the LLM found the article relevant, 1 otherwise.
+        """
+        with self._lock:
+            self.samples.append((score, verdict))
+            del self.samples[:-self.max_samples]
+            self._recorded += 1
+            due: bool = self._recorded % self.calibrate_every == 0
+        with self.pool.connection() as conn:
+            row_id: int = conn.execute("INSERT INTO prefilter_samples (score, verdict) VALUES (?, ?)", (score, verdict)).lastrowid
+            conn.execute("DELETE FROM prefilter_samples WHERE id <= ?", (row_id - self.max_samples,))
+        if due:
+            self.calibrate()
+
+    def calibrate(self, target_precision: float = 0.95, min_samples: int = 20) -> None:
+        """
+        Set the thresholds as far into the middle band as the recorded LLM verdicts allow while local
+        decisions keep agreeing with the LLM at the target precision. The thresholds are derived from the
+        samples alone, so they tighten again when audited local decisions disagree with the LLM, and a
+        side is disabled if no threshold reaches the target precision.
+
+        :param target_precision: The minimum share of local decisions that must match the LLM verdict.
+        :param min_samples: The minimum number of samples required to calibrate.
+        """
+        with self._lock:
+            samples: List[Tuple[float, int]] = sorted(self.samples)
+        accept: Optional[float] = None
+        reject: Optional[float] = None
+        if len(samples) < min_samples:
+            logging.info(f"Not calibrating relevancy thresholds with only {len(samples)} samples.")
+            return
+        # relevant verdicts among the first index samples, so the shares above and below are O(1) each
+        relevant_below: List[int] = [0]
+        for _, verdict in samples:
+            relevant_below.append(relevant_below[-1] + (verdict == RELEVANT))
+        total: int = len(samples)
+        accepted_from: int = total
+        for index in range(total):
+            if (relevant_below[total] - relevant_below[index]) / (total - index) >= target_precision:
+                accept, accepted_from = samples[index][0], index
+                break
+        # the reject side only covers the samples below the accept side, so the two never overlap
+        for index in range(accepted_from, 0, -1):
+            if (index - relevant_below[index]) / index >= target_precision:
+                reject = samples[index - 1][0]
+                break
+        if accept is not None and reject is not None and reject >= accept:
+            reject = None
+        with self._lock:
+            self.accept_threshold, self.reject_threshold = accept, reject
+        self.save()
+
+    def _import_json(self, json_path: str) -> None:
+        try:
+            with open(json_path, "r", encoding = "utf-8") as file:
+                data: dict = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT COUNT(*) FROM prefilter_samples").fetchone()[0]:
+                return
+            # only the samples are imported, the thresholds of earlier versions were never calibrated
+            conn.executemany(
+                "INSERT INTO prefilter_samples (score, verdict) VALUES (?, ?)", [tuple(sample) for sample in data.get("samples", [])[-self.max_samples:]]
+            )
+        logging.info(f"Imported the relevancy calibration samples from {json_path}.")
+
+    def load(self) -> None:
+        """
+        Load the thresholds and calibration samples from disk if they exist.
+        """
+        with self.pool.connection() as conn:
+            thresholds: Dict[str, Optional[float]] = dict(conn.execute("SELECT name, value FROM prefilter_thresholds").fetchall())
+            samples: List[Tuple[float, int]] = conn.execute(
+                "SELECT score, verdict FROM prefilter_samples ORDER BY id DESC LIMIT ?", (self.max_samples,)
+            ).fetchall()[::-1]
+        with self._lock:
+            self.accept_threshold = thresholds.get("accept_threshold", self.accept_threshold)
+            self.reject_threshold = thresholds.get("reject_threshold", self.reject_threshold)
+            self.samples = [tuple(sample) for sample in samples]
+
+    def save(self) -> None:
+        """
+        Save the thresholds to disk. Calibration samples are stored as they are recorded.
+        """
+        with self._lock:
+            thresholds: Dict[str, Optional[float]] = {"accept_threshold": self.accept_threshold, "reject_threshold": self.reject_threshold}
+        with self.pool.connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO prefilter_thresholds (name, value) VALUES (?, ?)", thresholds.items())
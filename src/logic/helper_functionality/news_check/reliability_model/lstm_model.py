@@ -1,59 +1,100 @@
 """
 This module contains the LSTM model for the fake news detector.
 """
+import os
+from typing import Any, Dict, List, Tuple
+
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
-from sklearn.metrics import accuracy_score
-from keras.models import Sequential
-from keras.layers import LSTM, Dense, Embedding
-from keras.preprocessing.text import Tokenizer
-from keras.utils import pad_sequences
-from keras.optimizers import Adam
-from keras.layers import Dropout
 
-def LSTM_classifier(text: str) -> int:
-    """Predicts whether a news article is reliable or not. 0 is reliable, 1 is not reliable.
-    Takes the text of a news article as input and returns 0 or 1.
-    
-    :param text: The text to be classified.
-    :return: The classification result.
+from src.logic.helper_functionality.news_check.reliability_model.model_registry import model_registry
+
+MODEL_NAME: str = "lstm"
+MODEL_VERSION: str = "1"
+MAX_LEN: int = 100
+
+def train_lstm(data: pd.DataFrame) -> Dict[str, Any]:
+    """Fits the Keras tokenizer and the LSTM classifier on the training data.
+
+    :param data: The training data containing the columns "text" and "fake".
+    :return: The fitted tokenizer, classifier and the accuracy on the test split.
     """
-    data = pd.read_csv("src/logic/helper_functionality/news_check/reliability_model/fake_or_real_news.csv")
+    # keras is imported on first use, so registering the model does not load tensorflow
+    from keras.models import Sequential
+    from keras.layers import LSTM, Dense, Dropout, Embedding
+    from keras.preprocessing.text import Tokenizer
+    from keras.utils import pad_sequences
+    from keras.optimizers import Adam
     X = data["text"].values
-    y = data["label"].values
+    y = data["fake"].values
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.2)
     tokenizer = Tokenizer()
     tokenizer.fit_on_texts(X_train)
     X_train_sequences = tokenizer.texts_to_sequences(X_train)
     X_test_sequences = tokenizer.texts_to_sequences(X_test)
     vocab_size = len(tokenizer.word_index) + 1
-    max_len = 100
-    X_train_padded = pad_sequences(X_train_sequences, maxlen = max_len)
-    X_test_padded = pad_sequences(X_test_sequences, maxlen = max_len)
-    label_encoder = LabelEncoder()
-    y_train_encoded = label_encoder.fit_transform(y_train)
-    y_test_encoded = label_encoder.transform(y_test)
+    X_train_padded = pad_sequences(X_train_sequences, maxlen = MAX_LEN)
+    X_test_padded = pad_sequences(X_test_sequences, maxlen = MAX_LEN)
     model = Sequential()
-    model.add(Embedding(vocab_size, 100, input_length = max_len))
+    model.add(Embedding(vocab_size, 100, input_length = MAX_LEN))
     model.add(LSTM(128))
     model.add(Dropout(0.2))
     model.add(Dense(1, activation = 'sigmoid'))
     learning_rate = 0.001
     optimizer = Adam(learning_rate = learning_rate)
     model.compile(loss = 'binary_crossentropy', optimizer = optimizer, metrics = ['accuracy'])
-    model.fit(X_train_padded, y_train_encoded, validation_data = (X_test_padded, y_test_encoded), epochs = 10, batch_size = 64)
-    y_pred_probabilities = model.predict(X_test_padded)
-    y_pred_classes = (y_pred_probabilities > 0.5).astype(int)
-    y_test_original = label_encoder.inverse_transform(y_test_encoded)
-    y_pred_original = label_encoder.inverse_transform(y_pred_classes.ravel())
-    accuracy = accuracy_score(y_test_original, y_pred_original)
-    print(f'Accuracy: {accuracy}')
-    new_text_sequences = tokenizer.texts_to_sequences([text])
-    new_text_padded = pad_sequences(new_text_sequences, maxlen = max_len)
-    predicted_probabilities = model.predict(new_text_padded)
-    predicted_classes = (predicted_probabilities > 0.5).astype(int)
-    predicted_label = label_encoder.inverse_transform(predicted_classes.ravel()) 
-    print("Predicted Label:", predicted_label)
-    return predicted_label[0]
\ No newline at end of file
+    model.fit(X_train_padded, y_train, validation_data = (X_test_padded, y_test), epochs = 10, batch_size = 64)
+    _, accuracy = model.evaluate(X_test_padded, y_test, verbose = 0)
+    return {"tokenizer": tokenizer, "classifier": model, "accuracy": float(accuracy)}
+
+def save_lstm(artifacts: Dict[str, Any], path: str) -> None:
+    """Saves the fitted tokenizer and the LSTM classifier.
+
+    :param artifacts: The fitted tokenizer and classifier.
+    :param path: The directory to save the artifacts in.
+    """
+    artifacts["classifier"].save(os.path.join(path, "model.keras"))
+    with open(os.path.join(path, "tokenizer.json"), "w", encoding = "utf-8") as file:
+        file.write(artifacts["tokenizer"].to_json())
+
+def load_lstm(path: str) -> Dict[str, Any]:
+    """Loads the fitted tokenizer and the LSTM classifier.
+
+    :param path: The directory the artifacts are saved in.
+    :return: The fitted tokenizer and classifier.
+    """
+    from keras.models import load_model
+    from keras.preprocessing.text import tokenizer_from_json
+    with open(os.path.join(path, "tokenizer.json"), "r", encoding = "utf-8") as file:
+        tokenizer = tokenizer_from_json(file.read())
+    return {"tokenizer": tokenizer, "classifier": load_model(os.path.join(path, "model.keras"))}
+
+model_registry.register(name = MODEL_NAME, version = MODEL_VERSION, trainer = train_lstm, saver = save_lstm, loader = load_lstm)
+
+def LSTM_classifier_batch(texts: List[str], batch_size: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+    """Predicts for a batch of news articles whether they are reliable or not in a single padded tensor
+    pass. 0 is reliable, 1 is not reliable.
+
+    :param texts: The texts to be classified.
+    :param batch_size: The number of sequences the model processes at once.
+    :return: The classification results and the probabilities of the articles not being reliable.
+    """
+    if not texts:
+        return np.empty(0, dtype = int), np.empty(0, dtype = float)
+    from keras.utils import pad_sequences
+    model = model_registry.get(MODEL_NAME)
+    text_sequences = model["tokenizer"].texts_to_sequences(texts)
+    text_padded = pad_sequences(text_sequences, maxlen = MAX_LEN)
+    probabilities = model["classifier"].predict(text_padded, batch_size = batch_size, verbose = 0).ravel()
+    return (probabilities > 0.5).astype(int), probabilities
+
+def LSTM_classifier(text: str) -> int:
+    """Predicts whether a news article is reliable or not. 0 is reliable, 1 is not reliable.
+    Takes the text of a news article as input and returns 0 or 1.
+    
+    :param text: The text to be classified.
+    :return: The classification result.
+    """
+    labels, _ = LSTM_classifier_batch([text])
+    return int(labels[0])
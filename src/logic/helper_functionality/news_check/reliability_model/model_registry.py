@@ -0,0 +1,182 @@
+"""
+This module contains the model registry that trains the fake news detectors once and serves them from disk.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import joblib
+import pandas as pd
+
+DATA_PATH: str = "src/logic/helper_functionality/news_check/reliability_model/fake_or_real_news.csv"
+MODEL_DIR: str = "src/logic/helper_functionality/news_check/reliability_model/models"
+
+Trainer = Callable[[pd.DataFrame], Dict[str, Any]]
+Saver = Callable[[Dict[str, Any], str], None]
+Loader = Callable[[str], Dict[str, Any]]
+
+
+def load_training_data(data_path: str = DATA_PATH) -> pd.DataFrame:
+    """Reads the labelled news articles and adds the column "fake" (0 is reliable, 1 is not reliable).
+
+    :param data_path: The path of the csv file containing the columns "text" and "label".
+    :return: The training data.
+    """
+    data = pd.read_csv(data_path)
+    data["fake"] = data["label"].apply(lambda x: 0 if x == "REAL" else 1)
+    return data.drop("label", axis = 1)
+
+
+def save_joblib(artifacts: Dict[str, Any], path: str) -> None:
+    """Saves the fitted artifacts of a scikit-learn model.
+
+    :param artifacts: The fitted vectorizer and classifier.
+    :param path: The directory to save the artifacts in.
+    """
+    joblib.dump(artifacts, os.path.join(path, "model.joblib"))
+
+
+def load_joblib(path: str) -> Dict[str, Any]:
+    """Loads the fitted artifacts of a scikit-learn model.
+
+    :param path: The directory the artifacts are saved in.
+    :return: The fitted vectorizer and classifier.
+    """
+    return joblib.load(os.path.join(path, "model.joblib"))
+
+
+class ModelRegistry():
+    """
+    Class that trains every registered model once, persists it together with its version and the
+    fingerprint of the training data and loads it lazily for inference.
+    """
+
+    def __init__(self, data_path: str = DATA_PATH, model_dir: str = MODEL_DIR) -> None:
+        self.data_path: str = data_path
+        self.model_dir: str = model_dir
+        self._specs: Dict[str, Dict[str, Any]] = {}
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._fingerprint: Optional[str] = None
+        self._fingerprint_stat: Optional[tuple] = None
+        self._lock: threading.RLock = threading.RLock()
+
+    def register(self, name: str, version: str, trainer: Trainer, saver: Saver = save_joblib, loader: Loader = load_joblib) -> None:
+        """
+        Register a model with the registry.
+
+        :param name: The unique name of the model.
+        :param version: The version of the model code. Changing it invalidates the persisted model.
+        :param trainer: Function that fits the model on the training data and returns its artifacts.
+        :param saver: Function that saves the artifacts to a directory.
+        :param loader: Function that loads the artifacts from a directory.
+        :raise ValueError: If arg name or version is not a string or if the string is empty.
+        """
+        if not isinstance(name, str) or not name:
+            raise ValueError("Argument name must be a non empty string.")
+        if not isinstance(version, str) or not version:
+            raise ValueError("Argument version must be a non empty string.")
+        with self._lock:
+            self._specs[name] = {"version": version, "trainer": trainer, "saver": saver, "loader": loader}
+            self._models.pop(name, None)
+
+    def data_fingerprint(self) -> str:
+        """
+        Calculate the sha256 fingerprint of the training data. The result is reused as long as the
+        size and modification time of the file do not change.
+
+        :return: The hex digest of the training data.
+        """
+        stat = os.stat(self.data_path)
+        current: tuple = (stat.st_size, stat.st_mtime_ns)
+        if self._fingerprint is None or self._fingerprint_stat != current:
+            digest = hashlib.sha256()
+            with open(self.data_path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+            self._fingerprint = digest.hexdigest()
+            self._fingerprint_stat = current
+        return self._fingerprint
+
+    def _model_path(self, name: str) -> str:
+        return os.path.join(self.model_dir, name)
+
+    def _read_metadata(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self._model_path(name), "metadata.json"), "r", encoding = "utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_current(self, name: str) -> bool:
+        """
+        Check whether the persisted model matches the registered version and the training data.
+
+        :param name: The name of the model.
+        :return: True if the persisted model can be used, False otherwise.
+        """
+        metadata: Optional[Dict[str, Any]] = self._read_metadata(name)
+        return bool(metadata) and metadata.get("version") == self._specs[name]["version"] \
+            and metadata.get("data_fingerprint") == self.data_fingerprint()
+
+    def train(self, name: str) -> Dict[str, Any]:
+        """
+        Train a model on the training data and persist its artifacts.
+
+        :param name: The name of the model.
+        :return: The fitted artifacts of the model.
+        :raise ValueError: If no model with the given name is registered.
+        """
+        if name not in self._specs:
+            raise ValueError(f"No model registered with the name '{name}'.")
+        spec: Dict[str, Any] = self._specs[name]
+        with self._lock:
+            start: float = time.perf_counter()
+            artifacts: Dict[str, Any] = spec["trainer"](load_training_data(self.data_path))
+            path: str = self._model_path(name)
+            os.makedirs(path, exist_ok = True)
+            spec["saver"](artifacts, path)
+            metadata: Dict[str, Any] = {
+                "name": name,
+                "version": spec["version"],
+                "data_fingerprint": self.data_fingerprint(),
+                "accuracy": artifacts.get("accuracy"),
+                "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "training_seconds": round(time.perf_counter() - start, 2),
+            }
+            with open(os.path.join(path, "metadata.json"), "w", encoding = "utf-8") as file:
+                json.dump(metadata, file, indent = 4)
+            logging.info(f"Trained model '{name}' with accuracy {metadata['accuracy']}.")
+            self._models[name] = artifacts
+        return artifacts
+
+    def get(self, name: str) -> Dict[str, Any]:
+        """
+        Return the fitted artifacts of a model. The model is loaded from disk on first use and only
+        trained if no persisted model matches its version and the training data.
+
+        :param name: The name of the model.
+        :return: The fitted artifacts of the model.
+        :raise ValueError: If no model with the given name is registered.
+        """
+        model: Optional[Dict[str, Any]] = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._specs:
+            raise ValueError(f"No model registered with the name '{name}'.")
+        with self._lock:
+            if name in self._models:
+                return self._models[name]
+            if self.is_current(name):
+                try:
+                    self._models[name] = self._specs[name]["loader"](self._model_path(name))
+                    return self._models[name]
+                except (OSError, ValueError) as e:
+                    logging.error(f"Could not load model '{name}', retraining: {e}")
+            return self.train(name)
+
+
+model_registry: ModelRegistry = ModelRegistry()
@@ -1,31 +1,57 @@
 """
 This module contains the Random Forest model for the fake news detector.
 """
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.ensemble import RandomForestClassifier
 
-def random_forest_classifier(text: str) -> int:
-    """Predicts whether a news article is reliable or not. 0 is reliable, 1 is not reliable.
-    Takes the text of a news article as input and returns 0 or 1.
-    
-    :param text: The text to be classified.
-    :return: The classification result.
+from src.logic.helper_functionality.news_check.reliability_model.model_registry import model_registry
+
+MODEL_NAME: str = "random_forest"
+MODEL_VERSION: str = "1"
+
+def train_random_forest(data: pd.DataFrame) -> Dict[str, Any]:
+    """Fits the TF-IDF vectorizer and the Random Forest classifier on the training data.
+
+    :param data: The training data containing the columns "text" and "fake".
+    :return: The fitted vectorizer, classifier and the accuracy on the test split.
     """
-    data = pd.read_csv("src/logic/helper_functionality/news_check/reliability_model/fake_or_real_news.csv")
-    print(data)
-    data["fake"] = data["label"].apply(lambda x: 0 if x == "REAL" else 1)
-    data = data.drop("label", axis=1)
     X, y = data["text"], data["fake"]
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.2)
-    vectorizer = TfidfVectorizer(stop_words="english", max_df = 0.7)
+    vectorizer = TfidfVectorizer(stop_words = "english", max_df = 0.7)
     X_train_vectorized = vectorizer.fit_transform(X_train)
     X_test_vectorized = vectorizer.transform(X_test)
     clf = RandomForestClassifier()
     clf.fit(X_train_vectorized, y_train)
-    print(clf.score(X_test_vectorized, y_test))
-    vectorized_text = vectorizer.transform([text])
-    result = clf.predict(vectorized_text)
-    print(result)
-    return result
\ No newline at end of file
+    accuracy = clf.score(X_test_vectorized, y_test)
+    return {"vectorizer": vectorizer, "classifier": clf, "accuracy": float(accuracy)}
+
+model_registry.register(name = MODEL_NAME, version = MODEL_VERSION, trainer = train_random_forest)
+
+def random_forest_classifier_batch(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Predicts for a batch of news articles whether they are reliable or not in a single vectorize and
+    predict pass. 0 is reliable, 1 is not reliable.
+
+    :param texts: The texts to be classified.
+    :return: The classification results and the probabilities of the articles not being reliable.
+    """
+    if not texts:
+        return np.empty(0, dtype = int), np.empty(0, dtype = float)
+    model = model_registry.get(MODEL_NAME)
+    vectorized_texts = model["vectorizer"].transform(texts)
+    probabilities = model["classifier"].predict_proba(vectorized_texts)[:, 1]
+    return (probabilities > 0.5).astype(int), probabilities
+
+def random_forest_classifier(text: str) -> int:
+    """Predicts whether a news article is reliable or not. 0 is reliable, 1 is not reliable.
+    Takes the text of a news article as input and returns 0 or 1.
+    
+    :param text: The text to be classified.
+    :return: The classification result.
+    """
+    labels, _ = random_forest_classifier_batch([text])
+    return int(labels[0])
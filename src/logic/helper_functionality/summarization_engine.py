@@ -0,0 +1,194 @@
+"""
+File that contains the logic for concurrent map-reduce summarization with a chunk summary cache.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from langchain import LLMChain
+from langchain.docstore.document import Document
+from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
+
+from src.logic.helper_functionality.token_budget import count_tokens
+from src.logic.helper_functionality.tracing import Tracer, get_tracer, in_context
+
+from db.prompt_repository import DB_DIR, open_connection
+
+SUMMARY_CACHE_DB_PATH: str = os.path.join(DB_DIR, "summary_cache.db")
+
+class ChunkSummaryCache():
+    """
+    Class that persists chunk summaries in a local SQLite database keyed by the content hash of the
+    chunk and the prompt that summarized it.
+    """
+
+    def __init__(self, db_path: str = SUMMARY_CACHE_DB_PATH) -> None:
+        """
+        Initialize the ChunkSummaryCache.
+
+        :param db_path: The path of the SQLite file the summaries are stored in.
+        """
+        self.db_path: str = db_path
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self.conn: sqlite3.Connection = open_connection(self.db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(text: str, prompt: str) -> str:
+        """
+        Create the content address of a chunk summary.
+
+        :param text: The chunk.
+        :param prompt: The prompt template that summarizes the chunk.
+        :return: The sha256 hex digest of prompt and chunk.
+        """
+        return hashlib.sha256(f"{prompt}\n---\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """
+        Look up several chunk summaries.
+
+        :param keys: The content addresses of the chunks.
+        :return: The summaries found, keyed by content address.
+        """
+        found: Dict[str, str] = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch: List[str] = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({', '.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(dict(rows))
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: str, summary: str) -> None:
+        """
+        Store a chunk summary.
+
+        :param key: The content address of the chunk.
+        :param summary: The summary of the chunk.
+        """
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", (key, summary))
+            self.conn.commit()
+
+
+class SummarizationEngine():
+    """
+    Class that summarizes documents with a map-reduce strategy. The map step runs concurrently and every
+    chunk summary is cached, so repeated or overlapping text is never summarized twice.
+    """
+
+    def __init__(self, map_chain: LLMChain, reduce_chain: BaseCombineDocumentsChain, max_workers: int = 4, token_max: int = 3000, cache: Optional[ChunkSummaryCache] = None, document_variable_name: str = "text") -> None:
+        """
+        Initialize the SummarizationEngine.
+
+        :param map_chain: The chain that summarizes a single chunk.
+        :param reduce_chain: The chain that combines the chunk summaries into the final summary.
+        :param max_workers: The maximum number of chunks summarized at the same time.
+        :param token_max: The maximum number of tokens of the summaries passed to one reduce call.
+        :param cache: The cache for chunk summaries.
+        :param document_variable_name: The input variable of the map prompt that receives the chunk.
+        :raise ValueError: If arg max_workers is not a positive integer.
+        """
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("Argument max_workers must be a positive integer.")
+        self.map_chain: LLMChain = map_chain
+        self.reduce_chain: BaseCombineDocumentsChain = reduce_chain
+        self.max_workers: int = max_workers
+        self.token_max: int = token_max
+        self.cache: ChunkSummaryCache = cache or get_chunk_summary_cache()
+        self.document_variable_name: str = document_variable_name
+        self.tracer: Tracer = get_tracer()
+        self._prompt_id: str = self.map_chain.prompt.template if hasattr(self.map_chain.prompt, "template") else repr(self.map_chain.prompt)
+
+    def map(self, texts: List[str]) -> List[str]:
+        """
+        Summarize chunks concurrently. Identical chunks are summarized once and cached summaries are reused.
+
+        :param texts: The chunks to summarize.
+        :return: The summaries in the order of the chunks.
+        """
+        keys: List[str] = [ChunkSummaryCache.key(text = text, prompt = self._prompt_id) for text in texts]
+        unique: Dict[str, str] = dict(zip(keys, texts))
+        summaries: Dict[str, str] = self.cache.get_many(list(unique))
+        missing: List[str] = [key for key in unique if key not in summaries]
+
+        def summarize_chunk(key: str) -> str:
+            with self.tracer.span("summary.map", kind = "chain"):
+                summary: str = self.map_chain.predict(callbacks = self.tracer.callbacks, **{self.document_variable_name: unique[key]})
+            self.cache.put(key = key, summary = summary)
+            return summary
+
+        if missing:
+            with ThreadPoolExecutor(max_workers = min(self.max_workers, len(missing))) as executor:
+                summaries.update(zip(missing, executor.map(in_context(summarize_chunk), missing)))
+        return [summaries[key] for key in keys]
+
+    def _group(self, summaries: List[str]) -> List[List[str]]:
+        """
+        Split summaries into groups whose token count stays within token_max.
+        """
+        groups: List[List[str]] = [[]]
+        tokens: int = 0
+        for summary in summaries:
+            summary_tokens: int = count_tokens(summary)
+            if groups[-1] and tokens + summary_tokens > self.token_max:
+                groups.append([])
+                tokens = 0
+            groups[-1].append(summary)
+            tokens += summary_tokens
+        return groups
+
+    def reduce(self, summaries: List[str]) -> str:
+        """
+        Combine the chunk summaries into the final summary. Summaries exceeding token_max are first
+        collapsed group by group.
+
+        :param summaries: The chunk summaries.
+        :return: The final summary.
+        """
+        groups: List[List[str]] = self._group(summaries)
+        while len(groups) > 1:
+            summaries = self.map(["\n\n".join(group) for group in groups])
+            groups = self._group(summaries)
+        with self.tracer.span("summary.reduce", kind = "chain"):
+            return self.reduce_chain.run([Document(page_content = summary) for summary in groups[0]], callbacks = self.tracer.callbacks)
+
+    def summarize(self, documents: List[Document]) -> str:
+        """
+        Summarize documents by summarizing each chunk concurrently and combining the results once all
+        chunk summaries are in.
+
+        :param documents: The chunks to summarize.
+        :return: The summary.
+        :raise ValueError: If arg documents is empty.
+        """
+        if not documents:
+            raise ValueError("Argument documents must be a non-empty list of Documents.")
+        return self.reduce(self.map([document.page_content for document in documents]))
+
+
+_cache: Optional[ChunkSummaryCache] = None
+_cache_lock: threading.Lock = threading.Lock()
+
+
+def get_chunk_summary_cache() -> ChunkSummaryCache:
+    """
+    Return the process wide chunk summary cache.
+
+    :return: The chunk summary cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ChunkSummaryCache()
+        return _cache
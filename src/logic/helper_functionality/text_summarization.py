@@ -2,16 +2,17 @@
 File that contains the logic for text segmentation and summarization.
 """
 import logging
-from typing import List
-
-import tiktoken
+from typing import List, Optional
 
 from langchain.chains.summarize import load_summarize_chain
 from langchain.chat_models import ChatOpenAI
+from langchain.chat_models.base import BaseChatModel
 from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains.qa_with_sources.loading import BaseCombineDocumentsChain
 
+from src.logic.helper_functionality.summarization_engine import ChunkSummaryCache, SummarizationEngine
+from src.logic.helper_functionality.token_budget import article_tokens, count_tokens, split_by_tokens
+
 import src.logic.config.secrets as config_secrets
 
 class TextSummarizer():
@@ -19,9 +20,16 @@ class TextSummarizer():
     Class that contains the logic for text segmentation and summarization.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, max_workers: int = 4, llm: Optional[BaseChatModel] = None, cache: Optional[ChunkSummaryCache] = None) -> None:
+        """
+        Initialize the TextSummarizer.
+
+        :param max_workers: The maximum number of chunks summarized at the same time.
+        :param llm: The chat model summarizing the chunks, ChatOpenAI if None.
+        :param cache: The cache of the chunk summaries, the default summary cache if None.
+        """
         self.chain: BaseCombineDocumentsChain = load_summarize_chain(
-            llm = ChatOpenAI(
+            llm = llm or ChatOpenAI(
                 temperature = 0.5,
                 client = Document,
                 openai_api_key = config_secrets.read_openai_credentials(),
@@ -29,6 +37,12 @@ class TextSummarizer():
             chain_type = "map_reduce",
             verbose = True,
         )
+        self.engine: SummarizationEngine = SummarizationEngine(
+            map_chain = self.chain.llm_chain,
+            reduce_chain = self.chain.combine_document_chain,
+            max_workers = max_workers,
+            cache = cache,
+        )
     
     def num_tokens(self, text: str, model: str = "cl100k_base") -> int:
         """
@@ -45,15 +59,15 @@ class TextSummarizer():
         if not isinstance(model, str) or not model.strip():
             raise ValueError("Argument model must be a non-empty string.")
         try:
-           tokens: List[int] = tiktoken.get_encoding(model).encode(text)
+           tokens: int = count_tokens(text, model)
         except ValueError as e:
             raise ValueError(
                 f"Error encoding document with model '{model}': {str(e)}"
             ) from e
-        return len(tokens)
+        return tokens
 
     def summarize_text(
-        self, raw_text: str, max_tokens: int, model: str = "cl100k_base"
+        self, raw_text: str, max_tokens: int, model: str = "cl100k_base", num_tokens: Optional[int] = None
     ) -> str:
         """
         Calulate the number of tokens in a given text and summarizes it if it has more
@@ -62,6 +76,7 @@ class TextSummarizer():
         :param raw_text: The text to be processed.
         :param max_tokens: The maximum number of tokens allowed for a prompt to the
         respective LLM.
+        :param num_tokens: The token count of raw_text if it is already known.
         :return: The summarized text if the original document has more than the specified
         amount of tokens, otherwise the original document.
         :raise ValueError: If arg raw_text is not a string or if the string is empty.
@@ -72,16 +87,34 @@ class TextSummarizer():
         if not isinstance(max_tokens, int) or max_tokens < 1:
             raise ValueError("Argument max_tokens must be a positive integer.")
         try:
-            if self.num_tokens(text = raw_text, model = model) > max_tokens:
-                documents: Document = [Document(page_content = raw_text)]
+            if num_tokens is None:
+                num_tokens = self.num_tokens(text = raw_text, model = model)
+            if num_tokens > max_tokens:
                 chunk_size: int = max_tokens // 2
                 chunk_overlap: int = max_tokens // 10
-                contents: List[Document] = RecursiveCharacterTextSplitter(
-                    chunk_size = chunk_size, chunk_overlap = chunk_overlap
-                ).split_documents(documents = documents)
-                analysis_result: str = self.chain.run(contents)
+                contents: List[Document] = split_by_tokens(
+                    text = raw_text, chunk_size = chunk_size, chunk_overlap = chunk_overlap, encoding_name = model
+                )
+                analysis_result: str = self.engine.summarize(contents)
                 return analysis_result
         except ValueError as e:
             logging.error(e)
             raise ValueError(f"Error: {str(e)} ") from e
         return raw_text
+
+    def summarize_article(self, article: dict, max_tokens: int, model: str = "cl100k_base") -> dict:
+        """
+        Summarize the body of a news article, reusing and updating its token count.
+
+        :param article: The news article.
+        :param max_tokens: The maximum number of tokens allowed for a prompt to the
+        respective LLM.
+        :return: A copy of the article with the summarized body and its token count under "tokens".
+        """
+        tokens: int = article_tokens(article, encoding_name = model)
+        body: str = self.summarize_text(raw_text = article["body"], max_tokens = max_tokens, model = model, num_tokens = tokens)
+        summarized: dict = {**article, "tokens": tokens}
+        if body != article["body"]:
+            summarized["body"] = body
+            summarized["tokens"] = count_tokens(body, model)
+        return summarized
@@ -0,0 +1,116 @@
+"""
+File that contains the logic for counting tokens and splitting text by token budgets.
+"""
+from functools import lru_cache
+from typing import List, Optional
+
+import tiktoken
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+DEFAULT_ENCODING: str = "cl100k_base"
+
+
+@lru_cache(maxsize = None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    """
+    Return a tiktoken encoding, loaded once per process.
+
+    :param encoding_name: The name of the encoding.
+    :return: The encoding.
+    :raise ValueError: If the encoding does not exist.
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize = 4096)
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """
+    Count the tokens of a text. Special tokens in the text are counted as ordinary text. Counts of
+    recently seen texts are served from memory.
+
+    :param text: The text to be tokenized.
+    :param encoding_name: The name of the encoding.
+    :return: The number of tokens.
+    """
+    return len(get_encoding(encoding_name).encode_ordinary(text))
+
+
+def count_tokens_batch(texts: List[str], encoding_name: str = DEFAULT_ENCODING, num_threads: int = 8) -> List[int]:
+    """
+    Count the tokens of several texts on multiple threads.
+
+    :param texts: The texts to be tokenized.
+    :param encoding_name: The name of the encoding.
+    :param num_threads: The number of threads used for encoding.
+    :return: The number of tokens of each text.
+    """
+    if not texts:
+        return []
+    return [len(tokens) for tokens in get_encoding(encoding_name).encode_ordinary_batch(texts, num_threads = num_threads)]
+
+
+def token_splitter(chunk_size: int, chunk_overlap: int, encoding_name: str = DEFAULT_ENCODING) -> RecursiveCharacterTextSplitter:
+    """
+    Create a text splitter whose chunk size and overlap are measured in tokens instead of characters.
+
+    :param chunk_size: The maximum number of tokens of a chunk.
+    :param chunk_overlap: The number of tokens shared by consecutive chunks.
+    :param encoding_name: The name of the encoding.
+    :return: The text splitter.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size = chunk_size,
+        chunk_overlap = chunk_overlap,
+        length_function = lambda text: count_tokens(text, encoding_name),
+    )
+
+
+def split_by_tokens(text: str, chunk_size: int, chunk_overlap: int, encoding_name: str = DEFAULT_ENCODING) -> List[Document]:
+    """
+    Split a text into documents of at most chunk_size tokens.
+
+    :param text: The text to be split.
+    :param chunk_size: The maximum number of tokens of a chunk.
+    :param chunk_overlap: The number of tokens shared by consecutive chunks.
+    :param encoding_name: The name of the encoding.
+    :return: The chunks as documents.
+    """
+    return token_splitter(chunk_size = chunk_size, chunk_overlap = chunk_overlap, encoding_name = encoding_name).split_documents(
+        documents = [Document(page_content = text)]
+    )
+
+
+def annotate_token_counts(news: List[dict], key: str = "body", encoding_name: str = DEFAULT_ENCODING) -> List[dict]:
+    """
+    Add the token count of each article under "tokens", so later stages do not tokenize it again.
+    Articles that already carry a count are reused, the others are copied, so the given articles are not
+    modified.
+
+    :param news: The news articles.
+    :param key: The article field that is counted.
+    :param encoding_name: The name of the encoding.
+    :return: The articles with their token counts, in input order.
+    """
+    missing: List[int] = [index for index, article in enumerate(news) if article.get("tokens") is None]
+    counts: List[int] = count_tokens_batch([news[index].get(key) or "" for index in missing], encoding_name = encoding_name)
+    annotated: List[dict] = list(news)
+    for index, tokens in zip(missing, counts):
+        annotated[index] = {**news[index], "tokens": tokens}
+    return annotated
+
+
+def article_tokens(article: dict, key: str = "body", encoding_name: str = DEFAULT_ENCODING) -> int:
+    """
+    Return the token count of an article, counting it only if it does not carry one yet.
+
+    :param article: The news article.
+    :param key: The article field that is counted.
+    :param encoding_name: The name of the encoding.
+    :return: The number of tokens.
+    """
+    tokens: Optional[int] = article.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(article.get(key) or "", encoding_name)
+    return tokens
@@ -0,0 +1,371 @@
+"""
+File that contains the logic for tracing pipeline spans with token and cost metrics.
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+
+from db.prompt_repository import DB_DIR
+
+TRACES_PATH: str = os.path.join(DB_DIR, "traces.jsonl")
+METRICS_PATH: str = os.path.join(DB_DIR, "metrics.prom")
+
+# USD per 1000 prompt and completion tokens
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default = None)
+_attributes: contextvars.ContextVar = contextvars.ContextVar("trace_attributes", default = {})
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimate the cost of an LLM call.
+
+    :param model: The name of the model, versioned names use the price of their base model.
+    :param prompt_tokens: The number of prompt tokens.
+    :param completion_tokens: The number of completion tokens.
+    :return: The estimated cost in USD, 0 for unknown models.
+    """
+    prices: Optional[Tuple[float, float]] = None
+    for name in sorted(MODEL_PRICES, key = len, reverse = True):
+        if model and model.startswith(name):
+            prices = MODEL_PRICES[name]
+            break
+    if prices is None:
+        return 0.0
+    return prompt_tokens / 1000 * prices[0] + completion_tokens / 1000 * prices[1]
+
+
+def in_context(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Bind a function to the current trace context, so spans it opens on a worker thread belong to the
+    span, run, company and article of the submitting thread.
+
+    :param func: The function submitted to a thread pool.
+    :return: The function running in a copy of the current context on every call.
+    """
+    context: contextvars.Context = contextvars.copy_context()
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
+
+
+class Span():
+    """
+    Class that records one timed operation and the LLM usage that happened directly inside it.
+    """
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.id: str = uuid.uuid4().hex[:16]
+        self.name: str = name
+        self.kind: str = kind
+        self.parent_id: Optional[str] = parent.id if parent else None
+        self.attributes: Dict[str, Any] = attributes
+        self.start: float = time.time()
+        self.duration: float = 0.0
+        self.llm_calls: int = 0
+        self.prompt_tokens: int = 0
+        self.completion_tokens: int = 0
+        self.tool_calls: int = 0
+        self.cost: float = 0.0
+        self.error: Optional[str] = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def record_llm(self, model: Optional[str], prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        Add the usage of an LLM call to the span.
+        """
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += estimate_cost(model = model, prompt_tokens = prompt_tokens, completion_tokens = completion_tokens)
+
+    def record_tool(self) -> None:
+        """
+        Count a tool invocation of an agent running inside the span.
+        """
+        with self._lock:
+            self.tool_calls += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the span as a JSON serializable dictionary.
+        """
+        return {
+            "run": self.attributes.get("run"),
+            "span": self.id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "duration": self.duration,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tool_calls": self.tool_calls,
+            "cost": self.cost,
+            "error": self.error,
+            **{key: value for key, value in self.attributes.items() if key != "run"},
+        }
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Class that adds the token usage of LLM calls and the tool invocations of agents to the current span.
+    """
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        span: Optional[Span] = _current_span.get()
+        if span is None:
+            return
+        usage: Dict[str, int] = (response.llm_output or {}).get("token_usage") or {}
+        span.record_llm(
+            model = (response.llm_output or {}).get("model_name"),
+            prompt_tokens = usage.get("prompt_tokens", 0),
+            completion_tokens = usage.get("completion_tokens", 0),
+        )
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        span: Optional[Span] = _current_span.get()
+        if span is not None:
+            span.record_tool()
+
+
+class Tracer():
+    """
+    Class that collects the spans of pipeline runs and keeps cumulative metrics per span name. The
+    spans can be appended to a JSON lines file and the metrics written to a Prometheus text-format file.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None, max_spans: int = 10000) -> None:
+        """
+        Initialize the Tracer.
+
+        :param jsonl_path: The JSON lines file finished spans are appended to, None disables the export.
+        :param prometheus_path: The file the metrics are written to at the end of every run, None
+        disables the export.
+        :param max_spans: The number of finished spans kept in memory.
+        """
+        self.jsonl_path: Optional[str] = jsonl_path
+        self.prometheus_path: Optional[str] = prometheus_path
+        self.spans: Deque[Span] = deque(maxlen = max_spans)
+        self.metrics: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.handler: TracingCallbackHandler = TracingCallbackHandler()
+        self._lock: threading.Lock = threading.Lock()
+        self._ids: Iterator[int] = itertools.count(1)
+
+    @property
+    def callbacks(self) -> List[BaseCallbackHandler]:
+        """
+        The callbacks to pass to agent, chain and LLM calls, so their usage is recorded on the current span.
+        """
+        return [self.handler]
+
+    @contextmanager
+    def attributes(self, **attributes: Any) -> Iterator[None]:
+        """
+        Attach attributes, e.g. the company or the article index, to all spans opened in the with block.
+        """
+        token: contextvars.Token = _attributes.set({**_attributes.get(), **attributes})
+        try:
+            yield
+        finally:
+            _attributes.reset(token)
+
+    @contextmanager
+    def run(self, name: str, **attributes: Any) -> Iterator[str]:
+        """
+        Trace a pipeline run. All spans opened in the with block carry the id of the run, and the
+        metrics file is written when the run ends.
+
+        :param name: The name of the run, e.g. the pipeline step.
+        :return: The id of the run.
+        """
+        run_id: str = f"{name}-{next(self._ids)}-{uuid.uuid4().hex[:8]}"
+        with self.attributes(run = run_id, **attributes):
+            try:
+                with self.span(name, kind = "run"):
+                    yield run_id
+            finally:
+                self.export_prometheus()
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes: Any) -> Iterator[Span]:
+        """
+        Time an operation. LLM usage and tool calls recorded while the span is the innermost open span
+        are added to it.
+
+        :param name: The name of the operation, e.g. "risk_agent.run".
+        :param kind: The kind of the operation, e.g. "agent", "chain", "llm", "news", "vector" or "db".
+        :return: The span.
+        """
+        span: Span = Span(name = name, kind = kind, parent = _current_span.get(), attributes = {**_attributes.get(), **attributes})
+        token: contextvars.Token = _current_span.set(span)
+        started: float = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        """
+        Store a finished span, update the metrics and append it to the JSON lines file.
+        """
+        record: Dict[str, Any] = span.to_dict()
+        with self._lock:
+            self.spans.append(span)
+            metric: Dict[str, float] = self.metrics.setdefault((span.name, span.kind), {
+                "count": 0, "errors": 0, "seconds": 0.0, "llm_calls": 0, "prompt_tokens": 0,
+                "completion_tokens": 0, "tool_calls": 0, "cost": 0.0,
+            })
+            metric["count"] += 1
+            metric["errors"] += 1 if span.error else 0
+            metric["seconds"] += span.duration
+            for key in ("llm_calls", "prompt_tokens", "completion_tokens", "tool_calls", "cost"):
+                metric[key] += record[key]
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, "a", encoding = "utf-8") as file:
+                        file.write(json.dumps(record, default = str) + "\n")
+                except OSError as e:
+                    logging.error(f"Writing span {span.name} failed: {e}")
+
+    def run_spans(self, run_id: str) -> List[Dict[str, Any]]:
+        """
+        Return the finished spans of a run.
+
+        :param run_id: The id of the run.
+        :return: The spans as dictionaries in the order they finished.
+        """
+        with self._lock:
+            return [span.to_dict() for span in self.spans if span.attributes.get("run") == run_id]
+
+    def breakdown(self, run_id: str, by: str = "name") -> List[Dict[str, Any]]:
+        """
+        Aggregate the spans of a run, e.g. per operation, per company or per article.
+
+        :param run_id: The id of the run.
+        :param by: The span field to group by, e.g. "name", "kind", "company" or "article".
+        :return: One row per group with the number of spans, wall time, tokens, tool calls and cost,
+        sorted by wall time. Tokens and cost are recorded on the innermost span only.
+        """
+        rows: Dict[Any, Dict[str, Any]] = {}
+        spans: List[Dict[str, Any]] = self.run_spans(run_id)
+        groups: Dict[str, Any] = {span["span"]: span.get(by) for span in spans}
+        for span in spans:
+            if span["kind"] == "run":
+                continue
+            row: Dict[str, Any] = rows.setdefault(span.get(by), {
+                by: span.get(by), "spans": 0, "seconds": 0.0, "llm_calls": 0, "prompt_tokens": 0,
+                "completion_tokens": 0, "tool_calls": 0, "cost": 0.0,
+            })
+            row["spans"] += 1
+            for key in ("llm_calls", "prompt_tokens", "completion_tokens", "tool_calls", "cost"):
+                row[key] += span[key]
+            # wall time of a span nested in a span of the same group is already part of its parent
+            if groups.get(span["parent"], object()) != span.get(by):
+                row["seconds"] += span["duration"]
+        return sorted(rows.values(), key = lambda row: row["seconds"], reverse = True)
+
+    def prometheus(self) -> str:
+        """
+        Render the cumulative metrics per span name in the Prometheus text format.
+
+        :return: The metrics.
+        """
+        families: List[Tuple[str, str, str, str]] = [
+            ("pipeline_span_total", "counter", "count", "Number of finished spans."),
+            ("pipeline_span_errors_total", "counter", "errors", "Number of spans that raised."),
+            ("pipeline_span_seconds_total", "counter", "seconds", "Wall time spent in spans."),
+            ("pipeline_llm_calls_total", "counter", "llm_calls", "Number of LLM calls."),
+            ("pipeline_prompt_tokens_total", "counter", "prompt_tokens", "Number of prompt tokens."),
+            ("pipeline_completion_tokens_total", "counter", "completion_tokens", "Number of completion tokens."),
+            ("pipeline_tool_calls_total", "counter", "tool_calls", "Number of agent tool invocations."),
+            ("pipeline_cost_usd_total", "counter", "cost", "Estimated LLM cost in USD."),
+        ]
+        with self._lock:
+            metrics: Dict[Tuple[str, str], Dict[str, float]] = {key: dict(value) for key, value in self.metrics.items()}
+        lines: List[str] = []
+        for family, metric_type, key, description in families:
+            lines.append(f"# HELP {family} {description}")
+            lines.append(f"# TYPE {family} {metric_type}")
+            for (name, kind), metric in sorted(metrics.items()):
+                labels: str = 'name="{}",kind="{}"'.format(name.replace("\\", "\\\\").replace('"', '\\"'), kind)
+                lines.append(f"{family}{{{labels}}} {metric[key]}")
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self) -> None:
+        """
+        Write the metrics to the Prometheus text-format file.
+        """
+        if not self.prometheus_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.prometheus_path) or ".", exist_ok = True)
+            tmp_path: str = self.prometheus_path + ".tmp"
+            with open(tmp_path, "w", encoding = "utf-8") as file:
+                file.write(self.prometheus())
+            os.replace(tmp_path, self.prometheus_path)
+        except OSError as e:
+            logging.error(f"Writing the metrics failed: {e}")
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock: threading.Lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Return the process wide tracer. Unless a tracer was installed with install_tracer, it keeps its spans
+    and metrics in memory only, so tests, benchmarks and scripts do not write to the trace files of the app.
+
+    :return: The tracer.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def install_tracer(jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None, max_spans: int = 10000) -> Tracer:
+    """
+    Replace the process wide tracer, e.g. with one exporting to TRACES_PATH and METRICS_PATH. Components
+    look up the tracer when they are created or used, so it should be installed before they are built.
+    Installing a tracer with the paths of the installed one returns it, so its metrics keep accumulating.
+
+    :param jsonl_path: The JSON lines file finished spans are appended to, None disables the export.
+    :param prometheus_path: The file the metrics are written to, None disables the export.
+    :param max_spans: The number of finished spans kept in memory.
+    :return: The installed tracer.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None or (_tracer.jsonl_path, _tracer.prometheus_path) != (jsonl_path, prometheus_path):
+            _tracer = Tracer(jsonl_path = jsonl_path, prometheus_path = prometheus_path, max_spans = max_spans)
+        return _tracer
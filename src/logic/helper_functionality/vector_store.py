@@ -0,0 +1,405 @@
+"""
+File that contains the vector store backends used for the risk types index.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.schema import BaseRetriever
+
+from src.logic.config import secrets as config_secrets
+from src.logic.helper_functionality.tracing import get_tracer, in_context
+
+from db.prompt_repository import DB_DIR
+
+VECTOR_STORE_DIR: str = os.path.join(DB_DIR, "vector_store")
+METRICS: Tuple[str, ...] = ("cosine", "dotproduct", "euclidean")
+
+Match = Tuple[str, float, Dict[str, Any]]
+
+class VectorStoreBackend(ABC):
+    """
+    Interface of a vector store holding the vectors of one index namespace.
+    """
+
+    @abstractmethod
+    def upsert(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], metadatas: Sequence[Dict[str, Any]]) -> None:
+        """
+        Insert vectors or replace the vectors with the same ids.
+
+        :param ids: The unique ids of the vectors.
+        :param vectors: The vectors.
+        :param metadatas: The metadata stored alongside each vector.
+        """
+
+    @abstractmethod
+    def query(self, vector: Sequence[float], k: int = 4) -> List[Match]:
+        """
+        Find the vectors most similar to a query vector.
+
+        :param vector: The query vector.
+        :param k: The number of matches to return.
+        :return: The ids, scores and metadata of the matches, best match first.
+        """
+
+    @abstractmethod
+    def delete(self, ids: Sequence[str]) -> None:
+        """
+        Remove vectors from the store.
+
+        :param ids: The ids of the vectors to remove.
+        """
+
+    @abstractmethod
+    def count(self) -> int:
+        """
+        Return the number of stored vectors.
+        """
+
+    @abstractmethod
+    def existing(self, ids: Sequence[str]) -> Set[str]:
+        """
+        Return which of the given ids are already stored.
+
+        :param ids: The ids to check.
+        :return: The subset of ids that is stored.
+        """
+
+
+def _check_upsert_args(ids: Sequence[str], vectors: Sequence[Sequence[float]], metadatas: Sequence[Dict[str, Any]]) -> None:
+    if not (len(ids) == len(vectors) == len(metadatas)):
+        raise ValueError("Arguments ids, vectors and metadatas must have the same length.")
+    if len(set(ids)) != len(ids):
+        raise ValueError("Argument ids must not contain duplicates.")
+
+
+class LocalVectorStore(VectorStoreBackend):
+    """
+    Class that keeps the vectors in a memory-mapped float32 matrix on disk with an id/metadata sidecar
+    and answers queries with an exact, vectorised top-k search.
+    """
+
+    def __init__(self, path: str, metric: str = "cosine", initial_capacity: int = 1024) -> None:
+        """
+        Initialize the LocalVectorStore. Opens the store at the given path or creates it on first upsert.
+
+        :param path: The directory the store is saved in.
+        :param metric: The similarity metric, one of cosine, dotproduct or euclidean.
+        :param initial_capacity: The number of rows reserved when the matrix is created.
+        :raise ValueError: If arg metric is not supported.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Argument metric must be one of {', '.join(METRICS)}.")
+        self.path: str = path
+        self.metric: str = metric
+        self.initial_capacity: int = initial_capacity
+        self.dimension: Optional[int] = None
+        self.capacity: int = 0
+        self._ids: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._sq_norms: Optional[np.ndarray] = None
+        self._lock: threading.RLock = threading.RLock()
+        self._load()
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _sidecar_path(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    def _load(self) -> None:
+        try:
+            with open(self._sidecar_path, "r", encoding = "utf-8") as file:
+                sidecar: Dict[str, Any] = json.load(file)
+        except FileNotFoundError:
+            return
+        if sidecar["metric"] != self.metric:
+            logging.warning(f"Vector store at {self.path} uses metric {sidecar['metric']}, ignoring {self.metric}.")
+            self.metric = sidecar["metric"]
+        self.dimension = sidecar["dimension"]
+        self.capacity = sidecar["capacity"]
+        self._ids = sidecar["ids"]
+        self._metadatas = sidecar["metadatas"]
+        self._rows = {id_: row for row, id_ in enumerate(self._ids)}
+        self._matrix = np.memmap(self._matrix_path, dtype = np.float32, mode = "r+", shape = (self.capacity, self.dimension))
+        self._sq_norms = np.einsum("ij,ij->i", self._matrix[:len(self._ids)], self._matrix[:len(self._ids)])
+
+    def _save_sidecar(self) -> None:
+        sidecar: Dict[str, Any] = {
+            "metric": self.metric,
+            "dimension": self.dimension,
+            "capacity": self.capacity,
+            "ids": self._ids,
+            "metadatas": self._metadatas,
+        }
+        tmp_path: str = self._sidecar_path + ".tmp"
+        with open(tmp_path, "w", encoding = "utf-8") as file:
+            json.dump(sidecar, file)
+        os.replace(tmp_path, self._sidecar_path)
+
+    def _reserve(self, rows: int) -> None:
+        """
+        Make sure the matrix has room for the given number of rows, growing the file geometrically.
+        """
+        if rows <= self.capacity:
+            return
+        capacity: int = max(self.initial_capacity, self.capacity)
+        while capacity < rows:
+            capacity *= 2
+        os.makedirs(self.path, exist_ok = True)
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with open(self._matrix_path, "ab") as file:
+            file.truncate(capacity * self.dimension * np.dtype(np.float32).itemsize)
+        self._matrix = np.memmap(self._matrix_path, dtype = np.float32, mode = "r+", shape = (capacity, self.dimension))
+        self.capacity = capacity
+
+    def upsert(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], metadatas: Sequence[Dict[str, Any]]) -> None:
+        _check_upsert_args(ids = ids, vectors = vectors, metadatas = metadatas)
+        if not ids:
+            return
+        matrix: np.ndarray = np.asarray(vectors, dtype = np.float32)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = matrix.shape[1]
+            if matrix.shape[1] != self.dimension:
+                raise ValueError(f"Vectors must have dimension {self.dimension}, got {matrix.shape[1]}.")
+            if self.metric == "cosine":
+                norms: np.ndarray = np.linalg.norm(matrix, axis = 1, keepdims = True)
+                matrix = matrix / np.where(norms == 0, 1, norms)
+            new_ids: List[str] = [id_ for id_ in ids if id_ not in self._rows]
+            self._reserve(len(self._ids) + len(new_ids))
+            for id_ in new_ids:
+                self._rows[id_] = len(self._ids)
+                self._ids.append(id_)
+                self._metadatas.append({})
+            rows: np.ndarray = np.fromiter((self._rows[id_] for id_ in ids), dtype = np.int64, count = len(ids))
+            self._matrix[rows] = matrix
+            for row, metadata in zip(rows, metadatas):
+                self._metadatas[row] = dict(metadata)
+            self._matrix.flush()
+            self._sq_norms = np.einsum("ij,ij->i", self._matrix[:len(self._ids)], self._matrix[:len(self._ids)])
+            self._save_sidecar()
+
+    def query(self, vector: Sequence[float], k: int = 4) -> List[Match]:
+        with self._lock:
+            count: int = len(self._ids)
+            if count == 0 or k < 1:
+                return []
+            query: np.ndarray = np.asarray(vector, dtype = np.float32)
+            if self.metric == "cosine":
+                norm: float = float(np.linalg.norm(query))
+                query = query / (norm or 1)
+            scores: np.ndarray = self._matrix[:count] @ query
+            if self.metric == "euclidean":
+                scores = -(self._sq_norms - 2 * scores + float(query @ query))
+            k = min(k, count)
+            top: np.ndarray = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results: List[Match] = [(self._ids[row], float(scores[row]), self._metadatas[row]) for row in top]
+        if self.metric == "euclidean":
+            results = [(id_, float(np.sqrt(max(-score, 0.0))), metadata) for id_, score, metadata in results]
+        return results
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            removed: bool = False
+            for id_ in ids:
+                row: Optional[int] = self._rows.pop(id_, None)
+                if row is None:
+                    continue
+                last: int = len(self._ids) - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._ids[row] = self._ids[last]
+                    self._metadatas[row] = self._metadatas[last]
+                    self._rows[self._ids[row]] = row
+                self._ids.pop()
+                self._metadatas.pop()
+                removed = True
+            if removed:
+                self._matrix.flush()
+                self._sq_norms = np.einsum("ij,ij->i", self._matrix[:len(self._ids)], self._matrix[:len(self._ids)])
+                self._save_sidecar()
+
+    def clear(self) -> None:
+        """
+        Remove all vectors and the files of the store, so vectors of another dimension can be stored.
+        """
+        with self._lock:
+            if self._matrix is not None:
+                del self._matrix
+            for path in (self._matrix_path, self._sidecar_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.dimension = None
+            self.capacity = 0
+            self._ids = []
+            self._metadatas = []
+            self._rows = {}
+            self._matrix = None
+            self._sq_norms = None
+
+    def ids(self) -> List[str]:
+        """
+        Return the ids of all stored vectors.
+        """
+        with self._lock:
+            return list(self._ids)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._ids)
+
+    def existing(self, ids: Sequence[str]) -> Set[str]:
+        with self._lock:
+            return {id_ for id_ in ids if id_ in self._rows}
+
+
+class PineconeVectorStore(VectorStoreBackend):
+    """
+    Class that stores the vectors of one namespace in a Pinecone index.
+    """
+
+    _initialized: bool = False
+    _init_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, index_name: str, namespace: Optional[str] = None, metric: str = "cosine", pod_type: str = "p1.x1") -> None:
+        self.index_name: str = index_name
+        self.namespace: Optional[str] = namespace
+        self.metric: str = metric
+        self.pod_type: str = pod_type
+        self._index: Any = None
+
+    @classmethod
+    def _init_pinecone(cls) -> None:
+        with cls._init_lock:
+            if not cls._initialized:
+                import pinecone
+                pinecone.init(
+                    api_key = config_secrets.read_pinecone_credentials(),
+                    environment = "us-west4-gcp"
+                )
+                cls._initialized = True
+
+    def _index_exists(self) -> bool:
+        if self._index is not None:
+            return True
+        self._init_pinecone()
+        import pinecone
+        return self.index_name in pinecone.list_indexes()
+
+    def _get_index(self, dimension: Optional[int] = None) -> Any:
+        if self._index is None:
+            self._init_pinecone()
+            import pinecone
+            if self.index_name not in pinecone.list_indexes():
+                if dimension is None:
+                    raise ValueError(f"Index '{self.index_name}' does not exist.")
+                pinecone.create_index(name = self.index_name, metric = self.metric, dimension = dimension, pod_type = self.pod_type)
+            self._index = pinecone.Index(self.index_name)
+        return self._index
+
+    def upsert(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], metadatas: Sequence[Dict[str, Any]]) -> None:
+        _check_upsert_args(ids = ids, vectors = vectors, metadatas = metadatas)
+        if not ids:
+            return
+        index: Any = self._get_index(dimension = len(vectors[0]))
+        items: List[Tuple[str, List[float], Dict[str, Any]]] = list(zip(ids, [list(vector) for vector in vectors], metadatas))
+        for start in range(0, len(items), 100):
+            index.upsert(vectors = items[start:start + 100], namespace = self.namespace)
+
+    def query(self, vector: Sequence[float], k: int = 4) -> List[Match]:
+        response: Any = self._get_index().query(vector = list(vector), top_k = k, include_metadata = True, namespace = self.namespace)
+        return [(match["id"], match["score"], match.get("metadata") or {}) for match in response["matches"]]
+
+    def delete(self, ids: Sequence[str]) -> None:
+        if ids:
+            self._get_index().delete(ids = list(ids), namespace = self.namespace)
+
+    def existing(self, ids: Sequence[str]) -> Set[str]:
+        found: Set[str] = set()
+        ids = list(ids)
+        if not ids or not self._index_exists():
+            # nothing is stored in an index that does not exist yet, the first upsert creates it
+            return found
+        for start in range(0, len(ids), 100):
+            response: Any = self._get_index().fetch(ids = ids[start:start + 100], namespace = self.namespace)
+            found.update(response["vectors"].keys())
+        return found
+
+    def count(self) -> int:
+        if not self._index_exists():
+            return 0
+        stats: Any = self._get_index().describe_index_stats()
+        return stats["namespaces"].get(self.namespace or "", {}).get("vector_count", 0)
+
+
+class VectorStoreRetriever(BaseRetriever):
+    """
+    Class that exposes a vector store backend as a LangChain retriever. The text of a document is
+    read from the metadata key "text".
+    """
+
+    def __init__(self, store: VectorStoreBackend, embeddings: Embeddings, k: int = 4) -> None:
+        self.store: VectorStoreBackend = store
+        self.embeddings: Embeddings = embeddings
+        self.k: int = k
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any = None) -> List[Document]:
+        with get_tracer().span("vector.query", kind = "vector", k = self.k):
+            matches: List[Match] = self.store.query(vector = self.embeddings.embed_query(query), k = self.k)
+        documents: List[Document] = []
+        for _, score, metadata in matches:
+            metadata = dict(metadata)
+            text: str = metadata.pop("text", "")
+            documents.append(Document(page_content = text, metadata = {**metadata, "score": score}))
+        return documents
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: Any = None) -> List[Document]:
+        # neither backend has an asynchronous client, so the query runs on the default executor
+        return await asyncio.get_running_loop().run_in_executor(None, in_context(self._get_relevant_documents), query)
+
+
+_stores: Dict[Tuple[str, str, str], VectorStoreBackend] = {}
+_stores_lock: threading.Lock = threading.Lock()
+
+
+def get_vector_store(index_name: str, namespace: Optional[str] = None, metric: str = "cosine", pod_type: str = "p1.x1", backend: Optional[str] = None) -> VectorStoreBackend:
+    """
+    Return the vector store of an index namespace. Stores are opened once per process.
+
+    :param index_name: The name of the index.
+    :param namespace: The namespace within the index.
+    :param metric: The similarity metric used when the store is created.
+    :param pod_type: The Pinecone pod type used when the index is created.
+    :param backend: Either "local" or "pinecone". Defaults to the environment variable VECTOR_STORE_BACKEND or
+    "pinecone", the index existing deployments were populated in.
+    :return: The vector store.
+    :raise ValueError: If the backend is not supported.
+    """
+    backend = backend or os.environ.get("VECTOR_STORE_BACKEND", "pinecone")
+    key: Tuple[str, str, str] = (backend, index_name, namespace or "")
+    with _stores_lock:
+        if key not in _stores:
+            if backend == "local":
+                path: str = os.path.join(VECTOR_STORE_DIR, index_name, namespace or "default")
+                _stores[key] = LocalVectorStore(path = path, metric = metric)
+            elif backend == "pinecone":
+                _stores[key] = PineconeVectorStore(index_name = index_name, namespace = namespace, metric = metric, pod_type = pod_type)
+            else:
+                raise ValueError("Argument backend must be either 'local' or 'pinecone'.")
+        return _stores[key]
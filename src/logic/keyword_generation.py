@@ -1,9 +1,13 @@
 """
 File that contains the logic for keyword generation.
 """
-import logging
-from typing import List, Literal
 import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple
 
 from langchain.agents import AgentType, initialize_agent, AgentExecutor
 from langchain.chat_models import ChatOpenAI
@@ -14,23 +18,103 @@ from langchain.prompts.chat import (
 )
 from langchain.agents import Tool
 from langchain import SerpAPIWrapper
-from langchain.prompts.example_selector import SemanticSimilarityExampleSelector
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.prompts import FewShotPromptTemplate, PromptTemplate
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import BaseMessage
+from langchain.embeddings.base import Embeddings
 
 from src.logic.langchain_tools.tool_process_thought import process_thoughts
 
 from src.logic.config import secrets as config_secrets
+from src.logic.helper_functionality.tracing import Tracer, get_tracer, in_context
+from src.logic.helper_functionality.example_index import ExampleIndex
+
+from db.prompt_repository import PromptRepository, get_prompt_repository
+from db.keyword_store import KeywordStore, get_keyword_store
+
+EXAMPLES_PATH: str = "content/examples/keyword_examples.json"
+KEYWORD_TTL: float = 60 * 60 * 24 * 7
+KEYWORD_SYSTEM_TEMPLATE: str = """As a risk analyst, your task is to generate a comma-separated list of keywords that 
+            accurately describe a company based on its operations and products. The company name will be passed to you. Include
+            industry-specific terminology to ensure the keywords are tailored to the company's operations. Please return only 
+            the comma-separated list of keywords, without any prefix or suffix, containing only the desired amount of keywords 
+            as your final answer."""
+KEYWORD_HUMAN_TEMPLATE: str = "Please identify {n} keywords for the company {company}."
+BATCH_SYSTEM_TEMPLATE: str = """As a risk analyst, your task is to generate keywords that accurately describe companies
+based on their operations and products. You will be given one request per company, each line starting with the
+company name followed by a colon. Include industry-specific terminology to ensure the keywords are tailored to each
+company's operations. Answer with a JSON object that maps every company name exactly as given to the list of
+keywords requested for it. Do not add any text before or after the JSON object."""
+BATCH_HUMAN_TEMPLATE: str = """{requests}"""
+
+
+def parse_keywords(output_raw: str) -> List[str]:
+    """
+    Split a comma separated keyword answer into cleaned keywords.
+
+    :param output_raw: The raw answer.
+    :return: The keywords.
+    """
+    return [keyword.replace(".", "").replace(" and ", "") for keyword in output_raw.split(", ")]
+
+
+def parse_batch_keywords(answer: str, companies: List[str]) -> Dict[str, List[str]]:
+    """
+    Parse the keywords per company of a batched keyword answer. Company names are matched
+    case-insensitively, unknown companies and empty keyword lists are ignored.
+
+    :param answer: The answer of the LLM, a JSON object mapping companies to keyword lists.
+    :param companies: The companies of the batch.
+    :return: The keywords keyed by the companies as given.
+    """
+    match: Optional[re.Match] = re.search(r"\{.*\}", answer, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        items: Any = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    names: Dict[str, str] = {company.strip().lower(): company for company in companies}
+    result: Dict[str, List[str]] = {}
+    for name, keywords in items.items() if isinstance(items, dict) else []:
+        company: Optional[str] = names.get(str(name).strip().lower())
+        if isinstance(keywords, str):
+            keywords = parse_keywords(keywords)
+        if company and isinstance(keywords, list):
+            cleaned: List[str] = [str(keyword).replace(".", "").strip() for keyword in keywords if str(keyword).strip()]
+            if cleaned:
+                result[company] = cleaned
+    return result
 
-from db.database_connector import DatabaseConnector
 
 class KeywordGenerator():
     """
     Class that contains the logic for keyword generation.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, prompt_repository: Optional[PromptRepository] = None, llm: Optional[BaseChatModel] = None, search: Optional[SerpAPIWrapper] = None, embeddings: Optional[Embeddings] = None, example_index: Optional[ExampleIndex] = None, keyword_store: Optional[KeywordStore] = None, ttl: float = KEYWORD_TTL, refresh_ahead: float = 0.8) -> None:
+        """
+        Initialize the KeywordGenerator.
+
+        :param prompt_repository: The repository of the prompts revised by the feedback loop.
+        :param llm: The chat model of the agent, GPT-4 if None.
+        :param search: The web search of the agent, SerpAPI if None.
+        :param embeddings: The embeddings used to select the few-shot example, OpenAI if None.
+        :param example_index: The index of the few-shot examples, the index of the keyword examples if None.
+        :param keyword_store: The store of the generated keywords.
+        :param ttl: The number of seconds stored keywords are served for.
+        :param refresh_ahead: The share of the ttl after which stored keywords are still served, but
+        regenerated in the background.
+        :raise ValueError: If arg refresh_ahead is not between 0 and 1.
+        """
+        if not 0 < refresh_ahead <= 1:
+            raise ValueError("Argument refresh_ahead must be between 0 and 1.")
+        self.prompt_repository: PromptRepository = prompt_repository or get_prompt_repository()
+        self.keyword_store: KeywordStore = keyword_store or get_keyword_store()
+        self.ttl: float = ttl
+        self.refresh_ahead: float = refresh_ahead
+        self._refreshing: Dict[int, Set[str]] = {}
+        self._refresh_lock: threading.Lock = threading.Lock()
+        self._refresh_executor: Optional[ThreadPoolExecutor] = None
         self.keyword_list: List[str] = []
         self.few_shot_examples: List = []
         self.template: str = """template"""
@@ -43,13 +127,15 @@ class KeywordGenerator():
         self.chat_prompt: ChatPromptTemplate = ChatPromptTemplate.from_messages(
             [self.system_message_prompt, self.few_shot_human, self.few_shot_ai, self.human_message_prompt]
         )
-        self.llm: ChatOpenAI = ChatOpenAI(
+        self.tracer: Tracer = get_tracer()
+        self.llm: BaseChatModel = llm or ChatOpenAI(
             model="gpt-4",
             temperature = 0,
             client = self.chat_prompt,
             openai_api_key = config_secrets.read_openai_credentials()
         )
-        self.search: SerpAPIWrapper = SerpAPIWrapper(serpapi_api_key = config_secrets.read_serpapi_credentials())
+        self.search: SerpAPIWrapper = search or SerpAPIWrapper(serpapi_api_key = config_secrets.read_serpapi_credentials())
+        self.example_index: ExampleIndex = example_index or ExampleIndex(path = EXAMPLES_PATH, embeddings = embeddings)
         self.tools = [
             Tool(
                 name = "Search",
@@ -67,14 +153,6 @@ class KeywordGenerator():
             tools = self.tools, llm = self.llm, agent = AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION, verbose = True
         )
 
-    def createDBConnection(self, db_name: str = "risk.db") -> DatabaseConnector:
-        """
-        Open a connection to the database and return a connection object.
-        """
-        db = DatabaseConnector(db_name)
-        db.open()
-        return db
-    
     def get_few_shot_examples(self, input: str) -> List[str]:
         """
         Choose example from the database to use for the few-shot learning.
@@ -82,31 +160,20 @@ class KeywordGenerator():
         :param input: The input to the few-shot learning.
         :return: The few-shot learning example.
         """
-        with open('./content/examples/keyword_examples.json', 'r') as file:
-            data = json.load(file)
-        example_prompt: PromptTemplate = PromptTemplate(
-            input_variables = ["input", "output"],
-            template = "Input: {input}\nOutput: {output}",
-        )
-        examples = data
-        example_selector = SemanticSimilarityExampleSelector.from_examples(
-            examples,
-            OpenAIEmbeddings(),
-            FAISS,
-            k = 1,
-        )
-        similar_prompt: FewShotPromptTemplate = FewShotPromptTemplate(
-            example_selector = example_selector,
-            example_prompt = example_prompt,
-            prefix = "Please identify n keywords for a company.",
-            suffix = """{input}\nOutput:""",
-            input_variables = ["input"],
-        )
-        result: str = similar_prompt.format(input = input)
-        pairs: List[str] = result.split("\n\n")
-        input: str = pairs[1].split("\nOutput:")[0].strip()
-        output: str = pairs[1].split("\nOutput:")[1].strip()
-        return [input, output]
+        example: Dict[str, str] = self.example_index.select(query = input, k = 1)[0]
+        return [example["input"], example["output"]]
+
+    def add_examples(self, examples: List[Dict[str, str]]) -> int:
+        """
+        Add examples for the few-shot learning, e.g. keyword lists accepted by the user.
+
+        :param examples: The examples, each with an "input" prompt and the "output" keywords.
+        :return: The number of added examples.
+        :raise ValueError: If an example is missing the input or the output.
+        """
+        if not all(isinstance(example, dict) and {"input", "output"} <= set(example) for example in examples):
+            raise ValueError("Every example must contain an input and an output.")
+        return self.example_index.add([{"input": example["input"], "output": example["output"]} for example in examples])
 
     def clean_output(self, output_raw: str) -> None:
         """
@@ -118,11 +185,7 @@ class KeywordGenerator():
         if not isinstance(output_raw, str) or not output_raw:
             raise ValueError("Argument output_raw must be a non empty string")
         try:
-            keyword_list: List[str] = output_raw.split(", ")
-            self.keyword_list = []
-            for keyword in keyword_list:
-                cleaned_keyword: str = keyword.replace(".", "").replace(" and ", "")
-                self.keyword_list.append(cleaned_keyword)
+            self.keyword_list = parse_keywords(output_raw)
         except ValueError as e:
             logging.error(e)
             raise ValueError(f"Error: {e}") from e
@@ -142,41 +205,170 @@ class KeywordGenerator():
         if not isinstance(n, int) or n < 1:
             raise ValueError("Argument num must be a positive integer.")
         try:
-            self.template = """As a risk analyst, your task is to generate a comma-separated list of keywords that 
-            accurately describe a company based on its operations and products. The company name will be passed to you. Include
-            industry-specific terminology to ensure the keywords are tailored to the company's operations. Please return only 
-            the comma-separated list of keywords, without any prefix or suffix, containing only the desired amount of keywords 
-            as your final answer."""
+            self.template = KEYWORD_SYSTEM_TEMPLATE
             self.system_message_prompt = SystemMessagePromptTemplate.from_template(self.template)
             if(message_type and message_type == "keyword"):
-                db = self.createDBConnection()
-                query = "SELECT message FROM prompts WHERE type = ?"
-                result = db.c.execute(query, (message_type,))
-                row = result.fetchone()
-                if row:
-                    self.human_template = row[0]
+                prompt: Optional[str] = self.prompt_repository.latest(message_type)
+                if prompt:
+                    self.human_template = prompt
                     self.few_shot_examples = self.get_few_shot_examples(input=self.human_template)
                 else:
-                    self.human_template = "Please identify {n} keywords for the company {company}."
-                    self.few_shot_examples = self.get_few_shot_examples(input="Please identify {n} keywords for the company {company}.")
+                    self.human_template = KEYWORD_HUMAN_TEMPLATE
+                    self.few_shot_examples = self.get_few_shot_examples(input=KEYWORD_HUMAN_TEMPLATE)
             else:
-                self.human_template = """Please identify {n} keywords for the company {company}."""
-                self.few_shot_examples = self.get_few_shot_examples(input="Please identify {n} keywords for the company {company}.")
+                self.human_template = KEYWORD_HUMAN_TEMPLATE
+                self.few_shot_examples = self.get_few_shot_examples(input=KEYWORD_HUMAN_TEMPLATE)
             self.few_shot_human = SystemMessagePromptTemplate.from_template(self.few_shot_examples[0], additional_kwargs = {"name": "example_user"})
             self.few_shot_ai = SystemMessagePromptTemplate.from_template(self.few_shot_examples[1], additional_kwargs = {"name": "example_assistant"})
             self.human_message_prompt = HumanMessagePromptTemplate.from_template(self.human_template)
             self.chat_prompt = ChatPromptTemplate.from_messages(
                 [self.system_message_prompt, self.few_shot_human, self.few_shot_ai, self.human_message_prompt]
             )
-            result: str = self.agent.run(
-                self.chat_prompt.format_messages(company = company, n = n)
-            )
+            with self.tracer.span("keyword_agent.run", kind = "agent", company = company):
+                result: str = self.agent.run(
+                    self.chat_prompt.format_messages(company = company, n = n), callbacks = self.tracer.callbacks
+                )
             self.clean_output(result)
         except ValueError as e:
-            if message_type and message_type == "keyword":
-                db.close()
             logging.error(e)
             raise ValueError(f"Error: {e}") from e
-        if message_type and message_type == "keyword":
-            db.close()
         return self.keyword_list
+
+    def _prompt_version(self) -> int:
+        return self.prompt_repository.version("keyword") or 0
+
+    def _ask_batch(self, companies: List[str], n: int, prompt: str, example: List[str]) -> Dict[str, List[str]]:
+        """
+        Generate keywords for a batch of companies with a single LLM call. Each company is asked with the
+        keyword prompt of the agent, after the same few-shot example.
+
+        :return: The keywords of the companies that could be parsed.
+        """
+        chat_prompt: ChatPromptTemplate = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(BATCH_SYSTEM_TEMPLATE),
+            SystemMessagePromptTemplate.from_template(example[0], additional_kwargs = {"name": "example_user"}),
+            SystemMessagePromptTemplate.from_template(example[1], additional_kwargs = {"name": "example_assistant"}),
+            HumanMessagePromptTemplate.from_template(BATCH_HUMAN_TEMPLATE),
+        ])
+        try:
+            requests: List[str] = [
+                f"{company}: {HumanMessagePromptTemplate.from_template(prompt).format(company = company, n = n).content}" for company in companies
+            ]
+            messages: List[BaseMessage] = chat_prompt.format_messages(requests = "\n".join(requests))
+            with self.tracer.span("keywords.batch", kind = "llm", companies = len(companies)):
+                answer: str = self.llm.predict_messages(messages, callbacks = self.tracer.callbacks).content
+        except Exception as e:
+            logging.error(f"Batched keyword generation failed: {e}")
+            return {}
+        return parse_batch_keywords(answer = answer, companies = companies)
+
+    def generate_keywords_batch(self, companies: List[str], n: int, batch_size: int = 10, max_workers: int = 4) -> Dict[str, List[str]]:
+        """
+        Generate keywords for many companies, batch_size companies per LLM call with up to max_workers
+        calls at the same time, and put them into the keyword store. The companies are asked with the
+        current keyword prompt and few-shot example, so the keywords are stored under its version, but
+        unlike generate_keywords no agent and no web search is involved.
+
+        :param companies: The companies.
+        :param n: The number of keywords per company.
+        :param batch_size: The number of companies per LLM call.
+        :param max_workers: The maximum number of LLM calls running at the same time.
+        :return: The keywords keyed by company, companies the LLM left out of its answer are missing.
+        :raise ValueError: If arg n, batch_size or max_workers is not a positive integer.
+        """
+        if not isinstance(n, int) or n < 1:
+            raise ValueError("Argument n must be a positive integer.")
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError("Argument batch_size must be a positive integer.")
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("Argument max_workers must be a positive integer.")
+        unique: List[str] = list(dict.fromkeys(company for company in companies if company))
+        batches: List[List[str]] = [unique[start:start + batch_size] for start in range(0, len(unique), batch_size)]
+        if not batches:
+            return {}
+        # read the version before the prompt, so a prompt revised in between is stored under the old version
+        version: int = self._prompt_version()
+        prompt: str = self.prompt_repository.latest("keyword") or KEYWORD_HUMAN_TEMPLATE
+        example: List[str] = self.get_few_shot_examples(input = prompt)
+        keywords: Dict[str, List[str]] = {}
+        with ThreadPoolExecutor(max_workers = min(max_workers, len(batches))) as executor:
+            for result in executor.map(in_context(lambda batch: self._ask_batch(companies = batch, n = n, prompt = prompt, example = example)), batches):
+                if result:
+                    self.keyword_store.put_many(keywords = result, n = n, prompt_version = version)
+                keywords.update(result)
+        logging.info(f"Generated keywords for {len(keywords)} of {len(unique)} companies in {len(batches)} batches.")
+        return keywords
+
+    def prefetch(self, companies: List[str], n: int, batch_size: int = 10, max_workers: int = 4) -> Dict[str, List[str]]:
+        """
+        Make sure the keyword store holds fresh keywords for all companies, e.g. before running a
+        watchlist. Missing and expired companies are generated in batches, companies the batches left
+        out are generated one by one with the agent.
+
+        :param companies: The companies.
+        :param n: The number of keywords per company.
+        :param batch_size: The number of companies per LLM call.
+        :param max_workers: The maximum number of LLM calls running at the same time.
+        :return: The keywords keyed by company.
+        """
+        now: float = time.time()
+        stored: Dict[str, Tuple[List[str], float]] = self.keyword_store.get_many(companies = companies, n = n, prompt_version = self._prompt_version())
+        keywords: Dict[str, List[str]] = {company: entry[0] for company, entry in stored.items() if now - entry[1] < self.ttl}
+        missing: List[str] = [company for company in dict.fromkeys(companies) if company not in keywords]
+        if missing:
+            keywords.update(self.generate_keywords_batch(companies = missing, n = n, batch_size = batch_size, max_workers = max_workers))
+        for company in missing:
+            if company not in keywords:
+                keywords[company] = self.get_keywords(company = company, n = n, force = True)
+        return keywords
+
+    def get_keywords(self, company: str, n: int, force: bool = False) -> List[str]:
+        """
+        Return the keywords of a company from the keyword store, generating them with the agent if they
+        are missing, expired or force is set. Keywords older than refresh_ahead of the ttl are returned
+        immediately and regenerated in the background, so the next call finds them fresh.
+
+        :param company: The company.
+        :param n: The number of keywords.
+        :param force: Whether to regenerate the keywords even if they are stored.
+        :return: The keywords.
+        """
+        version: int = self._prompt_version()
+        entry: Optional[Tuple[List[str], float]] = None if force else self.keyword_store.get(company = company, n = n, prompt_version = version)
+        if entry is not None:
+            keywords, created_at = entry
+            age: float = time.time() - created_at
+            if age < self.ttl:
+                if age >= self.ttl * self.refresh_ahead:
+                    self._refresh_in_background(company = company, n = n)
+                return keywords
+        keywords = list(self.generate_keywords(company = company, n = n, message_type = "keyword"))
+        self.keyword_store.put(company = company, keywords = keywords, n = n, prompt_version = version)
+        return keywords
+
+    def _refresh_in_background(self, company: str, n: int) -> None:
+        """
+        Queue a company for regeneration. Companies queued while a refresh runs are regenerated together
+        in the next batch.
+        """
+        with self._refresh_lock:
+            queued: Set[str] = self._refreshing.setdefault(n, set())
+            if company in queued:
+                return
+            queued.add(company)
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "keyword-refresh")
+            self._refresh_executor.submit(self._refresh, n)
+
+    def _refresh(self, n: int) -> None:
+        with self._refresh_lock:
+            companies: List[str] = sorted(self._refreshing.get(n, set()))
+        if not companies:
+            return
+        try:
+            self.generate_keywords_batch(companies = companies, n = n)
+        except Exception as e:
+            logging.error(f"Refreshing the keywords of {len(companies)} companies failed: {e}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing[n].difference_update(companies)
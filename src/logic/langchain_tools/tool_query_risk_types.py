@@ -2,43 +2,57 @@
 File that contains the tools to query for risk types.
 """
 import logging
+from typing import Optional
 
 from langchain.tools import BaseTool
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import RetrievalQA
-from langchain.vectorstores import Pinecone
 from langchain.embeddings.openai import OpenAIEmbeddings
-import pinecone 
 
+from src.logic.helper_functionality.embedding_store import CachedEmbeddings
+from src.logic.helper_functionality.vector_store import VectorStoreRetriever, get_vector_store
 from src.logic.config import secrets as config_secrets
 
+INDEX_NAME: str = "index-risk"
+NAMESPACE: str = "risk-types"
+
+_embeddings: Optional[CachedEmbeddings] = None
+
+def _get_embeddings() -> CachedEmbeddings:
+    """
+    Return the embeddings used to query the risk types index, created once per process.
+    """
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = CachedEmbeddings(
+            embeddings = OpenAIEmbeddings(openai_api_key = config_secrets.read_openai_credentials())
+        )
+    return _embeddings
+
 class ToolSearchRiskTypes(BaseTool):
     name = "Search Risk Types"
     description = "useful for when you need information for a specific risk type"
 
+    def _ask(self, question: str) -> str:
+        """Answers a question with the documents of the risk types index that are most similar to it."""
+        retriever: VectorStoreRetriever = VectorStoreRetriever(
+            store = get_vector_store(index_name = INDEX_NAME, namespace = NAMESPACE), embeddings = _get_embeddings()
+        )
+        qa = RetrievalQA.from_chain_type(
+            llm = ChatOpenAI(), 
+            chain_type = "map_reduce", 
+            retriever = retriever,
+            verbose = True
+        )
+        return qa.run(question)
+
     def run_find_type(self, query: str) -> str:
         """Queries a vectorstore to find an associated risk type. The tool takes an object of interest 
         (e.g. price increases, brand reputation, etc.) as input and returns the relevant risk type."""
         if not isinstance(query, str) or not type:
             raise ValueError("Argument type must be a non empty string")
         try:
-            pinecone.init(
-                api_key = config_secrets.read_pinecone_credentials(),
-                environment = "us-west4-gcp"
-            )
-            index_name: str = "index-risk"
-            namespace: str = "risk-types"
-            embeddings: OpenAIEmbeddings = OpenAIEmbeddings(
-                openai_api_key = config_secrets.read_openai_credentials()
-            )
-            index: Pinecone = Pinecone.from_existing_index(index_name = index_name, embedding = embeddings, namespace = namespace)
-            qa = RetrievalQA.from_chain_type(
-                llm = ChatOpenAI(), 
-                chain_type = "map_reduce", 
-                retriever = index.as_retriever(),
-                verbose = True
-            )
-            result: str = qa.run(f"What type of risk is associated with {query}. Please provide a detailed explanation.")
+            result: str = self._ask(f"What type of risk is associated with {query}. Please provide a detailed explanation.")
         except ValueError as e:
             logging.error(e)
             raise ValueError(f"Error: {e}") from e
@@ -51,23 +65,7 @@ class ToolSearchRiskTypes(BaseTool):
         if not isinstance(query, str) or not type:
             raise ValueError("Argument type must be a non empty string")
         try:
-            pinecone.init(
-                api_key = config_secrets.read_pinecone_credentials(),
-                environment = "us-west4-gcp"
-            )
-            index_name: str = "index-risk"
-            namespace: str = "risk-types"
-            embeddings: OpenAIEmbeddings = OpenAIEmbeddings(
-                openai_api_key = config_secrets.read_openai_credentials()
-            )
-            index: Pinecone = Pinecone.from_existing_index(index_name = index_name, embedding = embeddings, namespace = namespace)
-            qa = RetrievalQA.from_chain_type(
-                llm = ChatOpenAI(), 
-                chain_type = "map_reduce", 
-                retriever = index.as_retriever(),
-                verbose = True
-            )
-            result: str = qa.run(f"Please provide a detailed explanation of the risk type {query}.")
+            result: str = self._ask(f"Please provide a detailed explanation of the risk type {query}.")
         except ValueError as e:
             logging.error(e)
             raise ValueError(f"Error: {e}") from e
@@ -82,23 +80,7 @@ class ToolSearchRiskTypes(BaseTool):
         if not isinstance(risk_type, str) or not type:
             raise ValueError("Argument risk_type must be a non empty string")
         try:
-            pinecone.init(
-                api_key = config_secrets.read_pinecone_credentials(),
-                environment = "us-west4-gcp"
-            )
-            index_name: str = "index-risk"
-            namespace: str = "risk-types"
-            embeddings: OpenAIEmbeddings = OpenAIEmbeddings(
-                openai_api_key = config_secrets.read_openai_credentials()
-            )
-            index: Pinecone = Pinecone.from_existing_index(index_name = index_name, embedding = embeddings, namespace = namespace)
-            qa = RetrievalQA.from_chain_type(
-                llm = ChatOpenAI(), 
-                chain_type = "map_reduce", 
-                retriever = index.as_retriever(),
-                verbose = True
-            )
-            result: str = qa.run(f"Please provide a detailed explanation of the mitigation strategies for risk type {risk_type}.")
+            result: str = self._ask(f"Please provide a detailed explanation of the mitigation strategies for risk type {risk_type}.")
         except ValueError as e:
             logging.error(e)
             raise ValueError(f"Error: {e}") from e
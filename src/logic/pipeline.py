@@ -0,0 +1,264 @@
+"""
+File that contains the logic for running the risk pipeline as a memoized graph of stages.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.logic.keyword_generation import KeywordGenerator
+from src.data.sources.news_extraction import NewsExtractor
+from src.logic.risk_analysis import RiskAnalysis
+from src.logic.helper_functionality.news_check.news_deduplication import NearDuplicateDetector
+from src.logic.helper_functionality.news_check.news_filter import NewsFilter
+from src.logic.helper_functionality.text_summarization import TextSummarizer
+from src.logic.helper_functionality.tracing import get_tracer
+
+from db.prompt_repository import DB_DIR, open_connection, PromptRepository, get_prompt_repository
+
+STAGE_CACHE_DB_PATH: str = os.path.join(DB_DIR, "stage_cache.db")
+
+def output_hash(output: Any) -> str:
+    """
+    Calculate the content hash of a stage output.
+
+    :param output: The JSON serializable output.
+    :return: The sha256 hex digest of the canonical JSON of the output.
+    """
+    return hashlib.sha256(json.dumps(output, sort_keys = True, default = str).encode("utf-8")).hexdigest()
+
+
+class StageStore():
+    """
+    Class that persists stage outputs in a local SQLite database keyed by the inputs of the stage.
+    """
+
+    def __init__(self, db_path: str = STAGE_CACHE_DB_PATH) -> None:
+        """
+        Initialize the StageStore.
+
+        :param db_path: The path of the SQLite file the outputs are stored in.
+        """
+        self.db_path: str = db_path
+        self._lock: threading.Lock = threading.Lock()
+        self.conn: sqlite3.Connection = open_connection(self.db_path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS stage_outputs (
+                key TEXT PRIMARY KEY,
+                stage TEXT,
+                output TEXT,
+                hash TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )"""
+        )
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Any, str]]:
+        """
+        Look up a stage output.
+
+        :param key: The input key of the stage.
+        :return: The output and its content hash or None if the stage did not run with these inputs.
+        """
+        with self._lock:
+            row: Optional[Tuple[str, str]] = self.conn.execute(
+                "SELECT output, hash FROM stage_outputs WHERE key = ?", (key,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: str, stage: str, output: Any) -> str:
+        """
+        Store a stage output.
+
+        :param key: The input key of the stage.
+        :param stage: The name of the stage.
+        :param output: The JSON serializable output.
+        :return: The content hash of the output.
+        """
+        content_hash: str = output_hash(output)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO stage_outputs (key, stage, output, hash) VALUES (?, ?, ?, ?)",
+                (key, stage, json.dumps(output, default = str), content_hash)
+            )
+            self.conn.commit()
+        return content_hash
+
+    def recent(self, stage: str, limit: int = 10) -> List[Any]:
+        """
+        Return the latest outputs of a stage, e.g. as the evaluation set of the feedback loop.
+
+        :param stage: The name of the stage.
+        :param limit: The maximum number of outputs.
+        :return: The outputs, newest first.
+        """
+        with self._lock:
+            rows: List[Tuple[str]] = self.conn.execute(
+                "SELECT output FROM stage_outputs WHERE stage = ? ORDER BY created_at DESC, rowid DESC LIMIT ?", (stage, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class Stage():
+    """
+    Class that describes one stage of the pipeline: the function computing its output, the stages it
+    depends on, the run parameters it reads and the versions (e.g. of prompts) its output depends on.
+    """
+
+    def __init__(self, name: str, func: Callable[..., Any], dependencies: Iterable[str] = (), parameters: Iterable[str] = (), versions: Optional[Dict[str, Callable[[], Any]]] = None, cacheable: Optional[Callable[[Any], bool]] = None) -> None:
+        """
+        Initialize the Stage.
+
+        :param name: The name of the stage.
+        :param func: The function computing the output, called with the outputs of the dependencies and
+        the parameters as keyword arguments.
+        :param dependencies: The names of the stages whose outputs are passed to func.
+        :param parameters: The names of the run parameters passed to func.
+        :param versions: Functions returning versions that invalidate the output when they change, but are
+        not passed to func.
+        :param cacheable: A function telling whether an output may be stored, e.g. False if part of it
+        failed, so the stage is recomputed on the next run. Every output is stored if None.
+        """
+        self.name: str = name
+        self.func: Callable[..., Any] = func
+        self.dependencies: List[str] = list(dependencies)
+        self.parameters: List[str] = list(parameters)
+        self.versions: Dict[str, Callable[[], Any]] = versions or {}
+        self.cacheable: Optional[Callable[[Any], bool]] = cacheable
+
+
+class StageGraph():
+    """
+    Class that runs stages in dependency order and persists their outputs. A stage is recomputed only if
+    its parameters, its versions or the content of one of its dependencies changed.
+    """
+
+    def __init__(self, store: Optional[StageStore] = None) -> None:
+        """
+        Initialize the StageGraph.
+
+        :param store: The store for stage outputs.
+        """
+        self.store: StageStore = store or StageStore()
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, stage: Stage) -> "StageGraph":
+        """
+        Add a stage. Its dependencies have to be added before it.
+
+        :param stage: The stage.
+        :return: The graph.
+        :raise ValueError: If the stage already exists or one of its dependencies does not.
+        """
+        if stage.name in self.stages:
+            raise ValueError(f"Stage {stage.name} already exists.")
+        missing: List[str] = [dependency for dependency in stage.dependencies if dependency not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {', '.join(missing)}.")
+        self.stages[stage.name] = stage
+        return self
+
+    def key(self, stage: Stage, params: Dict[str, Any], hashes: Dict[str, str]) -> str:
+        """
+        Create the input key of a stage.
+
+        :param stage: The stage.
+        :param params: The run parameters.
+        :param hashes: The content hashes of the outputs of the stages that already ran.
+        :return: The sha256 hex digest of the stage name, its parameters, versions and dependency hashes.
+        """
+        return output_hash({
+            "stage": stage.name,
+            "parameters": {name: params[name] for name in stage.parameters},
+            "versions": {name: version() for name, version in stage.versions.items()},
+            "dependencies": {name: hashes[name] for name in stage.dependencies},
+        })
+
+    def run(self, params: Dict[str, Any], force: Iterable[str] = ()) -> Dict[str, Any]:
+        """
+        Run the pipeline, reusing every stage output whose inputs did not change. Downstream stages
+        of a recomputed stage are only recomputed if its output actually changed.
+
+        :param params: The run parameters, e.g. the company and the number of keywords.
+        :param force: The names of stages to recompute even if their inputs did not change.
+        :return: A dictionary containing the output of each stage under "outputs" and whether each
+        stage was "cached" or "computed" under "stages".
+        :raise ValueError: If a parameter required by a stage is missing.
+        """
+        missing: List[str] = [name for stage in self.stages.values() for name in stage.parameters if name not in params]
+        if missing:
+            raise ValueError(f"Missing pipeline parameters: {', '.join(sorted(set(missing)))}.")
+        forced: set = set(force)
+        outputs: Dict[str, Any] = {}
+        hashes: Dict[str, str] = {}
+        report: Dict[str, str] = {}
+        for stage in self.stages.values():
+            key: str = self.key(stage = stage, params = params, hashes = hashes)
+            cached: Optional[Tuple[Any, str]] = None if stage.name in forced else self.store.get(key)
+            if cached is None:
+                logging.info(f"Computing stage {stage.name}.")
+                with get_tracer().span(f"stage.{stage.name}", kind = "stage"):
+                    output: Any = stage.func(
+                        **{name: outputs[name] for name in stage.dependencies},
+                        **{name: params[name] for name in stage.parameters},
+                    )
+                if stage.cacheable is None or stage.cacheable(output):
+                    hashes[stage.name] = self.store.put(key = key, stage = stage.name, output = output)
+                else:
+                    logging.info(f"Not storing the output of stage {stage.name}, part of it failed.")
+                    hashes[stage.name] = output_hash(output)
+                outputs[stage.name] = output
+                report[stage.name] = "computed"
+            else:
+                outputs[stage.name], hashes[stage.name] = cached
+                report[stage.name] = "cached"
+        return {"outputs": outputs, "stages": report}
+
+
+def build_risk_pipeline(keyword_generator: KeywordGenerator, news_extractor: NewsExtractor, duplicate_detector: NearDuplicateDetector, text_summarizer: TextSummarizer, news_filter: NewsFilter, risk_analysis: RiskAnalysis, prompt_repository: Optional[PromptRepository] = None, store: Optional[StageStore] = None) -> StageGraph:
+    """
+    Build the risk pipeline graph: keywords, news, summaries, verdicts and analysis. The keyword and
+    analysis stages depend on the version of their prompt, so a prompt revised by the feedback loop
+    invalidates them and everything downstream.
+
+    The graph expects the run parameters company, n, max_articles and max_tokens.
+
+    :return: The stage graph.
+    """
+    prompts: PromptRepository = prompt_repository or get_prompt_repository()
+
+    def keywords(company: str, n: int) -> List[str]:
+        return keyword_generator.get_keywords(company = company, n = n)
+
+    def news(keywords: List[str], max_articles: int) -> List[dict]:
+        representatives, _ = duplicate_detector.deduplicate(news_extractor.get_news(keywords = keywords, max_articles = max_articles))
+        return representatives
+
+    def summaries(news: List[dict], max_tokens: int) -> List[dict]:
+        return [text_summarizer.summarize_article(article = article, max_tokens = max_tokens) for article in news]
+
+    def verdicts(summaries: List[dict], keywords: List[str], company: str, max_tokens: int) -> List[dict]:
+        return news_filter.filter_news(news = summaries, company = company, max_tokens = max_tokens, keywords = keywords)
+
+    def analysis(verdicts: List[dict], company: str) -> Optional[dict]:
+        relevant: List[str] = [result["article"]["body"] for result in verdicts if result["verified"]]
+        if not relevant:
+            return None
+        return risk_analysis.analyse_many(company = company, news = relevant, message_type = "analysis")
+
+    graph: StageGraph = StageGraph(store = store)
+    graph.add(Stage("keywords", keywords, parameters = ["company", "n"], versions = {"prompt": lambda: prompts.version("keyword")}))
+    graph.add(Stage("news", news, dependencies = ["keywords"], parameters = ["max_articles"]))
+    graph.add(Stage("summaries", summaries, dependencies = ["news"], parameters = ["max_tokens"]))
+    graph.add(Stage(
+        "verdicts", verdicts, dependencies = ["summaries", "keywords"], parameters = ["company", "max_tokens"],
+        cacheable = lambda output: not any(result["error"] for result in output),
+    ))
+    graph.add(Stage(
+        "analysis", analysis, dependencies = ["verdicts"], parameters = ["company"], versions = {"prompt": lambda: prompts.version("analysis")},
+        cacheable = lambda output: output is None or not any(article["error"] for article in output["articles"]),
+    ))
+    return graph
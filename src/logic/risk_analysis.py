@@ -2,51 +2,99 @@
 File that contains the logic for risk analysis.
 """
 import logging
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional
 
-from langchain.chat_models import ChatOpenAI
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
-from langchain.agents import Tool
-from langchain import SerpAPIWrapper
-from langchain.utilities import WikipediaAPIWrapper
-from langchain import LLMChain
-from langchain.experimental.plan_and_execute import PlanAndExecute, load_agent_executor, load_chat_planner
-from langchain.agents import Tool, AgentExecutor
-from langchain import SerpAPIWrapper, LLMChain
-from langchain.agents import AgentType, initialize_agent
+from langchain.schema import AgentAction
 from langchain import LLMChain
 
-from src.logic.langchain_tools.tool_process_thought import process_thoughts
-from src.logic.langchain_tools.tool_get_risk_scoring_system import get_risk_scoring_system
-from src.logic.langchain_tools.tool_query_risk_types import ToolSearchRiskTypes
+from src.logic.component_factory import ComponentFactory, get_component_factory
 from src.logic.helper_functionality.text_summarization import TextSummarizer
+from src.logic.helper_functionality.tracing import Tracer, get_tracer, in_context
+
+from db.prompt_repository import PromptRepository, get_prompt_repository
+
+Emit = Callable[[dict], None]
+KEYPOINT_SYSTEM_TEMPLATE: str = """You are a helpful assistant. Your job is to read a news article and return its key point.
+            News: {news}"""
+
+
+def split_items(text: str) -> List[str]:
+    """
+    Split an answer into its items: the entries of a numbered or bulleted list, else its paragraphs.
+
+    :param text: The answer.
+    :return: The items, the whole answer if it has neither.
+    """
+    items: List[str] = [item.strip() for item in re.split(r"^\s*(?:\d+[.)]|[-*\u2022])\s+", text, flags = re.MULTILINE)]
+    if len(items) < 2:
+        items = [item.strip() for item in re.split(r"\n\s*\n", text)]
+    return [item for item in items if item] or [text.strip()]
+
+
+def parse_scores(text: str) -> List[dict]:
+    """
+    Parse the awarded risk scores of a scoring answer, e.g. "the risk score for this risk is 4 x 3 = 12".
+
+    :param text: The answer of the scoring agent.
+    :return: Dictionaries containing the text of each scored risk, its likelihood, impact and score.
+    """
+    pattern: str = r"(\d+)\s*[x\u00d7*]\s*(\d+)\s*=\s*(\d+)"
+    scores: List[dict] = []
+    for item in split_items(text):
+        # an item scoring several risks, like the example answer, is split into its sentences
+        parts: List[str] = [item] if len(re.findall(pattern, item)) < 2 else re.split(r"(?<=[.!?])\s+", item)
+        for part in parts:
+            match: Optional[re.Match] = re.search(pattern, part)
+            if match:
+                likelihood, impact, score = (int(group) for group in match.groups())
+                scores.append({"text": part, "likelihood": likelihood, "impact": impact, "score": score})
+    return scores
+
 
-from src.logic.config import secrets as config_secrets
+class AnalysisEventHandler(BaseCallbackHandler):
+    """
+    Class that forwards the token deltas of streaming LLMs and the tool calls of agents as analysis events.
+    """
+
+    def __init__(self, emit: Emit, stage: str) -> None:
+        self.emit: Emit = emit
+        self.stage: str = stage
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            self.emit({"type": "token", "stage": self.stage, "text": token})
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        self.emit({"type": "step", "stage": self.stage, "tool": action.tool, "input": str(action.tool_input)})
 
-from db.database_connector import DatabaseConnector
 
 class RiskAnalysis():
     """
     Class that contains the logic for risk analysis.
     """
 
-    def __init__(self) -> None:
-        self.text_summarizer: TextSummarizer = TextSummarizer()
+    def __init__(self, components: Optional[ComponentFactory] = None, prompt_repository: Optional[PromptRepository] = None, text_summarizer: Optional[TextSummarizer] = None) -> None:
+        self.components: ComponentFactory = components or get_component_factory()
+        self.prompt_repository: PromptRepository = prompt_repository or get_prompt_repository()
+        self.tracer: Tracer = get_tracer()
+        self.text_summarizer: TextSummarizer = text_summarizer or TextSummarizer()
         self.combined_result: str = ""
 
-    def createDBConnection(self, db_name: str = "risk.db") -> DatabaseConnector:
-        """
-        Open a connection to the database and return a connection object.
-        """
-        db = DatabaseConnector(db_name)
-        db.open()
-        return db
-
-    def analysis(self, company: str, news: str, message_type = None) -> str:
+    def analysis(self, company: str, news: str, message_type = None, emit: Optional[Emit] = None) -> str:
         """
         Perform risk analysis for a given company based on a potential focus and the provided content.
 
         :param company: The name of the company for which risk analysis is to be performed.
         :param news: Text content to be analyzed for potential risks.
+        :param emit: If set, called with an event dictionary as each stage progresses: "token" for each
+        token of the streamed keypoints, "keypoints", "step" for each tool call of the agents, "risk" for
+        each identified risk, "score" for each awarded score and finally "result".
         :return: A string containing the result of the analysis.
         :raise ValueError: If arg company is not a string or if the string is empty.
         :raise ValueError: If arg news is not a string or if the string is empty.
@@ -56,67 +104,11 @@ class RiskAnalysis():
         if not isinstance(news, str) or not news:
             raise ValueError("Argument news must be a non empty string")
         try:
-            search: SerpAPIWrapper = SerpAPIWrapper(serpapi_api_key = config_secrets.read_serpapi_credentials())
-            riskType: ToolSearchRiskTypes = ToolSearchRiskTypes()
-            wikipedia: WikipediaAPIWrapper = WikipediaAPIWrapper()
-            tools_risk_types = [
-                Tool(
-                    name = "Search",
-                    func = search.run,
-                    description = "useful for when you need to answer questions about current events. this tool should not be used to searhc for news articles",
-                ),
-                Tool(
-                    name = "Thought Processing",
-                    func = process_thoughts,
-                    description = """useful for when you have a thought that you want to use in a task, 
-                    but you want to make sure it's formatted correctly"""
-                ),
-                Tool(
-                    name = "Get Risk Type",
-                    func = riskType.run_find_type,
-                    description = """useful when you need to find a specific risk type. the input should be an object of interest 
-                    (e.g. price increases, brand reputation, decrease in user demand, etc.)"""
-                ),
-                Tool(
-                    name = "Get Risk Type Description",
-                    func = riskType.run,
-                    description = """useful when you need detailed information for a specific risk type. the input should be 
-                    the name of the risk type (e.g. market risk)"""
-                ),
-                Tool(
-                    name = "Wikipedia",
-                    func = wikipedia.run,
-                    description = "useful for when you need to detailed information about a topic"
-                )
-            ]
-            tools_risk_scoring_system = [
-                Tool(
-                    name = "Search",
-                    func = search.run,
-                    description = "useful for when you need to answer questions about current events",
-                ),
-                Tool(
-                    name = "Thought Processing",
-                    func = process_thoughts,
-                    description = """useful for when you have a thought that you want to use in a task, 
-                    but you want to make sure it's formatted correctly"""
-                ),
-                Tool(
-                    name = "Get Risk Scoring System",
-                    func = get_risk_scoring_system,
-                    description = """useful when you need information about how to score risks (likelihood and impact)). takes a single input formatted as a question"""
-                )
-            ]
-            system_template = """You are a helpful assistant. Your job is to read a news article and return its key point.
-            News: {news}"""
-            system_message_prompt: SystemMessagePromptTemplate = SystemMessagePromptTemplate.from_template(system_template)
+            system_message_prompt: SystemMessagePromptTemplate = SystemMessagePromptTemplate.from_template(KEYPOINT_SYSTEM_TEMPLATE)
             if(message_type and message_type == "analysis"):
-                db: DatabaseConnector = self.createDBConnection()
-                query = "SELECT message FROM prompts WHERE type = ?"
-                result = db.c.execute(query, (message_type,))
-                row = result.fetchone()
-                if row:
-                    human_template = row[0]
+                prompt: Optional[str] = self.prompt_repository.latest(message_type)
+                if prompt:
+                    human_template = prompt
                 else:
                     human_template = "Please identify the key points of the news article."
             else:
@@ -125,24 +117,21 @@ class RiskAnalysis():
             chat_prompt: ChatPromptTemplate = ChatPromptTemplate.from_messages(
                 [system_message_prompt, human_message_prompt]
             )
-            llm: ChatOpenAI = ChatOpenAI(
-                model="gpt-4",
-                temperature = 0, 
-                client = chat_prompt, 
-                openai_api_key = config_secrets.read_openai_credentials()
-            )
-            keypoint_chain: LLMChain = LLMChain(llm=llm, prompt=chat_prompt)
-            keypoints: str = keypoint_chain.run(news=news)
+            keypoint_chain: LLMChain = LLMChain(llm = self.components.get("streaming_llm" if emit else "llm"), prompt = chat_prompt)
+            with self.tracer.span("keypoint_chain.run", kind = "chain", company = company):
+                keypoints: str = keypoint_chain.run(news=news, callbacks = self._callbacks(emit, "keypoints"))
             logging.info("Done reading article.")
+            if emit:
+                emit({"type": "keypoints", "stage": "keypoints", "text": keypoints})
 
-            model_risk_score: ChatOpenAI = ChatOpenAI(model="gpt-4", temperature=0)
-            planner_risk_score = load_chat_planner(model_risk_score)
-            executor_risk_score = load_agent_executor(model_risk_score, tools_risk_types, verbose=True)
-            agent_risk_score = PlanAndExecute(planner=planner_risk_score, executor=executor_risk_score, verbose=True)
-            risk_analysis: str = agent_risk_score.run("""You are a helpful assistant. Please identify the risks for the 
-            company {company} based on this statement: {keypoints}. Report each identified risk type (max. 3) and support your decision
-            by providing explanations.""".format(company = company, keypoints = keypoints))
+            with self.components.acquire("risk_agent") as agent_risk_score, self.tracer.span("risk_agent.run", kind = "agent", company = company):
+                risk_analysis: str = agent_risk_score.run("""You are a helpful assistant. Please identify the risks for the 
+                company {company} based on this statement: {keypoints}. Report each identified risk type (max. 3) and support your decision
+                by providing explanations.""".format(company = company, keypoints = keypoints), callbacks = self._callbacks(emit, "risks"))
             logging.info("Done risk analysis.")
+            if emit:
+                for index, risk in enumerate(split_items(risk_analysis)):
+                    emit({"type": "risk", "stage": "risks", "index": index, "text": risk})
         
             system_template = "You are a helpful assistant. Your job is to award risk scores to identified risks."
             system_message_prompt: SystemMessagePromptTemplate = SystemMessagePromptTemplate.from_template(system_template)
@@ -166,28 +155,137 @@ class RiskAnalysis():
             chat_prompt: ChatPromptTemplate = ChatPromptTemplate.from_messages(
                 [system_message_prompt, example_message_human, example_message_ai, human_message_prompt]
             )
-            llm: ChatOpenAI = ChatOpenAI(
-                model="gpt-4",
-                temperature = 0, 
-                client = chat_prompt, 
-                openai_api_key = config_secrets.read_openai_credentials(),
-                verbose = True
-            )
-            agent: AgentExecutor = initialize_agent(
-                tools = tools_risk_scoring_system,
-                llm = llm, 
-                agent = AgentType.CHAT_ZERO_SHOT_REACT_DESCRIPTION, 
-                verbose = True
-            )
-            risk_types_severity: str = agent.run(chat_prompt.format_messages(company = company, risk_analysis = risk_analysis))
+            with self.components.acquire("scoring_agent") as agent, self.tracer.span("scoring_agent.run", kind = "agent", company = company):
+                risk_types_severity: str = agent.run(chat_prompt.format_messages(company = company, risk_analysis = risk_analysis), callbacks = self._callbacks(emit, "scores"))
             logging.info("Done awarding risks.")
+            if emit:
+                for index, score in enumerate(parse_scores(risk_types_severity)):
+                    emit({"type": "score", "stage": "scores", "index": index, **score})
 
-            self.combined_result = "Keypoints:\n\n" + keypoints + "\n\n" + "Analysis:\n\n" + risk_analysis + "Risk Types Severity:\n\n" + risk_types_severity
+            combined_result: str = "Keypoints:\n\n" + keypoints + "\n\n" + "Analysis:\n\n" + risk_analysis + "Risk Types Severity:\n\n" + risk_types_severity
+            self.combined_result = combined_result
+            if emit:
+                emit({"type": "result", "stage": "result", "text": combined_result})
         except (ValueError, TypeError) as e:
-            if message_type and message_type == "analysis":
-                db.close()
             logging.error(e)
             raise ValueError(f"Error: {e}") from e
-        if message_type and message_type == "analysis":
-            db.close()
-        return self.combined_result
\ No newline at end of file
+        return combined_result
+
+    def _callbacks(self, emit: Optional[Emit], stage: str) -> List[BaseCallbackHandler]:
+        return self.tracer.callbacks + [AnalysisEventHandler(emit = emit, stage = stage)] if emit else self.tracer.callbacks
+
+    def _analyse_article(self, company: str, news: str, message_type: Optional[str], max_tokens: Optional[int], index: int, emit: Optional[Emit] = None) -> dict:
+        """
+        Summarize a single article if requested and perform the risk analysis on it.
+
+        :return: A dictionary containing the index of the article, the result and an error message if it
+        failed for any reason.
+        """
+        article_emit: Optional[Emit] = (lambda event: emit({**event, "article": index})) if emit else None
+        try:
+            with self.tracer.attributes(company = company, article = index), self.tracer.span("analysis.article", kind = "article"):
+                if max_tokens:
+                    news = self.text_summarizer.summarize_text(raw_text = news, max_tokens = max_tokens)
+                return {"index": index, "result": self.analysis(company = company, news = news, message_type = message_type, emit = article_emit), "error": None}
+        except Exception as e:
+            # e.g. an OpenAI, network or rate limit error, which must not abort the other articles
+            error: str = str(e) or type(e).__name__
+            logging.error(f"Analysis of article {index} failed: {error}")
+            if article_emit:
+                article_emit({"type": "error", "stage": "result", "error": error})
+            return {"index": index, "result": None, "error": error}
+
+    def analyse_many(self, company: str, news: List[str], message_type: Optional[str] = None, max_workers: int = 4, max_tokens: Optional[int] = None, emit: Optional[Emit] = None) -> dict:
+        """
+        Perform the risk analysis for a list of news articles concurrently and merge the results into
+        a company level report.
+
+        :param company: The name of the company for which risk analysis is to be performed.
+        :param news: The text contents to be analyzed for potential risks.
+        :param message_type: The prompt type forwarded to the analysis of each article.
+        :param max_workers: The maximum number of articles analysed at the same time.
+        :param max_tokens: If set, each article is summarized to this number of tokens before the analysis.
+        :param emit: If set, called with the events of the analysis of each article, see analysis, with
+        the index of the article under "article". Failed articles emit an "error" event.
+        :return: A dictionary containing the per article results in input order and the merged report.
+        :raise ValueError: If arg company is not a string or if the string is empty.
+        :raise ValueError: If arg news is not a non-empty list of strings.
+        :raise ValueError: If arg max_workers is not a positive integer.
+        """
+        if not isinstance(company, str) or not company:
+            raise ValueError("Argument company must be a non empty string")
+        if not isinstance(news, List) or not news or not all(isinstance(article, str) and article for article in news):
+            raise ValueError("Argument news must be a non-empty List of non empty strings")
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("Argument max_workers must be a positive integer")
+        with ThreadPoolExecutor(max_workers = min(max_workers, len(news))) as executor:
+            articles: List[dict] = list(executor.map(
+                in_context(lambda item: self._analyse_article(company, item[1], message_type, max_tokens, item[0], emit)), enumerate(news)
+            ))
+        sections: List[str] = [
+            f"Article {article['index'] + 1}:\n\n{article['result']}" for article in articles if article["result"] is not None
+        ]
+        failed: int = sum(1 for article in articles if article["error"] is not None)
+        report: str = f"Risk report for {company} based on {len(sections)} of {len(articles)} articles"
+        report += f" ({failed} failed)" if failed else ""
+        report += ".\n\n" + "\n\n".join(sections)
+        return {"articles": articles, "report": report}
+
+    def _stream(self, run: Callable[[Emit], Any]) -> Iterator[dict]:
+        """
+        Run an analysis on a background thread and yield its events on the calling thread as they are
+        emitted. An exception of the analysis is raised after the events emitted before it.
+
+        :param run: The analysis, called with the function emitting its events.
+        :return: An iterator of the events.
+        """
+        events: queue.Queue = queue.Queue()
+        done: object = object()
+
+        def target() -> None:
+            try:
+                run(events.put)
+            except Exception as e:
+                events.put(e)
+            finally:
+                events.put(done)
+
+        threading.Thread(target = in_context(target), name = "risk-analysis-stream", daemon = True).start()
+        while True:
+            event: Any = events.get()
+            if event is done:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def stream(self, company: str, news: str, message_type: Optional[str] = None) -> Iterator[dict]:
+        """
+        Perform the risk analysis of an article and yield its events as each stage progresses, see analysis.
+        The keypoints are generated by a streaming LLM, so their tokens arrive while they are written.
+        Events are yielded on the calling thread, so they can be rendered directly.
+
+        :param company: The name of the company for which risk analysis is to be performed.
+        :param news: Text content to be analyzed for potential risks.
+        :param message_type: The prompt type of the keypoints.
+        :return: An iterator of event dictionaries containing the type, the stage and the payload of the event.
+        :raise ValueError: If the analysis fails.
+        """
+        return self._stream(lambda emit: self.analysis(company = company, news = news, message_type = message_type, emit = emit))
+
+    def stream_many(self, company: str, news: List[str], message_type: Optional[str] = None, max_workers: int = 4, max_tokens: Optional[int] = None) -> Iterator[dict]:
+        """
+        Perform the risk analysis for a list of news articles concurrently and yield the events of all
+        articles as they happen, each with the index of its article under "article". The last event is
+        a "report" event containing the per article results and the merged report, see analyse_many.
+
+        :return: An iterator of event dictionaries.
+        :raise ValueError: If the arguments are invalid, see analyse_many.
+        """
+        def run(emit: Emit) -> None:
+            result: dict = self.analyse_many(
+                company = company, news = news, message_type = message_type, max_workers = max_workers, max_tokens = max_tokens, emit = emit
+            )
+            emit({"type": "report", "stage": "report", **result})
+
+        return self._stream(run)
@@ -0,0 +1,37 @@
+"""
+Tests for the persistent few-shot example index.
+"""
+import json
+from typing import Dict, List
+
+from langchain.embeddings.base import Embeddings
+
+from src.logic.helper_functionality.example_index import ExampleIndex
+
+
+class SizedEmbeddings(Embeddings):
+    def __init__(self, model: str, size: int) -> None:
+        self.model: str = model
+        self.size: int = size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text) % (index + 2)) + 1.0 for index in range(self.size)]
+
+
+def test_sync_rebuilds_index_for_new_embedding_size(tmp_path):
+    examples: List[Dict[str, str]] = [{"company": "ACME", "keywords": "anvil, rocket"}, {"company": "Initech", "keywords": "software, printer"}]
+    path: str = str(tmp_path / "examples.json")
+    with open(path, "w", encoding = "utf-8") as file:
+        json.dump(examples, file)
+    ExampleIndex(path = path, embeddings = SizedEmbeddings(model = "small", size = 4)).sync()
+    index: ExampleIndex = ExampleIndex(path = path, embeddings = SizedEmbeddings(model = "large", size = 16))
+    index.sync()
+    assert index.store.dimension == 16
+    assert index.store.count() == 2
+    assert index.select("ACME", k = 2)[0] in examples
+    reopened: ExampleIndex = ExampleIndex(path = path, embeddings = SizedEmbeddings(model = "large", size = 16))
+    assert reopened.store.dimension == 16
+    assert reopened.store.count() == 2
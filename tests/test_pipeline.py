@@ -0,0 +1,50 @@
+"""
+Tests for the memoized stage graph of the risk pipeline.
+"""
+from typing import Any, Dict, List
+
+import pytest
+
+from src.logic.pipeline import Stage, StageGraph, StageStore
+from src.logic.helper_functionality.tracing import install_tracer
+
+
+@pytest.fixture(autouse = True)
+def tracer(tmp_path):
+    # keep the stage spans out of the trace file of the app
+    return install_tracer(jsonl_path = str(tmp_path / "traces.jsonl"))
+
+
+def build_graph(store: StageStore, calls: List[str], failing: List[bool]) -> StageGraph:
+    def verdicts(company: str) -> List[dict]:
+        calls.append("verdicts")
+        error: Any = "timeout" if failing.pop(0) else None
+        return [{"index": 0, "verified": error is None, "error": error}]
+
+    def analysis(verdicts: List[dict]) -> int:
+        calls.append("analysis")
+        return sum(1 for result in verdicts if result["verified"])
+
+    graph: StageGraph = StageGraph(store = store)
+    graph.add(Stage("verdicts", verdicts, parameters = ["company"], cacheable = lambda output: not any(result["error"] for result in output)))
+    graph.add(Stage("analysis", analysis, dependencies = ["verdicts"]))
+    return graph
+
+
+def test_failed_verdicts_are_recomputed(tmp_path):
+    calls: List[str] = []
+    graph: StageGraph = build_graph(store = StageStore(db_path = str(tmp_path / "stages.db")), calls = calls, failing = [True, False])
+    first: Dict[str, Any] = graph.run(params = {"company": "ACME"})
+    assert first["outputs"]["analysis"] == 0
+    second: Dict[str, Any] = graph.run(params = {"company": "ACME"})
+    assert second["stages"] == {"verdicts": "computed", "analysis": "computed"}
+    assert second["outputs"]["analysis"] == 1
+    third: Dict[str, Any] = graph.run(params = {"company": "ACME"})
+    assert third["stages"] == {"verdicts": "cached", "analysis": "cached"}
+    assert calls == ["verdicts", "analysis", "verdicts", "analysis"]
+
+
+def test_stage_spans_are_exported_to_the_installed_tracer(tmp_path, tracer):
+    graph: StageGraph = build_graph(store = StageStore(db_path = str(tmp_path / "stages.db")), calls = [], failing = [False])
+    graph.run(params = {"company": "ACME"})
+    assert (tmp_path / "traces.jsonl").read_text(encoding = "utf-8").count("stage.verdicts") == 1
@@ -0,0 +1,62 @@
+"""
+Tests for the vector store backends and the indexation on top of them.
+"""
+import sys
+import types
+from typing import Any, Dict, List
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from src.logic.helper_functionality.document_indexation import Indexer
+from src.logic.helper_functionality.vector_store import PineconeVectorStore
+
+
+class ConstantEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[1.0, 0.0, 0.0] for _ in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [1.0, 0.0, 0.0]
+
+
+class FakeIndex():
+    def __init__(self) -> None:
+        self.vectors: Dict[str, Any] = {}
+
+    def upsert(self, vectors: List[Any], namespace: str = None) -> None:
+        self.vectors.update({id_: (vector, metadata) for id_, vector, metadata in vectors})
+
+    def fetch(self, ids: List[str], namespace: str = None) -> Dict[str, Any]:
+        return {"vectors": {id_: self.vectors[id_] for id_ in ids if id_ in self.vectors}}
+
+
+def fake_pinecone(monkeypatch) -> types.ModuleType:
+    module: types.ModuleType = types.ModuleType("pinecone")
+    module.indexes = {}
+    module.init = lambda **kwargs: None
+    module.list_indexes = lambda: list(module.indexes)
+    module.create_index = lambda name, **kwargs: module.indexes.setdefault(name, FakeIndex())
+    module.Index = lambda name: module.indexes[name]
+    monkeypatch.setitem(sys.modules, "pinecone", module)
+    monkeypatch.setattr(PineconeVectorStore, "_initialized", True)
+    return module
+
+
+def test_pinecone_existing_is_empty_for_missing_index(monkeypatch):
+    pinecone: types.ModuleType = fake_pinecone(monkeypatch)
+    store: PineconeVectorStore = PineconeVectorStore(index_name = "index-risk", namespace = "risk-types")
+    assert store.existing(["a", "b"]) == set()
+    assert pinecone.indexes == {}
+
+
+def test_indexation_creates_new_pinecone_index(monkeypatch):
+    pinecone: types.ModuleType = fake_pinecone(monkeypatch)
+    store: PineconeVectorStore = PineconeVectorStore(index_name = "index-risk", namespace = "risk-types")
+    indexer: Indexer = Indexer(embeddings = ConstantEmbeddings(), store = store)
+    documents: List[Document] = [Document(page_content = "Market risk is the risk of losses from market movements.")]
+    report: Dict[str, int] = indexer.do_indexation(documents = documents, namespace = "risk-types", index_name = "index-risk")
+    assert report == {"chunks": 1, "indexed": 1, "skipped": 0}
+    assert len(pinecone.indexes["index-risk"].vectors) == 1
+    report = indexer.do_indexation(documents = documents, namespace = "risk-types", index_name = "index-risk")
+    assert report == {"chunks": 1, "indexed": 0, "skipped": 1}